@@ -1,13 +1,26 @@
 import logging.config
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 import requests
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from services.db_conn import setup_mongodb, MongoConnection
-from services import stage1, stage2, stage3, reset_dots_stage
+from services.db_conn import setup_mongodb, MongoConnection, close_client
+from services import stage1, stage2, stage3, reset_dots_stage, stage_fused
 from services.get_dots import get_and_store_dot_data
+from services import ui_writer, metrics, pair_logging
+from services.stage_state import stage_states
+from services.telegram_outbox import outbox
+from services.price_refresher import PriceRefresher, refresh_prices
+from services.retention import RetentionRunner
+from services.change_stream_runner import ChangeStreamRunner, ChangeStreamsUnavailable
+from services.migrate_tv_time import backfill_tv_datetime, backfill_ui_datetimes
+from services.pair_registry import pair_registry
+from services.bar_scheduler import BarCloseScheduler
+from services.priority_scheduler import PriorityScheduler
+from services.sharding import coordinator
+from services import read_model, bar_cache
 import schedule
 
 dotenv_path = "./config/.env"
@@ -15,29 +28,47 @@ load_dotenv(dotenv_path=dotenv_path)
 
 class FileChangeHandler(FileSystemEventHandler):
     def on_modified(self, event):
+        self.reload(event.src_path)
+
+    def on_created(self, event):
+        self.reload(event.src_path)
+
+    def on_moved(self, event):
+        # Editors that save through a temp file and rename
+        self.reload(event.dest_path)
+
+    def reload(self, path):
         logger = logging.getLogger('mainLogger')
-        if 'tickers.txt' in event.src_path:
-            logger.info("tickers.txt has been modified, updating tickers...")
-            get_all_tickers_from_file()
-        elif 'dot_tickers.txt' in event.src_path:
-            logger.info("dot_tickers.txt has been modified, updating dot tickers...")
-            get_all_dot_tickers_from_file()
+        kind = pair_registry.kind_for_path(path)
+        if kind is not None:
+            logger.info("%s has been modified, reloading %s pairs", path, kind)
+            pair_registry.reload(kind)
+
+def on_pairs_changed(kind, added, removed):
+    # Only the pairs that changed are warmed up; the next job picks up the new set as a whole
+    logger = logging.getLogger('mainLogger')
+    added = coordinator.filter(added)
+    if kind == "tickers":
+        if added:
+            try:
+                refresh_prices(added)
+            except Exception as e:
+                logger.error(f"Failed to refresh prices for added pairs: {e}")
+        for ticker, time_frame in removed:
+            pair_logging.discard_pair(ticker, time_frame)
+    elif kind == "dots" and added:
+        try:
+            update_dots(added)
+        except Exception as e:
+            logger.error(f"Failed to get dots for added pairs: {e}")
+
+pair_registry.add_listener(on_pairs_changed)
 
 def get_all_tickers_from_file():
-    tickers = []
-    with open('./config/tickers.txt', 'r') as f:
-        for line in f.readlines():
-            ticker, time_frame = line.strip().split(', ')
-            tickers.append({"ticker_symbol": ticker, "time_frame": time_frame})
-    return tickers
+    return [{"ticker_symbol": ticker, "time_frame": time_frame} for ticker, time_frame in pair_registry.pairs()]
 
 def get_all_dot_tickers_from_file():
-    dot_tickers = []
-    with open('./config/dot_tickers.txt', 'r') as f:
-        for line in f.readlines():
-            ticker, time_frame = line.strip().split(', ')
-            dot_tickers.append((ticker, time_frame))
-    return dot_tickers
+    return list(pair_registry.dot_pairs())
 
 def setup_logging():
     default_path = './config/logging_config.ini'
@@ -52,119 +83,69 @@ def setup_logging():
         logging.config.fileConfig(absolute_path)
     else:
         logging.basicConfig(level=default_level)
+    # Queue-backed output, pair fields on every record and the per-pair debug ring buffer
+    pair_logging.install()
     logger = logging.getLogger('mainLogger')
     if not os.path.exists(absolute_path):
         logger.warning(f"Logging config not found at {absolute_path}")
 
 def get_current_stage(ticker, time_frame):
-    with MongoConnection() as mongo_conn:
-        logger = logging.getLogger('mainLogger')
-        logger.info(f"Inside get_current_stage()")
-        ui_collection = mongo_conn.ui_collection
-        record = ui_collection.find_one({"ticker": ticker, "time_frame": time_frame})
-        
-        logger.info(f"Record: {record}")  # This will log the fetched record
-
-        if record:
-            return (
-                record.get('stage', 0), 
-                record.get('start_time'), 
-                record.get('big_green_dot_time'), 
-                record.get('red_dot_time'),
-                record.get('green_dot_time')
-            )
-        else:
-            return 0, None, None, None, None
-
-def update_ui_collection(ticker, time_frame, stage=None, is_red_dot=None, is_green_dot=None, money_flow=None, start_time=None, big_green_dot_time=None, red_dot_time=None, green_dot_time=None, red_dot_value=None, price=None):
     logger = logging.getLogger('mainLogger')
-
-    with MongoConnection() as mongo_conn:
-        ui_collection = mongo_conn.ui_collection
-        
-        update_data = {
-            "stage": stage, 
-            "last_updated": time.time(),
-            "price": price,
-            "start_time": start_time,
-            "big_green_dot_time": big_green_dot_time,
-            "red_dot_time": red_dot_time,
-            "green_dot_time": green_dot_time,
-            "is_red_dot": is_red_dot,
-            "is_green_dot": is_green_dot,
-            "money_flow": money_flow,
-            "red_dot_value": red_dot_value
-        }
+    logger.info("Inside get_current_stage()")
+    # Served from the in-memory stage state table, no database round trip
+    record = stage_states.get(ticker, time_frame)
     
-        # Remove keys with None values
-        update_data = {k: v for k, v in update_data.items() if v is not None}
-        logger.info(f"Update_data: {update_data}")
-        ui_collection.update_one(
-            {"ticker": ticker, "time_frame": time_frame},
-            {"$set": update_data},
-            upsert=True
+    logger.info("Record: %s", record)  # This will log the fetched record
+
+    if record:
+        return (
+            record.get('stage', 0), 
+            record.get('start_time'), 
+            record.get('big_green_dot_time'), 
+            record.get('red_dot_time'),
+            record.get('green_dot_time')
         )
-        if price is not None:
-            logger.info(f"Updated {ticker} price: {price}")
-        
-        logger.info(f"Updated UI collection for {ticker}-{time_frame} to stage {stage}")
-
+    else:
+        return 0, None, None, None, None
 
-def update_ticker_prices():
+def update_ui_collection(ticker, time_frame, stage=None, is_red_dot=None, is_green_dot=None, money_flow=None, start_time=None, big_green_dot_time=None, red_dot_time=None, green_dot_time=None, red_dot_value=None, price=None):
     logger = logging.getLogger('mainLogger')
-    logger.info("Updating ticker prices in ui_collection")
 
-    # Retrieve the list of tickers from MongoDB or a file
-    tickers = get_all_tickers_from_file()
-    
-    processed_tickers = set()  # Set to keep track of processed tickers
+    update_data = {
+        "stage": stage, 
+        "last_updated": time.time(),
+        "price": price,
+        "start_time": start_time,
+        "big_green_dot_time": big_green_dot_time,
+        "red_dot_time": red_dot_time,
+        "green_dot_time": green_dot_time,
+        "is_red_dot": is_red_dot,
+        "is_green_dot": is_green_dot,
+        "money_flow": money_flow,
+        "red_dot_value": red_dot_value
+    }
+
+    # Remove keys with None values
+    update_data = {k: v for k, v in update_data.items() if v is not None}
+    logger.info("Update_data: %s", update_data)
+    # Inside job() the update is merged into the per-job buffer and flushed in bulk
+    ui_writer.write_update(ticker, time_frame, update_data)
+    if price is not None:
+        logger.info("Updated %s price: %s", ticker, price)
+
+    logger.info("Updated UI collection for %s-%s to stage %s", ticker, time_frame, stage)
 
-    for ticker_info in tickers:
-        ticker = ticker_info["ticker_symbol"]
-        if ticker not in processed_tickers:  # Check if the ticker has already been processed
-            try:
-                # Fetch and update the price data in ui_collection
-                fetch_ticker_price(ticker)
-                processed_tickers.add(ticker)  # Add the ticker to the set of processed tickers
-            except Exception as e:
-                logger.error(f"Error updating price for {ticker}: {e}")
 
-
-def fetch_ticker_price(ticker_name):
+def update_ticker_prices():
     logger = logging.getLogger('mainLogger')
-    time_frame = '15'  # Define the 15-minute time frame
-
-    logger.info(f"Fetching latest price for: {ticker_name} with a {time_frame} minute time frame")
+    logger.info("Updating ticker prices in ui_collection")
 
     try:
-        with MongoConnection() as mongo_conn:
-            # Query the market_cipher_b collection for the latest record of the specific ticker and time frame
-            query = {"ticker": ticker_name, "Time Frame": time_frame}
-            # Sorting by "TV Time" in descending order to get the latest record
-            latest_record = mongo_conn.collection.find_one(query, sort=[("TV Time", -1)])
-            
-            if latest_record and 'close' in latest_record:
-                # Convert the 'close' value to float
-                try:
-                    price = float(latest_record['close'])
-                except ValueError:
-                    logger.error(f"Invalid price format for {ticker_name}: {latest_record['close']}")
-                    return None
-
-                logger.info(f"Fetched latest price for {ticker_name}: {price}")
-
-                # Update the ui_collection with the fetched price
-                ui_update = {"$set": {"price": price}}
-                mongo_conn.ui_collection.update_one({"ticker_symbol": ticker_name}, ui_update, upsert=True)
-
-                return price
-            else:
-                logger.warning(f"Latest price data not available for the requested ticker {ticker_name}")
-                return None
+        # One aggregation for all tickers, one bulk write for all of their rows
+        refresh_prices(get_owned_ticker_pairs())
     except Exception as e:
-        logger.error(f"Failed to fetch latest price from MongoDB: {e}")
-        return None
-    
+        logger.error(f"Error updating prices: {e}")
+
 
 # def get_unique_ticker_prices(tickers):
 #     # This will strip 'USDT' only for the purpose of making the API call
@@ -192,26 +173,112 @@ def fetch_ticker_price(ticker_name):
 #         if price is not None:
 #             # Update the collection using the original ticker symbol
 #             update_ui_collection(original_ticker, time_frame, price=price)
-#             logger.info(f"Updated price for {original_ticker} at time frame {time_frame}.")
+#             logger.info("Updated price for %s at time frame %s.", original_ticker, time_frame)
 #         else:
 #             logger.warning(f"No price fetched for ticker: {original_ticker}. Skipping update.")
 
-def job():
+def get_all_ticker_pairs():
+    return list(pair_registry.pairs())
+
+def get_owned_ticker_pairs():
+    # With sharding, only the pairs of tickers this worker holds
+    return coordinator.filter(pair_registry.pairs())
+
+price_refresher = PriceRefresher(get_owned_ticker_pairs)
+
+def on_tickers_acquired(tickers):
+    # Another worker may have moved these pairs on since this process last read them
+    stage_states.load_tickers(tickers)
+    outbox.recover_pending(tickers)
+
+def get_recover_tickers():
+    # With sharding, undelivered alerts are re-queued only for the tickers this worker holds
+    return coordinator.held if coordinator.enabled else None
+
+def get_scheduled_pairs():
+    # Stage pairs and dot pairs, each once
+    return list(dict.fromkeys(pair_registry.pairs() + pair_registry.dot_pairs()))
+
+def get_owned_scheduled_pairs():
+    return coordinator.filter(get_scheduled_pairs())
+
+# Bars no open pattern needs any more move to the archive, a few times a day
+retention_runner = RetentionRunner(get_owned_scheduled_pairs)
+
+def job(pairs=None):
     logger = logging.getLogger('mainLogger')
     
     logger.warning("Starting job function")
 
+    with coordinator.job():
+        if coordinator.enabled:
+            # Other workers run the rest; a pair whose lease is elsewhere is skipped
+            pairs = coordinator.filter(get_scheduled_pairs() if pairs is None else pairs)
+            if not pairs:
+                logger.warning("No pairs leased to this worker")
+                return
+        # Pick up edits made to user_interface outside this process, before any writes are buffered
+        stage_states.reconcile_if_due(tickers=coordinator.held if coordinator.enabled else None)
+        read_model.read_model.sync_if_due()
+        # Typed TV Datetime for bars the alert ingester wrote since the last cycle
+        backfill_tv_datetime()
+        # Each pair's cached bar window fetches its new bars once in this cycle
+        bar_cache.bar_cache.new_cycle()
+
+        timings = metrics.CycleTimings()
+        with metrics.job_seconds.time():
+            with ui_writer.buffered_ui_writes() as ui_buffer:
+                run_job(ui_buffer, pairs, timings)
+
+    if ui_buffer.errors:
+        logger.error(f"UI updates failed for {len(ui_buffer.errors)} pairs: {sorted(ui_buffer.errors)}")
+    timings.summarize()
+    logger.warning("End of job function")
+
+def run_job(ui_buffer, pairs=None, timings=None):
+    logger = logging.getLogger('mainLogger')
+
     dot_tickers = get_all_dot_tickers_from_file()
+    order = None
+    if pairs is not None:
+        # Only the pairs that received new bars (change stream mode) or are due (priority mode)
+        order = {pair: i for i, pair in enumerate(pairs)}
+        pairs = set(pairs)
+        dot_tickers = [pair for pair in dot_tickers if pair in pairs]
     if not dot_tickers:
         logger.warning("No dot tickers found")
 
-    logger.info(f"Found {len(dot_tickers)} dot tickers. Getting current green and red dots for all tickers and timeframes")
+    logger.info("Found %s dot tickers. Getting current green and red dots for all tickers and timeframes", len(dot_tickers))
+    update_dots(dot_tickers)
+
+    # Fetch tickers
+    tickers = get_all_tickers_from_file()
+    if pairs is not None:
+        tickers = [ticker_info for ticker_info in tickers if (ticker_info["ticker_symbol"], ticker_info["time_frame"]) in pairs]
+        if order:
+            # Priority order: run_pairs starts the tickers of the first pairs first
+            tickers.sort(key=lambda ticker_info: order[(ticker_info["ticker_symbol"], ticker_info["time_frame"])])
+
+    # Prices normally refresh on their own faster cadence; refresh here only when that is off
+    if not price_refresher.running:
+        try:
+            refresh_prices([(ticker_info["ticker_symbol"], ticker_info["time_frame"]) for ticker_info in tickers])
+        except Exception as e:
+            logger.error(f"Failed to refresh prices: {e}")
+
+    logger.info("Start loop for tickers")
+    pair_errors = run_pairs(tickers, ui_buffer, timings or metrics.CycleTimings())
+    if pair_errors:
+        logger.error(f"Pipeline failed for {len(pair_errors)} pairs: {pair_errors}")
+
+def update_dots(dot_tickers):
+    logger = logging.getLogger('mainLogger')
     #Get Data for Dots.html
     dot_data_list = get_and_store_dot_data(dot_tickers)
-    logger.info(f"dot_data_list: {dot_data_list}")
+    logger.info("dot_data_list: %s", dot_data_list)
 
     for dot_data in dot_data_list:
-        logger.info(f"{dot_data}")
+        logger.info("%s", dot_data)
         update_ui_collection(
             dot_data["ticker"], 
             dot_data["time_frame"], 
@@ -220,114 +287,152 @@ def job():
             money_flow=dot_data["money_flow"]
         )
 
-    # Fetch tickers
-    tickers = get_all_tickers_from_file()
+def run_pairs(tickers, ui_buffer, timings):
+    logger = logging.getLogger('mainLogger')
+    workers = int(os.getenv("JOB_WORKERS", 1))
 
-    # Step 1: Fetch prices for unique tickers
-    unique_tickers = set(ticker_info["ticker_symbol"] for ticker_info in tickers)
-    ticker_prices = {}
+    # Pairs of one ticker run in the same task, in file order, so no two workers
+    # ever touch the same ticker's user_interface documents at once.
+    pairs_by_ticker = {}
+    for ticker_info in tickers:
+        pairs_by_ticker.setdefault(ticker_info["ticker_symbol"], []).append(ticker_info["time_frame"])
+
+    pair_errors = {}
+    if workers <= 1:
+        for ticker, time_frames in pairs_by_ticker.items():
+            pair_errors.update(process_ticker(ticker, time_frames, ui_buffer, timings))
+        return pair_errors
+
+    logger.info("Running %s pairs over %s tickers with %s workers", len(tickers), len(pairs_by_ticker), workers)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pair") as executor:
+        futures = [executor.submit(process_ticker, ticker, time_frames, ui_buffer, timings) for ticker, time_frames in pairs_by_ticker.items()]
+        for future in as_completed(futures):
+            pair_errors.update(future.result())
+    return pair_errors
+
+def process_ticker(ticker, time_frames, ui_buffer, timings):
+    logger = logging.getLogger('mainLogger')
+    errors = {}
+    for time_frame in time_frames:
+        with pair_logging.pair_context(ticker, time_frame):
+            try:
+                with timings.pair(ticker, time_frame):
+                    process_pair(ticker, time_frame, ui_buffer)
+            except Exception as e:
+                # One broken pair must not stop the others; its recent debug records explain how it got here
+                pair_logging.dump_pair(ticker, time_frame)
+                logger.exception(f"Error processing {ticker}-{time_frame}: {e}")
+                errors[(ticker, time_frame)] = repr(e)
+    return errors
 
-    for ticker in unique_tickers:
-        # Fetch the price for each unique ticker
-        price = fetch_ticker_price(ticker)
-        if price is not None:
-            ticker_prices[ticker] = price
+def process_pair(ticker, time_frame, ui_buffer):
+    logger = logging.getLogger('mainLogger')
+    logger.info("get_all_tickers_from_file - %s-%s", ticker, time_frame)
+
+    current_stage, start_time, big_green_dot_time, red_dot_time, green_dot_time = get_current_stage(ticker, time_frame)
+
+    logger.info("Returned from get_current_state(): %s-%s-%s-%s-%s", current_stage, start_time, big_green_dot_time, red_dot_time, green_dot_time)
+    red_dot_value = None  # Initialize red_dot_value here
+
+    if current_stage == 0:
+        logger.info("main current_stage = %s", current_stage)
+        result = stage1.find_big_green_dot(ticker, time_frame)
+        logger.info("result from stage 0: %s", result)
+        if result and result.get("TV Time"):
+            big_green_dot_time = result["TV Time"]
+            logger.info("Setting stage to 1 from main, big green dot found %s", result)
+            update_ui_collection(ticker, time_frame, 1, big_green_dot_time=big_green_dot_time)
+            current_stage = 1  # Update current_stage for immediate next stage check
+            start_time = big_green_dot_time  # Update start_time for next stages
         else:
-            logger.warning(f"Failed to fetch price for ticker: {ticker}")
-
-    # Step 2: Update UI Collection with fetched prices
-    for ticker_info in tickers:
-        ticker = ticker_info["ticker_symbol"]
-        time_frame = ticker_info["time_frame"]  # Make sure time_frame is retrieved from ticker_info
-
-        # Use the fetched price for this ticker
-        price = ticker_prices.get(ticker)
-        if price is not None:
-            update_ui_collection(ticker, time_frame, price=price)
-            logger.info(f"Updated price for {ticker} at time frame {time_frame}.")
+            logger.info("Setting stage to 0 from main, pattern is broken")
+            update_ui_collection(ticker, time_frame, 0)  # Reset stage to 0 if pattern is broken
+            return  # Skip the rest of this pair as pattern is broken
+
+    if current_stage in (1, 2) and stage_fused.STAGE_FUSED_EVALUATOR:
+        if process_pattern_fused(ticker, time_frame, current_stage, start_time, big_green_dot_time, red_dot_time):
+            return
+
+    if current_stage == 1:
+        logger.info("main current_stage = %s", current_stage)
+        result = stage2.find_red_dot(ticker, time_frame, start_time)
+        logger.info("result from stage 1: %s", result)
+        if result and result["Stage"] != 0:
+            red_dot_time = result["TV Time"]
+            red_dot_value = result["Red Dot Value"]  # Get the red dot value from the result
+            logger.info("Setting stage to 2 from main")
+            update_ui_collection(ticker, time_frame, 2, start_time=start_time, big_green_dot_time=big_green_dot_time, red_dot_time=red_dot_time, red_dot_value=red_dot_value)
+            current_stage = 2  # Update current_stage for immediate next stage check
         else:
-            logger.warning(f"No price fetched for ticker: {ticker}. Skipping update.")
-
-
-
-    logger.info(f"Start loop for tickers")
-    for ticker_info in tickers:
-        logger.info(f"Inside loop ticker_info")
-        ticker = ticker_info["ticker_symbol"]
-        time_frame = ticker_info["time_frame"]
-        logger.info(f"get_all_tickers_from_file - {ticker}-{time_frame}")
-        
-        current_stage, start_time, big_green_dot_time, red_dot_time, green_dot_time = get_current_stage(ticker, time_frame)
-        
-        logger.info(f"Returned from get_current_state(): {current_stage}-{start_time}-{big_green_dot_time}-{red_dot_time}-{green_dot_time}")
-        red_dot_value = None  # Initialize red_dot_value here
-
-        if current_stage == 0:
-            logger.info(f"main current_stage = {current_stage}")
-            result = stage1.find_big_green_dot(ticker, time_frame)
-            logger.info(f"result from stage 0: {result}")
-            if result and result.get("TV Time"):
-                big_green_dot_time = result["TV Time"]
-                logger.info(f"Setting stage to 1 from main, big green dot found {result}")
-                update_ui_collection(ticker, time_frame, 1, big_green_dot_time=big_green_dot_time)
-                current_stage = 1  # Update current_stage for immediate next stage check
-                start_time = big_green_dot_time  # Update start_time for next stages
-            else:
-                logger.info(f"Setting stage to 0 from main, pattern is broken")
-                update_ui_collection(ticker, time_frame, 0)  # Reset stage to 0 if pattern is broken
-                continue  # Skip to next iteration as pattern is broken
-
-        if current_stage == 1:
-            logger.info(f"main current_stage = {current_stage}")
-            result = stage2.find_red_dot(ticker, time_frame, start_time)
-            logger.info(f"result from stage 1: {result}")
-            if result and result["Stage"] != 0:
-                red_dot_time = result["TV Time"]
-                red_dot_value = result["Red Dot Value"]  # Get the red dot value from the result
-                logger.info(f"Setting stage to 2 from main")
-                update_ui_collection(ticker, time_frame, 2, start_time=start_time, big_green_dot_time=big_green_dot_time, red_dot_time=red_dot_time, red_dot_value=red_dot_value)
-                current_stage = 2  # Update current_stage for immediate next stage check
-            else:
-                update_ui_collection(ticker, time_frame, 1)  # Keep stage at 1 if pattern is not broken
-                continue  # Skip to next iteration as pattern is broken
-
-        if current_stage == 2:
-            result = stage2.find_red_dot(ticker, time_frame, start_time)
-            logger.info(f"result from stage 2: {result}")
-            red_dot_value = result["Red Dot Value"]
-            logger.info(f"Inside current_stage == 2, red_dot_value is: {red_dot_value}")
-            logger.info(f"main current_stage = {current_stage}")
-            logger.info(f"Current stage: {current_stage}, Ticker: {ticker}, Time Frame: {time_frame}")
-            logger.info(f"Red Dot Time: {red_dot_time}, Red Dot Value: {red_dot_value}")
-
-            if red_dot_value is not None:
-            #if red_dot_value is None:
-                result = stage3.find_green_dot(ticker, time_frame, red_dot_time, red_dot_value)  # Pass the red dot value here
-                if result:
-                    if result["Stage"] == 0:
-                        update_ui_collection(ticker, time_frame, 0)  # Reset stage to 0 if higher red dot is found
-                        continue  # Skip to next iteration as pattern is broken
-                    else:
-                        green_dot_time = result["TV Time"]
-                        update_ui_collection(ticker, time_frame, 3, start_time=start_time, big_green_dot_time=big_green_dot_time, red_dot_time=red_dot_time, green_dot_time=green_dot_time)
-                        current_stage = 3  # Update current_stage for immediate next stage check
+            update_ui_collection(ticker, time_frame, 1)  # Keep stage at 1 if pattern is not broken
+            return  # Skip the rest of this pair as pattern is broken
+
+    if current_stage == 2:
+        result = stage2.find_red_dot(ticker, time_frame, start_time)
+        logger.info("result from stage 2: %s", result)
+        red_dot_value = result["Red Dot Value"]
+        logger.info("Inside current_stage == 2, red_dot_value is: %s", red_dot_value)
+        logger.info("main current_stage = %s", current_stage)
+        logger.info("Current stage: %s, Ticker: %s, Time Frame: %s", current_stage, ticker, time_frame)
+        logger.info("Red Dot Time: %s, Red Dot Value: %s", red_dot_time, red_dot_value)
+
+        if red_dot_value is not None:
+        #if red_dot_value is None:
+            result = stage3.find_green_dot(ticker, time_frame, red_dot_time, red_dot_value)  # Pass the red dot value here
+            if result:
+                if result["Stage"] == 0:
+                    update_ui_collection(ticker, time_frame, 0)  # Reset stage to 0 if higher red dot is found
+                    return  # Skip the rest of this pair as pattern is broken
                 else:
-                    update_ui_collection(ticker, time_frame, 2)  # Keep stage at 2 if pattern is not broken
-                    continue  # Skip to next iteration as pattern is broken
+                    green_dot_time = result["TV Time"]
+                    update_ui_collection(ticker, time_frame, 3, start_time=start_time, big_green_dot_time=big_green_dot_time, red_dot_time=red_dot_time, green_dot_time=green_dot_time)
+                    current_stage = 3  # Update current_stage for immediate next stage check
             else:
-                logger.info(f"inside last else block of stage 2")
-                # Log an error or take appropriate action since red_dot_value is not available
-                continue
-
-        if current_stage == 3:
-            logger.info(f"main current_stage = {current_stage}")
-            result = reset_dots_stage.reset_dots(ticker, time_frame)
-            logger.info(f"result from stage 3: {result}")
-            if result:
-                update_ui_collection(ticker, time_frame, **result)
-                # No need to continue as the pattern has been reset
-                continue
-    logger.warning("End of job function")
+                update_ui_collection(ticker, time_frame, 2)  # Keep stage at 2 if pattern is not broken
+                return  # Skip the rest of this pair as pattern is broken
+        else:
+            logger.info("inside last else block of stage 2")
+            # Log an error or take appropriate action since red_dot_value is not available
+            return
+
+    if current_stage == 3:
+        logger.info("main current_stage = %s", current_stage)
+        result = reset_dots_stage.reset_dots(ticker, time_frame)
+        logger.info("result from stage 3: %s", result)
+        if result:
+            update_ui_collection(ticker, time_frame, **result)
+            # No need to continue as the pattern has been reset
+            return
+
+def process_pattern_fused(ticker, time_frame, current_stage, start_time, big_green_dot_time, red_dot_time):
+    # Stages 1-3 from one scan, writing the same updates as the stage blocks in process_pair.
+    # Returns False, leaving the pair to those blocks, where their outcome doesn't follow
+    # from the scan: no start time, or a stage 2 record whose red dot the scan doesn't find.
+    logger = logging.getLogger('mainLogger')
+    if start_time is None:
+        return False
+    result = stage_fused.evaluate_pattern(ticker, time_frame, start_time)
+    logger.info("result from the fused evaluator: %s", result)
+
+    if current_stage == 1:
+        if result["red_dot_time"] is None:
+            update_ui_collection(ticker, time_frame, 1)  # Keep stage at 1 if pattern is not broken
+            return True
+        red_dot_time = result["red_dot_time"]
+        update_ui_collection(ticker, time_frame, 2, start_time=start_time, big_green_dot_time=big_green_dot_time, red_dot_time=red_dot_time, red_dot_value=result["red_dot_value"])
+    elif result["red_dot_time"] is None or result["red_dot_time"] != red_dot_time:
+        return False
+
+    if result["outcome"] is None:
+        update_ui_collection(ticker, time_frame, 2)  # Keep stage at 2 if pattern is not broken
+    elif result["outcome"] == "broken":
+        update_ui_collection(ticker, time_frame, 0)  # Reset stage to 0 if higher red dot is found
+    else:
+        update_ui_collection(ticker, time_frame, 3, start_time=start_time, big_green_dot_time=big_green_dot_time, red_dot_time=red_dot_time, green_dot_time=result["green_dot_time"])
+        if result["reset"]:
+            # What reset_dots writes: the None fields are dropped, so only the stage changes
+            update_ui_collection(ticker, time_frame, stage=0, start_time=None, red_dot_time=None, green_dot_time=None, big_green_dot_time=None)
+    return True
 
 def main():
     setup_logging()
@@ -338,12 +443,31 @@ def main():
     else:
         logger.warning('__main__ tvstrats_server version: %s', version)
 
+    # Mongo command counters and the /metrics endpoint
+    metrics.install()
     setup_mongodb()
+    # Resumes where the last run stopped; a no-op once every bar has TV Datetime
+    backfill_tv_datetime()
+    backfill_ui_datetimes()
+    # One query for every pair's stage state; later reads are served from memory
+    stage_states.load()
+    # Dashboard rows kept in memory and served from /snapshot
+    read_model.install()
+    bar_cache.install()
+    # Deliver trade alerts in the background, starting with any left undelivered
+    if coordinator.enabled:
+        # Each worker reloads state and re-queues alerts for the tickers it takes over
+        coordinator.add_acquire_listener(on_tickers_acquired)
+        coordinator.start(lambda: {ticker for ticker, _ in get_scheduled_pairs()})
+    else:
+        outbox.recover_pending()
+    outbox.start(get_recover_tickers)
+    price_refresher.start()
+    retention_runner.start()
+    # Parse both pair files now so later edits are diffed against what is actually running
+    pair_registry.pairs()
+    pair_registry.dot_pairs()
     logger.warning("========================")
-    # Set up the schedule
-    schedule_interval = int(os.getenv("SCHEDULE_INTERVAL", 12))
-    #schedule.every(schedule_interval).seconds.do(job)
-    schedule.every(schedule_interval).minutes.do(job)
     # Set up the file change observer
     event_handler = FileChangeHandler()
     observer = Observer()
@@ -351,12 +475,41 @@ def main():
     observer.start()
 
     try:
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
+        # "change_stream" runs pairs as their bars arrive, "bar_close" runs each pair just after
+        # its bar closes, "priority" runs open patterns every minute and backs quiet pairs off,
+        # "poll" (default) runs every pair on a timer
+        run_mode = os.getenv("RUN_MODE", "poll")
+        if run_mode == "change_stream":
+            try:
+                ChangeStreamRunner(job).run()
+            except ChangeStreamsUnavailable as e:
+                logger.error(f"Change streams are not available ({e}), falling back to polling")
+        elif run_mode == "bar_close":
+            job()
+            BarCloseScheduler(get_scheduled_pairs, job).run()
+        elif run_mode == "priority":
+            PriorityScheduler(get_scheduled_pairs, job).run()
+        run_polling()
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+    price_refresher.stop()
+    retention_runner.stop()
+    coordinator.stop()
+    outbox.stop()
+    metrics.shutdown()
+    read_model.shutdown()
+    close_client()
+    pair_logging.shutdown()
+
+def run_polling():
+    # Set up the schedule
+    schedule_interval = int(os.getenv("SCHEDULE_INTERVAL", 12))
+    #schedule.every(schedule_interval).seconds.do(job)
+    schedule.every(schedule_interval).minutes.do(job)
+    while True:
+        schedule.run_pending()
+        time.sleep(1)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,199 @@
+import argparse
+import csv
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from services.db_conn import MongoConnection
+from services.bars import decode_bar
+from services.bar_archive import find_history
+from services.pair_registry import parse_pairs
+
+logger = logging.getLogger('mainLogger')
+
+# Same thresholds as stage2.find_red_dot and stage3.find_green_dot
+RED_DOT_THRESHOLD = 9
+GREEN_DOT_THRESHOLD = -9
+
+class PairBars:
+    # Column arrays for one pair's bars, sorted by TV Time. Missing values are NaN.
+    __slots__ = ("tv_time", "time", "close", "money_flow", "buy", "crossing_up", "crossing_down")
+
+    def __init__(self, bars):
+        bars = sorted(bars, key=lambda bar: bar.time)
+        self.tv_time = [bar.tv_time for bar in bars]
+        self.time = np.array([bar.time for bar in bars], dtype="datetime64[s]")
+        self.close = np.array([bar.close for bar in bars], dtype=float)
+        self.money_flow = np.array([bar.money_flow for bar in bars], dtype=float)
+        self.buy = np.array([bar.buy for bar in bars], dtype=bool)
+        self.crossing_up = np.array([bar.crossing_up for bar in bars], dtype=float)
+        self.crossing_down = np.array([bar.crossing_down for bar in bars], dtype=float)
+
+    def __len__(self):
+        return len(self.tv_time)
+
+def _last_true(mask):
+    # result[i] = last index <= i where mask is True, or -1
+    return np.maximum.accumulate(np.where(mask, np.arange(len(mask)), -1))
+
+def _next_true(mask):
+    # result[i] = first index >= i where mask is True, or len(mask); one extra slot for i == len(mask)
+    n = len(mask)
+    nxt = np.where(mask, np.arange(n), n)
+    nxt = np.minimum.accumulate(nxt[::-1])[::-1]
+    return np.append(nxt, n)
+
+def run_pair(ticker, time_frame, bars):
+    # Replays the live pipeline as if it ran after every bar:
+    #   stage 0: latest Buy bar becomes the start time (stage1.find_big_green_dot)
+    #   stage 1: first red dot >= 9 after the start (stage2.find_red_dot)
+    #   stage 2: first bar after the red dot with a higher red dot (pattern breaks, back to 0)
+    #            or a green dot <= -9 (trade trigger, stage 3) (stage3.find_green_dot)
+    #   stage 3: back to 0 once reset_dots sees a red dot after the green dot
+    # Pairs stuck in stage 1/2/3 simply produce no further triggers.
+    if not isinstance(bars, PairBars):
+        bars = PairBars(bars)
+    n = len(bars)
+    triggers = []
+    if n == 0:
+        return triggers
+
+    down = bars.crossing_down
+    up = bars.crossing_up
+    with np.errstate(invalid="ignore"):
+        red9 = down >= RED_DOT_THRESHOLD
+        green9 = up <= GREEN_DOT_THRESHOLD
+    red_any = ~np.isnan(down)
+    last_buy = _last_true(bars.buy)
+    next_buy = _next_true(bars.buy)
+    next_red9 = _next_true(red9)
+    next_red_any = _next_true(red_any)
+
+    triggered = set()
+    eval_index = next_buy[0]
+    previous_start = None
+    while eval_index < n:
+        start = last_buy[eval_index]
+        if start == previous_start:
+            # Same big green dot as the pattern that just resolved: it would resolve the same
+            # way on every run, so nothing changes until the next Buy bar arrives
+            eval_index = next_buy[eval_index + 1]
+            if eval_index >= n:
+                break
+            start = last_buy[eval_index]
+        previous_start = start
+
+        red = next_red9[start + 1]
+        if red >= n:
+            break
+        red_value = down[red]
+
+        with np.errstate(invalid="ignore"):
+            after = (down[red + 1:] > red_value) | green9[red + 1:]
+        hits = np.flatnonzero(after)
+        if len(hits) == 0:
+            break
+        resolved = red + 1 + hits[0]
+
+        if down[resolved] > red_value:
+            end = resolved
+        else:
+            if resolved not in triggered:
+                triggered.add(resolved)
+                triggers.append({
+                    "ticker": ticker,
+                    "time_frame": time_frame,
+                    "tv_time": bars.tv_time[resolved],
+                    "big_green_dot_time": bars.tv_time[start],
+                    "red_dot_time": bars.tv_time[red],
+                    "red_dot_value": float(red_value),
+                    "green_dot_value": float(up[resolved]),
+                })
+            reset = next_red_any[resolved + 1]
+            if reset >= n:
+                break
+            end = max(resolved, reset)
+
+        eval_index = end + 1
+    return triggers
+
+def _run_pair_args(args):
+    return run_pair(*args)
+
+def run_backtest(pair_bars, workers=1):
+    # pair_bars: {(ticker, time_frame): [Bar, ...] or PairBars}
+    jobs = [(ticker, time_frame, bars) for (ticker, time_frame), bars in pair_bars.items()]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_run_pair_args, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        results = [_run_pair_args(job) for job in jobs]
+    return [trigger for triggers in results for trigger in triggers]
+
+def load_pairs_from_mongo(pairs, since=None, until=None):
+    pair_bars = {}
+    with MongoConnection() as mongo_conn:
+        for ticker, time_frame in pairs:
+            # Archived months first, then what is still in Mongo
+            bars = find_history(mongo_conn.collection, ticker, time_frame, after=since, until=until)
+            pair_bars[(ticker, time_frame)] = PairBars(bars)
+    return pair_bars
+
+def _read_records(path):
+    # mongoexport output (JSON lines or a JSON array) or a CSV with the collection's field names
+    if path.endswith(".csv"):
+        with open(path, newline="") as f:
+            yield from csv.DictReader(f)
+        return
+    with open(path) as f:
+        first = f.read(1)
+        f.seek(0)
+        if first == "[":
+            yield from json.load(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def load_pairs_from_file(path, pairs=None, since=None, until=None):
+    wanted = set(pairs) if pairs is not None else None
+    grouped = {}
+    for record in _read_records(path):
+        key = (record.get("ticker"), record.get("Time Frame"))
+        if wanted is not None and key not in wanted:
+            continue
+        bar = decode_bar(record)
+        if (since and bar.tv_time <= since) or (until and bar.tv_time > until):
+            continue
+        grouped.setdefault(key, []).append(bar)
+    return {key: PairBars(bars) for key, bars in grouped.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the stage 1-3 strategy over market_cipher_b history")
+    parser.add_argument("--file", help="exported market_cipher_b bars (.jsonl/.json/.csv); reads Mongo when omitted")
+    parser.add_argument("--tickers", default="./config/tickers.txt", help="pairs to replay")
+    parser.add_argument("--since", help="only bars with TV Time after this, e.g. 2024-01-01T00:00:00Z")
+    parser.add_argument("--until", help="only bars with TV Time up to this")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("BACKTEST_WORKERS", 1)))
+    parser.add_argument("--out", help="write triggers to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # The same parser the live runner reads its pair files with
+    pairs = list(parse_pairs(args.tickers))
+    if args.file:
+        pair_bars = load_pairs_from_file(args.file, pairs, args.since, args.until)
+    else:
+        pair_bars = load_pairs_from_mongo(pairs, args.since, args.until)
+    triggers = run_backtest(pair_bars, args.workers)
+    logger.warning(f"{len(triggers)} triggers over {len(pair_bars)} pairs")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(triggers, f, indent=2)
+    else:
+        for trigger in triggers:
+            print(json.dumps(trigger))
+
+if __name__ == "__main__":
+    main()
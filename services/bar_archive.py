@@ -0,0 +1,163 @@
+import argparse
+import json
+import logging
+import os
+import re
+from datetime import datetime
+import numpy as np
+from services.db_conn import MongoConnection
+from services.bars import TV_DATETIME_FIELD, decode_bar, find_bars, parse_tv_time
+
+logger = logging.getLogger('mainLogger')
+
+# Cold storage for market_cipher_b bars moved out of Mongo by services/retention: one
+# compressed NumPy archive per ticker, time frame and month, one column per field.
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./data/archive")
+ARCHIVE_SUFFIX = ".npz"
+# Also kept as columns: _safe() can map two tickers onto one directory, and partitions
+# written before these columns existed get them filled in from the path on their next merge
+PAIR_FIELDS = ("ticker", "Time Frame")
+
+def _safe(name):
+    return re.sub(r"[^A-Za-z0-9._-]", "_", str(name))
+
+def pair_dir(ticker, time_frame, archive_dir=None):
+    return os.path.join(archive_dir or ARCHIVE_DIR, _safe(ticker), _safe(time_frame))
+
+def month_key(value):
+    return value.strftime("%Y-%m")
+
+def partition_path(ticker, time_frame, month, archive_dir=None):
+    return os.path.join(pair_dir(ticker, time_frame, archive_dir), month + ARCHIVE_SUFFIX)
+
+def archived_months(ticker, time_frame, archive_dir=None):
+    directory = pair_dir(ticker, time_frame, archive_dir)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[:-len(ARCHIVE_SUFFIX)] for name in os.listdir(directory) if name.endswith(ARCHIVE_SUFFIX))
+
+def read_partition(path):
+    # {field: column}; TV Datetime is datetime64[ms], every other field a string column
+    with np.load(path, allow_pickle=False) as data:
+        return {field: data[field] for field in data.files}
+
+def _to_columns(docs):
+    fields = sorted({field for doc in docs for field in doc if field not in ("_id", TV_DATETIME_FIELD)})
+    columns = {TV_DATETIME_FIELD: np.array([doc[TV_DATETIME_FIELD] for doc in docs], dtype="datetime64[ms]")}
+    for field in fields:
+        columns[field] = np.array(["" if doc.get(field) is None else str(doc[field]) for doc in docs], dtype=str)
+    return columns
+
+def _pair_mask(columns, ticker, time_frame):
+    # Rows of the partition that belong to the pair
+    mask = np.ones(len(columns[TV_DATETIME_FIELD]), dtype=bool)
+    for field, value in zip(PAIR_FIELDS, (ticker, time_frame)):
+        if field in columns:
+            mask &= columns[field] == str(value)
+    return mask
+
+def _merge(existing, new, ticker, time_frame):
+    # Union of both partitions ordered by time; a bar archived twice (a run that died between
+    # writing the file and deleting from Mongo) keeps the newer copy
+    fields = set(existing) | set(new)
+    count_existing = len(existing[TV_DATETIME_FIELD])
+    count_new = len(new[TV_DATETIME_FIELD])
+    merged = {}
+    for field in fields:
+        old = existing.get(field, np.full(count_existing, "", dtype=str))
+        if field in PAIR_FIELDS and field not in existing:
+            old = np.full(count_existing, str(ticker if field == "ticker" else time_frame))
+        added = new.get(field, np.full(count_new, "", dtype=str))
+        merged[field] = np.concatenate([old, added])
+    times = merged[TV_DATETIME_FIELD]
+    # A bar is the same bar only for the same pair and time
+    keys = np.rec.fromarrays([merged["ticker"], merged["Time Frame"], times], names=["ticker", "time_frame", "time"])
+    # Reversed so np.unique's first occurrence is the last written
+    _, last = np.unique(keys[::-1], return_index=True)
+    keep = np.sort(len(times) - 1 - last)
+    keep = keep[np.argsort(times[keep], kind="stable")]
+    return {field: column[keep] for field, column in merged.items()}
+
+def write_partition(ticker, time_frame, month, docs, archive_dir=None):
+    # Adds the docs to the month's archive file, written to a temp file and renamed into place
+    path = partition_path(ticker, time_frame, month, archive_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    columns = _to_columns(docs)
+    if os.path.exists(path):
+        columns = _merge(read_partition(path), columns, ticker, time_frame)
+    else:
+        order = np.argsort(columns[TV_DATETIME_FIELD], kind="stable")
+        columns = {field: column[order] for field, column in columns.items()}
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        np.savez_compressed(f, **columns)
+    os.replace(temp_path, path)
+    return len(columns[TV_DATETIME_FIELD])
+
+def write_docs(ticker, time_frame, docs, archive_dir=None):
+    # market_cipher_b docs of one pair, split into their month partitions
+    months = {}
+    for doc in docs:
+        months.setdefault(month_key(doc[TV_DATETIME_FIELD]), []).append(doc)
+    for month, month_docs in sorted(months.items()):
+        write_partition(ticker, time_frame, month, month_docs, archive_dir)
+    return sorted(months)
+
+def load_docs(ticker, time_frame, after=None, until=None, archive_dir=None):
+    # Archived bars of a pair as market_cipher_b-shaped docs, oldest first. after/until take a
+    # TV Time string or datetime; after is exclusive and until inclusive, like backtest.
+    after, until = parse_tv_time(after), parse_tv_time(until)
+    docs = []
+    for month in archived_months(ticker, time_frame, archive_dir):
+        if after and month < month_key(after):
+            continue
+        if until and month > month_key(until):
+            continue
+        columns = read_partition(partition_path(ticker, time_frame, month, archive_dir))
+        times = columns[TV_DATETIME_FIELD]
+        mask = _pair_mask(columns, ticker, time_frame)
+        if after:
+            mask &= times > np.datetime64(after, "ms")
+        if until:
+            mask &= times <= np.datetime64(until, "ms")
+        fields = [field for field in columns if field != TV_DATETIME_FIELD and field not in PAIR_FIELDS]
+        for i in np.flatnonzero(mask):
+            doc = {"ticker": ticker, "Time Frame": time_frame, TV_DATETIME_FIELD: times[i].astype(datetime)}
+            for field in fields:
+                value = str(columns[field][i])
+                if value:
+                    doc[field] = value
+            docs.append(doc)
+    return docs
+
+def load_bars(ticker, time_frame, after=None, until=None, archive_dir=None):
+    return [decode_bar(doc) for doc in load_docs(ticker, time_frame, after, until, archive_dir)]
+
+def find_history(collection, ticker, time_frame, after=None, until=None, archive_dir=None):
+    # Archived bars followed by the ones still in Mongo, as one ordered list of Bars. A bar
+    # present in both (archived but not yet deleted) is returned once.
+    archived = load_bars(ticker, time_frame, after, until, archive_dir)
+    extra = {TV_DATETIME_FIELD: {"$lte": parse_tv_time(until)}} if until else None
+    live_after = archived[-1].time if archived else after
+    return archived + list(find_bars(collection, ticker, time_frame, after=live_after, extra=extra))
+
+def main():
+    parser = argparse.ArgumentParser(description="Print archived (and optionally live) market_cipher_b bars of a pair as JSON lines")
+    parser.add_argument("ticker")
+    parser.add_argument("time_frame")
+    parser.add_argument("--since", help="only bars after this TV Time, e.g. 2024-01-01T00:00:00Z")
+    parser.add_argument("--until", help="only bars up to this TV Time")
+    parser.add_argument("--with-live", action="store_true", help="continue with the bars still in Mongo")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    if args.with_live:
+        with MongoConnection() as mongo_conn:
+            bars = find_history(mongo_conn.collection, args.ticker, args.time_frame, args.since, args.until, args.archive_dir)
+    else:
+        bars = load_bars(args.ticker, args.time_frame, args.since, args.until, args.archive_dir)
+    for bar in bars:
+        print(json.dumps(bar._asdict(), default=str))
+
+if __name__ == "__main__":
+    main()
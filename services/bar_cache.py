@@ -0,0 +1,251 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+import numpy as np
+from services import bars
+from services.bars import BAR_PROJECTION, TV_DATETIME_FIELD, Bar, decode_bar, pair_query
+from services.db_conn import CROSSING_DOWN_FILTER, CROSSING_UP_FILTER
+
+logger = logging.getLogger('mainLogger')
+
+BAR_CACHE_ENABLED = os.getenv("BAR_CACHE_ENABLED", "true").lower() == "true"
+# Bars kept per pair; lookups reaching further back go to Mongo
+BAR_CACHE_SIZE = int(os.getenv("BAR_CACHE_SIZE", 500))
+BAR_CACHE_MAX_MB = float(os.getenv("BAR_CACHE_MAX_MB", 256))
+# Each refresh re-reads the bars this close to the newest cached one, so a bar rewritten or
+# inserted late behind it replaces the cached copy (the TV Datetime backfill overlaps the same way)
+BAR_CACHE_REFRESH_OVERLAP_SECONDS = int(os.getenv("BAR_CACHE_REFRESH_OVERLAP_SECONDS", 300))
+# Rough size of one TV Time and one Mny Flow string and their slots, on top of the NumPy columns
+TV_TIME_BYTES = 80
+MONEY_FLOW_TEXT_BYTES = 60
+
+# The extra filters the stages and dots pass to find_bar/find_bars, as column masks
+_EXTRA_MASKS = (
+    ({"Buy": "1"}, lambda window, s: window.buy[s]),
+    (CROSSING_DOWN_FILTER, lambda window, s: ~np.isnan(window.crossing_down[s])),
+    (CROSSING_UP_FILTER, lambda window, s: ~np.isnan(window.crossing_up[s])),
+    ({"$or": [CROSSING_UP_FILTER, CROSSING_DOWN_FILTER]}, lambda window, s: ~np.isnan(window.crossing_up[s]) | ~np.isnan(window.crossing_down[s])),
+)
+
+def _none_if_nan(value):
+    return None if value != value else value
+
+class PairWindow:
+    # The last `size` bars of one pair in column arrays with room for 2 * size, so appends
+    # are a slice assignment and the window only slides (one copy) when the room runs out.
+    def __init__(self, size):
+        self.size = size
+        capacity = 2 * size
+        self.time = np.empty(capacity, dtype="datetime64[ms]")
+        self.tv_time = np.empty(capacity, dtype=object)
+        self.close = np.empty(capacity)
+        self.money_flow = np.empty(capacity)
+        self.buy = np.empty(capacity, dtype=bool)
+        self.crossing_up = np.empty(capacity)
+        self.crossing_down = np.empty(capacity)
+        self.money_flow_text = np.empty(capacity, dtype=object)
+        self.start = 0
+        self.end = 0
+        # True while the window still holds every bar the pair has, so "not found" is an answer
+        self.complete = False
+        self.cycle = None
+        self.lock = threading.Lock()
+
+    @property
+    def columns(self):
+        return (self.time, self.tv_time, self.close, self.money_flow, self.buy, self.crossing_up, self.crossing_down, self.money_flow_text)
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns) + len(self.tv_time) * (TV_TIME_BYTES + MONEY_FLOW_TEXT_BYTES)
+
+    def __len__(self):
+        return self.end - self.start
+
+    def append(self, new_bars):
+        count = len(new_bars)
+        if count == 0:
+            return
+        if count > self.size:
+            new_bars = new_bars[-self.size:]
+            count = self.size
+            self.complete = False
+        if self.end + count > len(self.time):
+            keep = max(0, min(len(self), self.size - count))
+            for column in self.columns:
+                column[:keep] = column[self.end - keep:self.end]
+            if keep < len(self):
+                self.complete = False
+            self.start, self.end = 0, keep
+        s = slice(self.end, self.end + count)
+        self.time[s] = [bar.time for bar in new_bars]
+        self.tv_time[s] = [bar.tv_time for bar in new_bars]
+        self.close[s] = [np.nan if bar.close is None else bar.close for bar in new_bars]
+        self.money_flow[s] = [np.nan if bar.money_flow is None else bar.money_flow for bar in new_bars]
+        self.buy[s] = [bar.buy for bar in new_bars]
+        self.crossing_up[s] = [np.nan if bar.crossing_up is None else bar.crossing_up for bar in new_bars]
+        self.crossing_down[s] = [np.nan if bar.crossing_down is None else bar.crossing_down for bar in new_bars]
+        self.money_flow_text[s] = [bar.money_flow_text for bar in new_bars]
+        self.end += count
+        if len(self) > self.size:
+            self.start = self.end - self.size
+            self.complete = False
+
+    def bar(self, i):
+        return Bar(
+            self.tv_time[i],
+            self.time[i].astype(object),
+            _none_if_nan(float(self.close[i])),
+            _none_if_nan(float(self.money_flow[i])),
+            bool(self.buy[i]),
+            _none_if_nan(float(self.crossing_up[i])),
+            _none_if_nan(float(self.crossing_down[i])),
+            self.money_flow_text[i],
+        )
+
+    def truncate_after(self, since):
+        # Drops the bars later than `since`; the refresh appends them again as read from Mongo
+        since = np.datetime64(since, "ms")
+        self.end = self.start + int(np.searchsorted(self.time[self.start:self.end], since, side="right"))
+
+    def first_index_after(self, after):
+        # Index of the first bar later than `after`, or None when older bars would be needed
+        if after is None:
+            return self.start if self.complete else None
+        after = np.datetime64(after, "ms")
+        if not self.complete and (len(self) == 0 or after < self.time[self.start]):
+            return None
+        return self.start + int(np.searchsorted(self.time[self.start:self.end], after, side="right"))
+
+class BarCache:
+    def __init__(self, size=BAR_CACHE_SIZE, max_bytes=BAR_CACHE_MAX_MB * 1024 * 1024, overlap_seconds=BAR_CACHE_REFRESH_OVERLAP_SECONDS):
+        self.size = size
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self.max_bytes = max_bytes
+        self.windows = OrderedDict()  # (ticker, time_frame) -> PairWindow, least recently used first
+        self.cycle = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def new_cycle(self):
+        # Each window fetches its new bars once per cycle, on first use
+        self.cycle += 1
+
+    def _window(self, collection, ticker, time_frame):
+        key = (ticker, time_frame)
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None:
+                window = self.windows[key] = PairWindow(self.size)
+                self._evict()
+            self.windows.move_to_end(key)
+        with window.lock:
+            if window.cycle != self.cycle:
+                self._refresh(window, collection, ticker, time_frame)
+                window.cycle = self.cycle
+        return window
+
+    def _refresh(self, window, collection, ticker, time_frame):
+        if len(window) == 0:
+            # First load: the newest `size` bars
+            docs = list(collection.find(pair_query(ticker, time_frame), projection=BAR_PROJECTION,
+                                        sort=[(TV_DATETIME_FIELD, -1)], limit=self.size))
+            docs.reverse()
+            window.complete = len(docs) < self.size
+            window.append([decode_bar(doc) for doc in docs])
+            return
+        since = window.time[window.end - 1].astype(object) - self.overlap
+        docs = list(collection.find(pair_query(ticker, time_frame, after=since), projection=BAR_PROJECTION,
+                                    sort=[(TV_DATETIME_FIELD, 1)], limit=self.size + 1))
+        if len(docs) > self.size:
+            # More new bars than the window holds: start over from the newest ones
+            window.start = window.end = 0
+            self._refresh(window, collection, ticker, time_frame)
+            return
+        # Every bar after `since` comes back in this read, so it replaces the cached tail as is
+        window.truncate_after(since)
+        window.append([decode_bar(doc) for doc in docs])
+
+    def _count(self, hit):
+        # Lookups on different pairs run on different threads, each under its own window lock
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _evict(self):
+        # Caller holds the lock; drops least recently used pairs while over the memory cap
+        total = sum(window.nbytes for window in self.windows.values())
+        while total > self.max_bytes and len(self.windows) > 1:
+            _, window = self.windows.popitem(last=False)
+            total -= window.nbytes
+
+    def _mask(self, window, extra, s):
+        if not extra:
+            return None
+        for known, mask in _EXTRA_MASKS:
+            if extra == known:
+                return mask(window, s)
+        return bars.MISS
+
+    def find_bars(self, collection, ticker, time_frame, after=None, extra=None, direction=1, limit=0):
+        # Same results as bars.find_bars, or bars.MISS when the window can't tell
+        window = self._window(collection, ticker, time_frame)
+        with window.lock:
+            first = window.first_index_after(bars.parse_tv_time(after))
+            if first is None:
+                self._count(False)
+                return bars.MISS
+            s = slice(first, window.end)
+            mask = self._mask(window, extra, s)
+            if mask is bars.MISS:
+                self._count(False)
+                return bars.MISS
+            indexes = np.arange(first, window.end) if mask is None else first + np.flatnonzero(mask)
+            if direction < 0:
+                indexes = indexes[::-1]
+            if limit:
+                indexes = indexes[:limit]
+            result = [window.bar(i) for i in indexes]
+        self._count(True)
+        return result
+
+    def find_bar(self, collection, ticker, time_frame, after=None, extra=None, direction=-1):
+        if direction < 0 and after is None:
+            # Latest match: anywhere in the window, or known absent when the window is complete
+            window = self._window(collection, ticker, time_frame)
+            with window.lock:
+                s = slice(window.start, window.end)
+                mask = self._mask(window, extra, s)
+                if mask is bars.MISS:
+                    self._count(False)
+                    return bars.MISS
+                indexes = np.arange(window.start, window.end) if mask is None else window.start + np.flatnonzero(mask)
+                if len(indexes):
+                    self._count(True)
+                    return window.bar(indexes[-1])
+                if window.complete:
+                    self._count(True)
+                    return None
+            self._count(False)
+            return bars.MISS
+        result = self.find_bars(collection, ticker, time_frame, after, extra, direction, limit=1)
+        if result is bars.MISS:
+            return result
+        return result[0] if result else None
+
+    def forget(self, ticker, time_frame):
+        with self.lock:
+            self.windows.pop((ticker, time_frame), None)
+
+bar_cache = BarCache()
+
+def install():
+    # Routes bars.find_bar/find_bars through the cache
+    if BAR_CACHE_ENABLED:
+        bars.set_cache(bar_cache)
+        logger.warning(f"Caching the last {BAR_CACHE_SIZE} bars per pair, up to {BAR_CACHE_MAX_MB:.0f} MB")
@@ -0,0 +1,130 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger('mainLogger')
+
+# Wait this long after a bar closes before evaluating it, so the alert for that bar is in
+SCHEDULE_GRACE_SECONDS = float(os.getenv("SCHEDULE_GRACE_SECONDS", 30))
+# Time frames whose evaluations fall due within this window of each other run as one batch
+SCHEDULE_BATCH_WINDOW_SECONDS = float(os.getenv("SCHEDULE_BATCH_WINDOW_SECONDS", 5))
+# Longest sleep between looks at the pair registry, so new time frames get scheduled
+SCHEDULE_MAX_SLEEP_SECONDS = float(os.getenv("SCHEDULE_MAX_SLEEP_SECONDS", 60))
+
+# Equity tickers whose intraday bars follow the US session, which opens at :30 UTC (9:30 ET)
+SCHEDULE_SESSION_TICKERS = {ticker.strip() for ticker in os.getenv("SCHEDULE_SESSION_TICKERS", "SPY,NVDA,TSLA,FNGU,FNGD,UDOW,SDOW").split(",") if ticker.strip()}
+SCHEDULE_SESSION_OFFSET_MINUTES = int(os.getenv("SCHEDULE_SESSION_OFFSET_MINUTES", 30))
+
+DAY_MINUTES = 24 * 60
+WEEK_MINUTES = 7 * DAY_MINUTES
+# The Unix epoch was a Thursday; weekly bars start on Monday 00:00 UTC
+WEEK_ANCHOR_MINUTES = 4 * DAY_MINUTES
+
+def time_frame_minutes(time_frame):
+    # "15" -> 15, "D" -> 1440, "3D" -> 4320, "W" -> 10080
+    unit = time_frame[-1:]
+    if unit in ("D", "W"):
+        count = int(time_frame[:-1] or 1)
+        return count * (DAY_MINUTES if unit == "D" else WEEK_MINUTES)
+    return int(time_frame)
+
+def session_offset(ticker, time_frame):
+    # Hourly and shorter equity bars close on the :30 session grid; longer session bars are
+    # anchored at the open with a short last bar, which a fixed grid can't follow
+    if ticker in SCHEDULE_SESSION_TICKERS and time_frame_minutes(time_frame) <= 60:
+        return SCHEDULE_SESSION_OFFSET_MINUTES
+    return 0
+
+def last_close(time_frame, at, offset=0):
+    # Latest bar close at or before `at` (UTC datetime), on a grid shifted by `offset` minutes.
+    # Intraday bars start at UTC midnight, so time frames that don't divide a day (77) have a
+    # short last bar, like on TradingView. Day bars count from the epoch, weeks from Monday.
+    minutes = time_frame_minutes(time_frame)
+    shift = timedelta(minutes=offset)
+    at = at - shift
+    if minutes >= DAY_MINUTES:
+        anchor = WEEK_ANCHOR_MINUTES if minutes % WEEK_MINUTES == 0 else 0
+        epoch_minutes = int(at.timestamp() // 60) - anchor
+        return datetime.fromtimestamp((epoch_minutes - epoch_minutes % minutes + anchor) * 60, timezone.utc) + shift
+    midnight = at.replace(hour=0, minute=0, second=0, microsecond=0)
+    elapsed = int((at - midnight).total_seconds() // 60)
+    return midnight + timedelta(minutes=elapsed - elapsed % minutes) + shift
+
+def next_close(time_frame, after, offset=0):
+    # First bar close strictly after `after`
+    minutes = time_frame_minutes(time_frame)
+    shift = timedelta(minutes=offset)
+    close = last_close(time_frame, after, offset)
+    candidate = close + timedelta(minutes=minutes)
+    if minutes < DAY_MINUTES:
+        next_midnight = (close - shift).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1) + shift
+        candidate = min(candidate, next_midnight)
+    return candidate
+
+def schedule_key(pair):
+    # Pairs fire together when they share a time frame and a close grid
+    return pair[1], session_offset(*pair)
+
+def _key_label(key):
+    time_frame, offset = key
+    return f"{time_frame}+{offset}m" if offset else time_frame
+
+class BarCloseScheduler:
+    def __init__(self, get_pairs, run_batch, grace_seconds=SCHEDULE_GRACE_SECONDS, batch_window_seconds=SCHEDULE_BATCH_WINDOW_SECONDS):
+        # get_pairs() returns the current (ticker, time_frame) pairs; run_batch(pairs) evaluates them
+        self.get_pairs = get_pairs
+        self.run_batch = run_batch
+        self.grace = timedelta(seconds=grace_seconds)
+        self.batch_window = timedelta(seconds=batch_window_seconds)
+        self.fired = {}  # (time_frame, offset) -> close of the last bar evaluated
+        self.stopping = threading.Event()
+
+    def due_times(self, now):
+        due = {}
+        for key in {schedule_key(pair) for pair in self.get_pairs()}:
+            if key not in self.fired:
+                # Bars that closed before startup are left to the startup run
+                self.fired[key] = last_close(key[0], now - self.grace, key[1])
+            due[key] = next_close(key[0], self.fired[key], key[1]) + self.grace
+        return due
+
+    def run_once(self, now=None):
+        # Runs every time frame that is due; returns the seconds until the next one is
+        now = now or datetime.now(timezone.utc)
+        due = self.due_times(now)
+        if not due:
+            return SCHEDULE_MAX_SLEEP_SECONDS
+        earliest = min(due.values())
+        if earliest > now:
+            return min((earliest - now).total_seconds(), SCHEDULE_MAX_SLEEP_SECONDS)
+
+        keys = {key for key, due_at in due.items() if due_at <= earliest + self.batch_window}
+        last_due = max(due[key] for key in keys)
+        if last_due > now:
+            # Let the rest of the window's time frames close too, then run them together
+            return (last_due - now).total_seconds()
+        for key in keys:
+            # Closes missed while a batch overran are folded into this one run
+            self.fired[key] = last_close(key[0], now - self.grace, key[1])
+        pairs = [pair for pair in self.get_pairs() if schedule_key(pair) in keys]
+        labels = [_key_label(key) for key in sorted(keys, key=lambda key: (time_frame_minutes(key[0]), key[1]))]
+        logger.warning(f"Bar close batch: {len(pairs)} pairs for time frames {labels}, "
+                       f"{(now - earliest).total_seconds() + self.grace.total_seconds():.0f}s after the close")
+        if pairs:
+            self.run_batch(pairs)
+        return 0.0
+
+    def run(self):
+        logger.warning(f"Evaluating pairs {self.grace.total_seconds():.0f}s after each bar close")
+        while not self.stopping.is_set():
+            try:
+                delay = self.run_once()
+            except Exception as e:
+                logger.exception(f"Bar close scheduler failed: {e}")
+                delay = SCHEDULE_MAX_SLEEP_SECONDS
+            if delay > 0:
+                self.stopping.wait(delay)
+
+    def stop(self):
+        self.stopping.set()
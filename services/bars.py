@@ -0,0 +1,99 @@
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+logger = logging.getLogger('mainLogger')
+
+TV_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# BSON datetime copy of the "TV Time" string, used for every range query and sort
+TV_DATETIME_FIELD = "TV Datetime"
+
+# Only the market_cipher_b fields the stages read; everything else stays on the server
+BAR_FIELDS = ("TV Time", TV_DATETIME_FIELD, "close", "Mny Flow", "Buy", "Blue Wave Crossing UP", "Blue Wave Crossing Down")
+BAR_PROJECTION = dict({field: 1 for field in BAR_FIELDS}, _id=0)
+
+# Compact, decoded view of a market_cipher_b row. tv_time is the original string (trade and
+# UI records are keyed on it), time the datetime. Numeric fields are floats, or None when
+# the alert sent "null"/nothing; buy is True for a big green dot. money_flow_text is the
+# "Mny Flow" string as stored, which the dots copy to user_interface unchanged.
+Bar = namedtuple("Bar", ["tv_time", "time", "close", "money_flow", "buy", "crossing_up", "crossing_down", "money_flow_text"])
+
+# Optional in-process bar window cache (services/bar_cache). It answers what it can and
+# returns MISS for lookups reaching past its window; None sends every lookup to Mongo.
+MISS = object()
+_cache = None
+
+def set_cache(cache):
+    global _cache
+    _cache = cache
+
+def cache_installed():
+    return _cache is not None
+
+def parse_tv_time(value):
+    # "2024-01-01T12:00:00Z" -> naive UTC datetime, the way pymongo returns BSON dates
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.strptime(value, TV_TIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+def to_float(value):
+    if value is None or value == "null" or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        logger.error(f"Invalid numeric value in market_cipher_b record: {value!r}")
+        return None
+
+def decode_bar(doc):
+    return Bar(
+        doc.get("TV Time"),
+        doc.get(TV_DATETIME_FIELD) or parse_tv_time(doc.get("TV Time")),
+        to_float(doc.get("close")),
+        to_float(doc.get("Mny Flow")),
+        doc.get("Buy") == "1",
+        to_float(doc.get("Blue Wave Crossing UP")),
+        to_float(doc.get("Blue Wave Crossing Down")),
+        doc.get("Mny Flow"),
+    )
+
+def pair_query(ticker, time_frame, after=None, extra=None):
+    query = {"ticker": ticker, "Time Frame": time_frame}
+    if after is not None:
+        query[TV_DATETIME_FIELD] = {"$gt": parse_tv_time(after)}
+    if extra:
+        query.update(extra)
+    return query
+
+def find_bars(collection, ticker, time_frame, after=None, extra=None, direction=1, limit=0):
+    if _cache is not None:
+        cached = _cache.find_bars(collection, ticker, time_frame, after, extra, direction, limit)
+        if cached is not MISS:
+            yield from cached
+            return
+    cursor = collection.find(
+        pair_query(ticker, time_frame, after, extra),
+        projection=BAR_PROJECTION,
+        sort=[(TV_DATETIME_FIELD, direction)],
+        limit=limit
+    )
+    for doc in cursor:
+        yield decode_bar(doc)
+
+def find_bar(collection, ticker, time_frame, after=None, extra=None, direction=-1):
+    # Latest bar by default; direction=1 returns the first bar after `after`
+    if _cache is not None:
+        cached = _cache.find_bar(collection, ticker, time_frame, after, extra, direction)
+        if cached is not MISS:
+            return cached
+    doc = collection.find_one(
+        pair_query(ticker, time_frame, after, extra),
+        projection=BAR_PROJECTION,
+        sort=[(TV_DATETIME_FIELD, direction)]
+    )
+    return decode_bar(doc) if doc else None
@@ -0,0 +1,281 @@
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import bson
+from pymongo import monitoring
+from services import db_conn
+from services.db_conn import MongoConnection, setup_mongodb
+
+logger = logging.getLogger('mainLogger')
+
+BENCH_DB_NAME = "tvstrats_bench"
+TV_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+class CommandCounter(monitoring.CommandListener):
+    # Counts Mongo commands and the BSON bytes sent and received, per command name
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.commands = {}
+            self.failed = 0
+            self.bytes_sent = 0
+            self.bytes_received = 0
+
+    def started(self, event):
+        size = len(bson.encode(event.command))
+        with self.lock:
+            self.commands[event.command_name] = self.commands.get(event.command_name, 0) + 1
+            self.bytes_sent += size
+
+    def succeeded(self, event):
+        size = len(bson.encode(event.reply))
+        with self.lock:
+            self.bytes_received += size
+
+    def failed(self, event):
+        with self.lock:
+            self.failed += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "commands": sum(self.commands.values()),
+                "by_command": dict(self.commands),
+                "failed_commands": self.failed,
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+            }
+
+def generate_pair_bars(ticker, time_frame, bars, end_time, active, rng):
+    # A noisy Blue Wave oscillator with crossings against its own moving average, so dots,
+    # money flow and prices look like TradingView alerts. Active pairs get a big green dot
+    # and a red dot planted early, and nothing afterwards that would finish or break the
+    # pattern, so the stage 3 scan covers most of their history every run.
+    minutes = int(time_frame)
+    period = rng.uniform(20, 60)
+    phase = rng.uniform(0, 2 * math.pi)
+    price = rng.uniform(1, 500)
+    money_flow = rng.uniform(-20, 20)
+    signal = 0.0
+    wave = 0.0
+    planted_buy = bars // 3
+    planted_red = planted_buy + 3
+    documents = []
+    for i in range(bars):
+        tv_time = end_time - timedelta(minutes=minutes * (bars - 1 - i))
+        previous_wave, previous_signal = wave, signal
+        wave = 45 * math.sin(2 * math.pi * i / period + phase) + rng.gauss(0, 6)
+        signal = 0.7 * signal + 0.3 * wave
+        price = max(0.01, price * (1 + rng.gauss(0, 0.004)))
+        money_flow = max(-60.0, min(60.0, money_flow + rng.gauss(0, 2)))
+
+        crossing_up = crossing_down = None
+        if i and previous_wave <= previous_signal and wave > signal:
+            crossing_up = wave
+        elif i and previous_wave >= previous_signal and wave < signal:
+            crossing_down = wave
+        buy = not active and crossing_up is not None and crossing_up < -30 and rng.random() < 0.3
+
+        if active:
+            if i == planted_buy:
+                buy = True
+            elif i == planted_red:
+                crossing_up, crossing_down = None, 15.0
+            elif i > planted_red:
+                if crossing_down is not None:
+                    crossing_down = min(crossing_down, 14.5)
+                if crossing_up is not None:
+                    crossing_up = max(crossing_up, -8.5)
+
+        documents.append({
+            "ticker": ticker,
+            "Time Frame": time_frame,
+            "TV Time": tv_time.strftime(TV_TIME_FORMAT),
+            "TV Datetime": tv_time.replace(tzinfo=None),
+            "close": f"{price:.4f}",
+            "Mny Flow": f"{money_flow:.2f}",
+            "Buy": "1" if buy else "0",
+            "Blue Wave Crossing UP": f"{crossing_up:.2f}" if crossing_up is not None else "null",
+            "Blue Wave Crossing Down": f"{crossing_down:.2f}" if crossing_down is not None else "null",
+        })
+    return documents
+
+def generate_pairs(tickers, time_frames):
+    return [(f"SYN{i:04d}USDT", time_frame) for i in range(tickers) for time_frame in time_frames]
+
+def seed_market_data(pairs, bars, active_fraction, seed):
+    rng = random.Random(seed)
+    end_time = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(days=365)
+    active_pairs = set(rng.sample(pairs, int(round(len(pairs) * active_fraction))))
+    with MongoConnection() as mongo_conn:
+        for ticker, time_frame in pairs:
+            documents = generate_pair_bars(ticker, time_frame, bars, end_time, (ticker, time_frame) in active_pairs, rng)
+            mongo_conn.collection.insert_many(documents, ordered=False)
+    return active_pairs
+
+def write_config(directory, pairs):
+    # job() reads its pairs from ./config, so the synthetic pairs get their own config dir
+    config_dir = os.path.join(directory, "config")
+    os.makedirs(config_dir, exist_ok=True)
+    for name in ("tickers.txt", "dot_tickers.txt"):
+        with open(os.path.join(config_dir, name), "w") as f:
+            f.write("\n".join(f"{ticker}, {time_frame}" for ticker, time_frame in pairs) + "\n")
+
+def measure(counter, name, func, results):
+    if counter:
+        counter.reset()
+    started = time.perf_counter()
+    func()
+    wall = time.perf_counter() - started
+    result = {"wall_seconds": round(wall, 4)}
+    if counter:
+        result.update(counter.snapshot())
+    results[name] = result
+    if counter:
+        logger.warning(f"{name}: {wall:.3f}s, {result['commands']} commands, {result['bytes_received']} bytes received")
+    else:
+        logger.warning(f"{name}: {wall:.3f}s")
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+def run(args):
+    import main
+    from services import stage1, stage2, stage3, reset_dots_stage
+    from services.get_dots import get_and_store_dot_data
+    from services.stage_state import stage_states
+    from services import bars
+    from services.bar_cache import bar_cache
+
+    counter = None
+    if args.backend == "mongomock":
+        # In-process stand-in: no server round trips, so command counts aren't available
+        import mongomock
+        db_conn.use_client(mongomock.MongoClient())
+    else:
+        counter = CommandCounter()
+        db_conn.add_event_listener(counter)
+
+    MongoConnection.DB_NAME = args.db
+    with MongoConnection() as mongo_conn:
+        mongo_conn.client.drop_database(args.db)
+    setup_mongodb()
+
+    time_frames = [time_frame.strip() for time_frame in args.time_frames.split(",")]
+    pairs = generate_pairs(args.tickers, time_frames)
+    logger.warning(f"Seeding {len(pairs)} pairs x {args.bars} bars ({args.active_fraction:.0%} mid-pattern)")
+    seed_started = time.perf_counter()
+    seed_market_data(pairs, args.bars, args.active_fraction, args.seed)
+    seed_seconds = time.perf_counter() - seed_started
+
+    # Scenarios below run with or without the per-pair bar window cache
+    bars.set_cache(bar_cache if args.bar_cache else None)
+
+    results = {}
+    previous_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        write_config(workdir, pairs)
+        os.chdir(workdir)
+        try:
+            stage_states.load()
+            measure(counter, "job_cold", main.job, results)
+            measure(counter, "job_warm", main.job, results)
+        finally:
+            os.chdir(previous_cwd)
+
+    measure(counter, "dots_batched", lambda: get_and_store_dot_data(pairs, batched=True), results)
+    measure(counter, "dots_per_pair", lambda: get_and_store_dot_data(pairs, batched=False), results)
+    measure(counter, "stage1_find_big_green_dot", lambda: [stage1.find_big_green_dot(*pair) for pair in pairs], results)
+
+    states = {pair: stage_states.get(*pair) or {} for pair in pairs}
+    in_stage2 = [(pair, state) for pair, state in states.items() if state.get("stage") in (2, 3) and state.get("start_time")]
+    in_stage3 = [pair for pair, state in states.items() if state.get("stage") == 3]
+    measure(counter, "stage2_find_red_dot_rebuild", lambda: [
+        stage2.find_red_dot(*pair, state["start_time"], rebuild=True) for pair, state in in_stage2
+    ], results)
+    measure(counter, "stage3_find_green_dot_rebuild", lambda: [
+        stage3.find_green_dot(*pair, state["red_dot_time"], state["red_dot_value"], rebuild=True)
+        for pair, state in in_stage2 if state.get("red_dot_time") and state.get("red_dot_value") is not None
+    ], results)
+    measure(counter, "reset_dots", lambda: [reset_dots_stage.reset_dots(*pair) for pair in in_stage3], results)
+
+    stage_counts = {}
+    for state in states.values():
+        stage_counts[str(state.get("stage", 0))] = stage_counts.get(str(state.get("stage", 0)), 0) + 1
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).strftime(TV_TIME_FORMAT),
+            "backend": args.backend,
+            "tickers": args.tickers,
+            "time_frames": time_frames,
+            "pairs": len(pairs),
+            "bars_per_pair": args.bars,
+            "active_fraction": args.active_fraction,
+            "seed": args.seed,
+            "bar_cache": args.bar_cache,
+            "seed_seconds": round(seed_seconds, 3),
+        },
+        "stage_counts": stage_counts,
+        "scenarios": results,
+    }
+
+def compare(current, previous):
+    for name, result in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        line = f"{name}: {before['wall_seconds']:.3f}s -> {result['wall_seconds']:.3f}s"
+        if before["wall_seconds"]:
+            line += f" ({result['wall_seconds'] / before['wall_seconds']:.2f}x)"
+        if "commands" in result and "commands" in before:
+            line += f", commands {before['commands']} -> {result['commands']}"
+            line += f", bytes received {before['bytes_received']} -> {result['bytes_received']}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark job() and the stage functions on synthetic market_cipher_b data")
+    parser.add_argument("--backend", choices=("mongod", "mongomock"), default="mongod",
+                        help="mongod uses MONGO_URI / MONGO_* settings; mongomock runs in-process")
+    parser.add_argument("--db", default=BENCH_DB_NAME, help="database to (re)create for the run")
+    parser.add_argument("--tickers", type=int, default=58)
+    parser.add_argument("--time-frames", default="15,30,60,240")
+    parser.add_argument("--bars", type=int, default=500)
+    parser.add_argument("--active-fraction", type=float, default=0.2, help="share of pairs left mid-pattern")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--bar-cache", action="store_true", help="serve bar lookups from the in-process bar cache")
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.db == "market_data":
+        parser.error("refusing to drop the live market_data database; pick another --db")
+
+    results = run(args)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import logging
+import os
+import time
+from pymongo.errors import OperationFailure, PyMongoError
+from services.db_conn import MongoConnection
+
+logger = logging.getLogger('mainLogger')
+
+RESUME_TOKEN_ID = "market_cipher_b_change_stream"
+
+# Error codes meaning change streams can't be used here at all (standalone mongod)
+# or the saved resume token has rolled off the oplog.
+_UNSUPPORTED_CODES = (40573,)
+_HISTORY_LOST_CODES = (260, 280, 286)
+
+class ChangeStreamsUnavailable(Exception):
+    pass
+
+class ChangeStreamRunner:
+    def __init__(self, process_pairs, debounce_seconds=None, max_delay_seconds=None):
+        # process_pairs(pairs) runs the dot/price/stage logic for a set of (ticker, time_frame)
+        # pairs, or for every pair when called with None (catch-up after missed events).
+        self.process_pairs = process_pairs
+        self.debounce_seconds = float(debounce_seconds if debounce_seconds is not None else os.getenv("CHANGE_STREAM_DEBOUNCE_SECONDS", 5))
+        self.max_delay_seconds = float(max_delay_seconds if max_delay_seconds is not None else os.getenv("CHANGE_STREAM_MAX_DELAY_SECONDS", 30))
+        self.retry_seconds = float(os.getenv("CHANGE_STREAM_RETRY_SECONDS", 5))
+        self.pending = {}  # (ticker, time_frame) -> [first seen, last seen]
+        self.saved_token = None
+        self.running = False
+
+    def load_resume_token(self):
+        with MongoConnection() as mongo_conn:
+            record = mongo_conn.db[MongoConnection.RUNNER_STATE_COLLECTION_NAME].find_one({"_id": RESUME_TOKEN_ID})
+        return record.get("resume_token") if record else None
+
+    def save_resume_token(self, token):
+        if token is None or token == self.saved_token:
+            return
+        with MongoConnection() as mongo_conn:
+            mongo_conn.db[MongoConnection.RUNNER_STATE_COLLECTION_NAME].update_one(
+                {"_id": RESUME_TOKEN_ID},
+                {"$set": {"resume_token": token, "updated": time.time()}},
+                upsert=True
+            )
+        self.saved_token = token
+
+    def clear_resume_token(self):
+        with MongoConnection() as mongo_conn:
+            mongo_conn.db[MongoConnection.RUNNER_STATE_COLLECTION_NAME].delete_one({"_id": RESUME_TOKEN_ID})
+        self.saved_token = None
+
+    def add_change(self, change):
+        document = change.get("fullDocument") or {}
+        ticker = document.get("ticker")
+        time_frame = document.get("Time Frame")
+        if ticker is None or time_frame is None:
+            return
+        now = time.monotonic()
+        self.pending.setdefault((ticker, time_frame), [now, now])[1] = now
+
+    def due_pairs(self):
+        # A pair is due once it has been quiet for the debounce window, or has waited the max delay
+        now = time.monotonic()
+        due = [
+            key for key, (first_seen, last_seen) in self.pending.items()
+            if now - last_seen >= self.debounce_seconds or now - first_seen >= self.max_delay_seconds
+        ]
+        for key in due:
+            del self.pending[key]
+        return due
+
+    def run_pairs(self, pairs):
+        try:
+            self.process_pairs(pairs)
+        except Exception as e:
+            logger.exception(f"Change stream processing failed for {'all pairs' if pairs is None else pairs}: {e}")
+
+    def watch(self, resume_token):
+        pipeline = [
+            {"$match": {"operationType": "insert"}},
+            {"$project": {"fullDocument.ticker": 1, "fullDocument.Time Frame": 1, "operationType": 1}},
+        ]
+        with MongoConnection() as mongo_conn:
+            with mongo_conn.collection.watch(pipeline, resume_after=resume_token, max_await_time_ms=1000) as stream:
+                if resume_token is None:
+                    # Nothing to resume from: catch up on every pair once the stream is open
+                    logger.warning("No change stream resume token saved, running a full job to catch up")
+                    self.run_pairs(None)
+                    self.save_resume_token(stream.resume_token)
+                logger.warning("Watching market_cipher_b inserts")
+                while self.running and stream.alive:
+                    change = stream.try_next()
+                    if change is not None:
+                        self.add_change(change)
+                        continue
+                    due = self.due_pairs()
+                    if due:
+                        logger.info(f"Change stream triggered {len(due)} pairs: {due}")
+                        self.run_pairs(due)
+                    if not self.pending:
+                        # Everything up to here is processed; a restart may resume after it
+                        self.save_resume_token(stream.resume_token)
+
+    def run(self):
+        self.running = True
+        while self.running:
+            try:
+                self.watch(self.load_resume_token())
+            except OperationFailure as e:
+                if e.code in _UNSUPPORTED_CODES:
+                    raise ChangeStreamsUnavailable(str(e))
+                if e.code in _HISTORY_LOST_CODES:
+                    logger.error(f"Change stream resume token is no longer valid ({e}), starting over")
+                    self.clear_resume_token()
+                    continue
+                logger.error(f"Change stream failed: {e}, retrying in {self.retry_seconds}s")
+                time.sleep(self.retry_seconds)
+            except PyMongoError as e:
+                logger.error(f"Change stream failed: {e}, retrying in {self.retry_seconds}s")
+                time.sleep(self.retry_seconds)
+
+    def stop(self):
+        self.running = False
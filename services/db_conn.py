@@ -1,15 +1,97 @@
+import atexit
 import logging
 import os
-from pymongo import MongoClient
+import threading
+import time
+from pymongo import MongoClient, ASCENDING
 from dotenv import load_dotenv
 
 load_dotenv(dotenv_path="./config/.env")
 
+# Process-wide client shared by every MongoConnection block. MongoClient owns a
+# thread-safe connection pool, so one instance per process is all we need.
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+# pymongo monitoring listeners attached when the client is created
+_event_listeners = []
+
+def _build_mongo_uri():
+    # A full MONGO_URI wins, e.g. "mongodb://localhost:27017/?replicaSet=rs0" for a local replica set
+    if os.getenv("MONGO_URI"):
+        return os.getenv("MONGO_URI")
+    MONGO_USERNAME = os.getenv("MONGO_USERNAME")
+    MONGO_PASSWORD = os.getenv("MONGO_PASSWORD")
+    MONGO_IP = os.getenv("MONGO_IP")
+    MONGO_PORT = os.getenv("MONGO_PORT", "27017")
+    return f"mongodb://{MONGO_USERNAME}:{MONGO_PASSWORD}@{MONGO_IP}:{MONGO_PORT}/?authMechanism=DEFAULT"
+
+def _client_options():
+    return {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", 50)),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", 0)),
+        "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 300000)),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 10000)),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000)),
+        "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 60000)),
+        "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 30000)),
+    }
+
+def get_client():
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            # A client inherited across fork() shares sockets with the parent and
+            # must never be used (or closed) here, so just drop the reference.
+            options = _client_options()
+            _client = MongoClient(_build_mongo_uri(), event_listeners=list(_event_listeners), **options)
+            _client_pid = pid
+            logging.getLogger('mainLogger').info(f"Created pooled MongoClient for pid {pid} with options {options}")
+        return _client
+
+def close_client():
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+            logging.getLogger('mainLogger').info("Closed pooled MongoClient")
+        _client = None
+        _client_pid = None
+
+def add_event_listener(listener):
+    # Listeners can only be attached to a new client, so an existing one is replaced
+    _event_listeners.append(listener)
+    if _client is not None:
+        close_client()
+
+def use_client(client):
+    # Run against a caller-provided client, e.g. an in-process stand-in for benchmarks
+    global _client, _client_pid
+    with _client_lock:
+        _client = client
+        _client_pid = os.getpid()
+
+def _reset_client_after_fork():
+    global _client, _client_pid, _client_lock
+    _client = None
+    _client_pid = None
+    _client_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_client_after_fork)
+atexit.register(close_client)
+
 class MongoConnection:
-    DB_NAME = "market_data"
+    DB_NAME = os.getenv("MONGO_DB_NAME", "market_data")
     COLLECTION_NAME = "market_cipher_b"
     TRADES_COLLECTION_NAME = "trades"
     UI_COLLECTION_NAME = "user_interface"
+    RUNNER_STATE_COLLECTION_NAME = "runner_state"
+    WORKERS_COLLECTION_NAME = "workers"
+    LEASES_COLLECTION_NAME = "pair_leases"
 
     def __init__(self):
         self.client = None
@@ -19,13 +101,8 @@ class MongoConnection:
         self.ui_collection = None
 
     def __enter__(self):
-        MONGO_USERNAME = os.getenv("MONGO_USERNAME")
-        MONGO_PASSWORD = os.getenv("MONGO_PASSWORD")
-        MONGO_IP = os.getenv("MONGO_IP")
-        MONGO_PORT = "27017"
-        MONGO_URI = f"mongodb://{MONGO_USERNAME}:{MONGO_PASSWORD}@{MONGO_IP}:{MONGO_PORT}/?authMechanism=DEFAULT"
-
-        self.client = MongoClient(MONGO_URI)
+        # Borrow the shared client; connections are checked out of its pool per operation.
+        self.client = get_client()
         self.db = self.client[self.DB_NAME]
         self.collection = self.db[self.COLLECTION_NAME]
         self.trades_collection = self.db[self.TRADES_COLLECTION_NAME]
@@ -33,7 +110,95 @@ class MongoConnection:
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.client.close()
+        # The pooled client outlives this block; use close_client() on shutdown.
+        self.client = None
+
+# Crossing values are numeric strings ("-12.5", "9.3") and sort below "n", while the
+# no-crossing placeholder "null" does not. Queries that add this predicate can use the
+# partial indexes below, which only contain bars that actually have a dot.
+CROSSING_DOWN_FILTER = {"Blue Wave Crossing Down": {"$lt": "n"}}
+CROSSING_UP_FILTER = {"Blue Wave Crossing UP": {"$lt": "n"}}
+
+# collection name -> list of (index name, keys, options)
+INDEX_SPECS = {
+    MongoConnection.COLLECTION_NAME: [
+        # Latest bar / bars after a time for a pair (stage 2, stage 3, money flow, price)
+        ("pair_tv_datetime", [("ticker", ASCENDING), ("Time Frame", ASCENDING), ("TV Datetime", ASCENDING)], {}),
+        # Latest big green dot (stage 1)
+        ("pair_buy_tv_datetime", [("ticker", ASCENDING), ("Time Frame", ASCENDING), ("Buy", ASCENDING), ("TV Datetime", ASCENDING)],
+         {"partialFilterExpression": {"Buy": "1"}}),
+        # Latest / next red dot (reset_dots, dots)
+        ("pair_red_dot_tv_datetime", [("ticker", ASCENDING), ("Time Frame", ASCENDING), ("TV Datetime", ASCENDING), ("Blue Wave Crossing Down", ASCENDING)],
+         {"partialFilterExpression": CROSSING_DOWN_FILTER}),
+        # Latest green dot (dots)
+        ("pair_green_dot_tv_datetime", [("ticker", ASCENDING), ("Time Frame", ASCENDING), ("TV Datetime", ASCENDING), ("Blue Wave Crossing UP", ASCENDING)],
+         {"partialFilterExpression": CROSSING_UP_FILTER}),
+    ],
+    MongoConnection.UI_COLLECTION_NAME: [
+        ("ticker_time_frame", [("ticker", ASCENDING), ("time_frame", ASCENDING)], {}),
+        # Per-ticker price rows (price refresher)
+        ("ticker_symbol", [("ticker_symbol", ASCENDING)], {"partialFilterExpression": {"ticker_symbol": {"$exists": True}}}),
+    ],
+    MongoConnection.TRADES_COLLECTION_NAME: [
+        # One row per trade; claim_trade relies on it when two upserts race
+        ("ticker_time_frame_tv_time", [("Ticker", ASCENDING), ("Time Frame", ASCENDING), ("TV Time", ASCENDING)], {"unique": True}),
+        # Undelivered alerts (outbox recover_pending)
+        ("pending_alerts", [("Message", ASCENDING), ("Ticker", ASCENDING)], {"partialFilterExpression": {"Message": 0}}),
+    ],
+}
+
+# Indexes on the string "TV Time" that queries no longer use since they moved to "TV Datetime"
+RETIRED_INDEXES = {
+    MongoConnection.COLLECTION_NAME: ["pair_tv_time", "pair_buy_tv_time", "pair_red_dot_tv_time", "pair_green_dot_tv_time"],
+}
+
+# Options we compare when checking an existing index against its spec
+_COMPARED_INDEX_OPTIONS = ("unique", "partialFilterExpression", "sparse", "expireAfterSeconds")
+
+def _index_drift(existing, keys, options):
+    differences = []
+    existing_keys = [(field, int(direction)) for field, direction in existing["key"]]
+    if existing_keys != list(keys):
+        differences.append(f"keys {existing_keys} != {keys}")
+    for option in _COMPARED_INDEX_OPTIONS:
+        if existing.get(option) != options.get(option):
+            differences.append(f"{option} {existing.get(option)} != {options.get(option)}")
+    return differences
+
+def setup_indexes(db):
+    rebuild_drifted = os.getenv("MONGO_REBUILD_DRIFTED_INDEXES", "false").lower() == "true"
+    total = sum(len(specs) for specs in INDEX_SPECS.values())
+    setup_start = time.monotonic()
+    done = 0
+    for collection_name, specs in INDEX_SPECS.items():
+        collection = db[collection_name]
+        existing_indexes = collection.index_information()
+        for name in RETIRED_INDEXES.get(collection_name, []):
+            if name in existing_indexes:
+                logging.warning(f"Dropping retired index {collection_name}.{name}.")
+                collection.drop_index(name)
+        for name, keys, options in specs:
+            done += 1
+            existing = existing_indexes.get(name)
+            if existing:
+                drift = _index_drift(existing, keys, options)
+                if not drift:
+                    logging.warning(f"[{done}/{total}] Index {collection_name}.{name} verified.")
+                    continue
+                if not rebuild_drifted:
+                    logging.warning(f"[{done}/{total}] Index {collection_name}.{name} differs from its spec: {'; '.join(drift)}. "
+                                    f"Set MONGO_REBUILD_DRIFTED_INDEXES=true to rebuild it.")
+                    continue
+                logging.warning(f"[{done}/{total}] Dropping drifted index {collection_name}.{name}: {'; '.join(drift)}")
+                collection.drop_index(name)
+            logging.warning(f"[{done}/{total}] Building index {collection_name}.{name} on {keys}...")
+            build_start = time.monotonic()
+            try:
+                collection.create_index(keys, name=name, **options)
+                logging.warning(f"[{done}/{total}] Index {collection_name}.{name} built in {time.monotonic() - build_start:.2f}s.")
+            except Exception as e:
+                logging.error(f"[{done}/{total}] Failed to build index {collection_name}.{name}: {e}")
+    logging.warning(f"Index setup for {total} indexes finished in {time.monotonic() - setup_start:.2f}s.")
 
 def setup_mongodb():
     logging.warning("Setting up MongoDB...")
@@ -46,6 +211,7 @@ def setup_mongodb():
                     logging.warning(f"Collection {collection_name} created.")
                 else:
                     logging.warning(f"Collection {collection_name} already exists.")
+            setup_indexes(db)
             logging.warning("MongoDB setup completed successfully.")
     except Exception as e:
         logging.error(f"Error setting up MongoDB: {e}")
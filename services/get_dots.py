@@ -1,9 +1,27 @@
 import logging
-from services.db_conn import MongoConnection
+import os
+import threading
+from datetime import datetime, timedelta
+from services.db_conn import MongoConnection, CROSSING_DOWN_FILTER, CROSSING_UP_FILTER
+from services.bar_scheduler import time_frame_minutes
+from services.bars import find_bar, decode_bar, cache_installed, pair_query, BAR_PROJECTION, TV_DATETIME_FIELD
+from services.metrics import timed
 
 logger = logging.getLogger('mainLogger')
 
-def get_and_store_dot_data(dot_tickers):
+# Pairs per batched query; keeps the $or list to a reasonable size.
+DOT_SCAN_CHUNK_SIZE = int(os.getenv("DOT_SCAN_CHUNK_SIZE", 100))
+DOT_SCAN_BATCHED = os.getenv("DOT_SCAN_BATCHED", "true").lower() == "true"
+# How far back, in bars of the pair's time frame, the batched scan looks for a pair it hasn't seen
+DOT_SCAN_SEED_BARS = int(os.getenv("DOT_SCAN_SEED_BARS", 100))
+
+@timed("dots")
+def get_and_store_dot_data(dot_tickers, batched=None):
+    if batched is None:
+        # With the bar cache the per-pair lookups are served from memory
+        batched = DOT_SCAN_BATCHED and not cache_installed()
+    if batched:
+        return get_dot_data_batched(dot_tickers)
     logger.info("Entering get_and_store_dot_data function")
     dot_data_list = []
     for ticker, time_frame in dot_tickers:
@@ -12,49 +30,132 @@ def get_and_store_dot_data(dot_tickers):
                 mc_collection = mongo_conn.collection
 
                 # Fetch the most recent "Mny Flow" for each ticker and time frame
-                money_flow_record = mc_collection.find_one(
-                    {"Time Frame": time_frame, "ticker": ticker}, 
-                    sort=[('TV Time', -1)]
-                )
-                money_flow = money_flow_record['Mny Flow'] if money_flow_record and 'Mny Flow' in money_flow_record else None
-                logger.info(f"money_flow_record: {money_flow_record}")
-
-                # Find the most recent record with a non-"null" Blue Wave Crossing UP or Down
-                record = mc_collection.find_one(
-                    {
-                        "Time Frame": time_frame, 
-                        "ticker": ticker, 
-                        "$or": [
-                            {"Blue Wave Crossing UP": {"$ne": "null"}},
-                            {"Blue Wave Crossing Down": {"$ne": "null"}}
-                        ]
-                    },
-                    sort=[('TV Time', -1)]
+                money_flow_bar = find_bar(mc_collection, ticker, time_frame)
+                logger.info("money_flow_bar: %s", money_flow_bar)
+
+                # Find the most recent bar with a Blue Wave Crossing UP or Down
+                dot_bar = find_bar(
+                    mc_collection,
+                    ticker,
+                    time_frame,
+                    extra={"$or": [CROSSING_UP_FILTER, CROSSING_DOWN_FILTER]}
                 )
 
-                # Determine dot color
-                is_red_dot = is_green_dot = "FALSE"
-                if record and record['Blue Wave Crossing UP'] != "null":
-                    is_green_dot = "TRUE"
-                elif record and record['Blue Wave Crossing Down'] != "null":
-                    is_red_dot = "TRUE"
-
-                # If no dot record found, log and create a default dot_data with Money Flow
-                if not record:
-                    logger.info(f"No dot found for {ticker}-{time_frame}")
-                    is_red_dot = is_green_dot = "FALSE"
-
-                dot_data = {
-                    "ticker": ticker,
-                    "time_frame": time_frame,
-                    "is_red_dot": is_red_dot,
-                    "is_green_dot": is_green_dot,
-                    "money_flow": money_flow
-                }
+                dot_data = build_dot_data(ticker, time_frame, money_flow_bar, dot_bar)
                 dot_data_list.append(dot_data)
-                logger.info(f"Collected data for {ticker}-{time_frame}")
+                logger.info("Collected data for %s-%s", ticker, time_frame)
 
         except Exception as e:
             logger.error(f"Error collecting data for {ticker}-{time_frame}: {e}")
             
     return dot_data_list
+
+
+def build_dot_data(ticker, time_frame, money_flow_bar, dot_bar):
+    # Determine dot color
+    is_red_dot = is_green_dot = "FALSE"
+    if dot_bar and dot_bar.crossing_up is not None:
+        is_green_dot = "TRUE"
+    elif dot_bar and dot_bar.crossing_down is not None:
+        is_red_dot = "TRUE"
+
+    # If no dot bar found, log and create a default dot_data with Money Flow
+    if not dot_bar:
+        logger.info("No dot found for %s-%s", ticker, time_frame)
+
+    return {
+        "ticker": ticker,
+        "time_frame": time_frame,
+        "is_red_dot": is_red_dot,
+        "is_green_dot": is_green_dot,
+        # The alert's string, as user_interface has always stored it
+        "money_flow": money_flow_bar.money_flow_text if money_flow_bar else None
+    }
+
+DOT_FIELDS = ("Blue Wave Crossing UP", "Blue Wave Crossing Down")
+# BAR_PROJECTION plus the pair, so one query can serve a whole chunk
+PAIR_BAR_PROJECTION = dict(BAR_PROJECTION, ticker=1, **{"Time Frame": 1})
+
+# Latest bar and latest dot bar of each pair the batched scan covers, by (ticker, time_frame).
+# Every chunk is one query: bars since the latest one seen for known pairs, the last
+# DOT_SCAN_SEED_BARS bars for new ones, so a cycle costs what arrived rather than the history.
+_latest_bars = {}
+_latest_dots = {}
+_latest_lock = threading.Lock()
+
+def is_dot(doc):
+    # Same test as CROSSING_UP_FILTER / CROSSING_DOWN_FILTER: a string sorting before "null"
+    return any(isinstance(doc.get(field), str) and doc[field] < "n" for field in DOT_FIELDS)
+
+def seed_since(time_frame, now=None):
+    return (now or datetime.utcnow()) - timedelta(minutes=time_frame_minutes(time_frame) * DOT_SCAN_SEED_BARS)
+
+def bars_since_query(pairs, now=None):
+    # $gte re-reads each pair's latest bar, so a bar rewritten after the last scan is picked up.
+    # A known pair without any bar has no history to re-read and gets no time bound.
+    branches = []
+    for ticker, time_frame in pairs:
+        if (ticker, time_frame) not in _latest_bars:
+            branches.append(pair_query(ticker, time_frame, after=seed_since(time_frame, now)))
+        elif _latest_bars[(ticker, time_frame)] is None:
+            branches.append(pair_query(ticker, time_frame))
+        else:
+            since = _latest_bars[(ticker, time_frame)].time
+            branches.append(pair_query(ticker, time_frame, extra={TV_DATETIME_FIELD: {"$gte": since}}))
+    return {"$or": branches}
+
+def _scan_new_bars(mc_collection, pairs):
+    new_pairs = [pair for pair in pairs if pair not in _latest_bars]
+    for doc in mc_collection.find(bars_since_query(pairs), projection=PAIR_BAR_PROJECTION):
+        pair = (doc["ticker"], doc["Time Frame"])
+        bar = decode_bar(doc)
+        latest = _latest_bars.get(pair)
+        if latest is None or bar.time >= latest.time:
+            _latest_bars[pair] = bar
+        if is_dot(doc):
+            latest_dot = _latest_dots.get(pair)
+            if latest_dot is None or bar.time >= latest_dot.time:
+                _latest_dots[pair] = bar
+    for ticker, time_frame in new_pairs:
+        # Quiet for longer than the seed window: the same bounded lookups as the per-pair path
+        if (ticker, time_frame) not in _latest_bars:
+            _latest_bars[(ticker, time_frame)] = find_bar(mc_collection, ticker, time_frame)
+        if (ticker, time_frame) not in _latest_dots:
+            _latest_dots[(ticker, time_frame)] = find_bar(mc_collection, ticker, time_frame, extra={"$or": [CROSSING_UP_FILTER, CROSSING_DOWN_FILTER]})
+
+def _forget_other_pairs(pairs):
+    # Pairs dropped from the dot list (or now held by another worker) leave the tables
+    current = set(pairs)
+    for table in (_latest_bars, _latest_dots):
+        for pair in [pair for pair in table if pair not in current]:
+            del table[pair]
+
+def get_dot_data_batched(dot_tickers):
+    logger.info("Entering get_dot_data_batched function")
+    pairs = list(dict.fromkeys((ticker, time_frame) for ticker, time_frame in dot_tickers))
+    failed = set()
+    with _latest_lock, MongoConnection() as mongo_conn:
+        mc_collection = mongo_conn.collection
+        _forget_other_pairs(pairs)
+        for i in range(0, len(pairs), DOT_SCAN_CHUNK_SIZE):
+            chunk = pairs[i:i + DOT_SCAN_CHUNK_SIZE]
+            new_pairs = [pair for pair in chunk if pair not in _latest_bars]
+            try:
+                _scan_new_bars(mc_collection, chunk)
+            except Exception as e:
+                logger.error(f"Error collecting batched dot data for {len(chunk)} pairs starting at {chunk[0]}: {e}")
+                # Leave failed pairs out, like the per-pair scan does; new ones start over next cycle
+                failed.update(chunk)
+                for pair in new_pairs:
+                    _latest_bars.pop(pair, None)
+                    _latest_dots.pop(pair, None)
+        latest = {pair: (_latest_bars.get(pair), _latest_dots.get(pair)) for pair in pairs}
+
+    dot_data_list = []
+    for ticker, time_frame in dot_tickers:
+        if (ticker, time_frame) in failed:
+            continue
+        money_flow_bar, dot_bar = latest[(ticker, time_frame)]
+        dot_data_list.append(build_dot_data(ticker, time_frame, money_flow_bar, dot_bar))
+    logger.info("Collected batched dot data for %s pairs", len(dot_data_list))
+    return dot_data_list
@@ -0,0 +1,202 @@
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pymongo import monitoring
+from services import db_conn
+
+logger = logging.getLogger('mainLogger')
+
+# Loopback only unless set explicitly, e.g. METRICS_HOST=0.0.0.0 for a Prometheus in another container
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))  # 0 disables the /metrics endpoint
+METRICS_SLOWEST_PAIRS = int(os.getenv("METRICS_SLOWEST_PAIRS", 5))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}  # sorted label tuple -> value
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+class Gauge(Counter):
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.values = {}  # sorted label tuple -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, series in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {series[-1]}")
+        return lines
+
+job_seconds = Histogram("tvstrats_job_seconds", "Duration of one job() cycle")
+stage_call_seconds = Histogram("tvstrats_stage_call_seconds", "Duration of stage, dot and price calls")
+pair_seconds = Histogram("tvstrats_pair_seconds", "Duration of one pair through the stage pipeline")
+mongo_commands = Counter("tvstrats_mongo_commands_total", "Mongo commands sent, by command name")
+mongo_command_failures = Counter("tvstrats_mongo_command_failures_total", "Mongo commands that failed, by command name")
+mongo_documents = Counter("tvstrats_mongo_documents_returned_total", "Documents returned by find/aggregate cursors, by command name")
+telegram_sends = Counter("tvstrats_telegram_sends_total", "Telegram sendMessage calls, by result")
+slowest_pairs = Gauge("tvstrats_slowest_pair_seconds", "Slowest pairs of the last job() cycle")
+priority_pairs = Gauge("tvstrats_priority_pairs", "Scheduled pairs by priority class")
+priority_cycle_pairs = Gauge("tvstrats_priority_cycle_pairs", "Pairs evaluated in the last priority cycle, by priority class")
+priority_budget = Gauge("tvstrats_priority_budget_pairs", "Pairs a priority cycle may evaluate besides the hot ones (0 is unlimited)")
+priority_backlog = Gauge("tvstrats_priority_backlog_pairs", "Due pairs the last priority cycle left for the next one")
+
+REGISTRY = [job_seconds, stage_call_seconds, pair_seconds, mongo_commands, mongo_command_failures,
+            mongo_documents, telegram_sends, slowest_pairs, priority_pairs, priority_cycle_pairs,
+            priority_budget, priority_backlog]
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def timed(stage):
+    # Decorator recording each call of a stage function in stage_call_seconds
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_call_seconds.time(stage=stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def started(self, event):
+        mongo_commands.inc(command=event.command_name)
+
+    def succeeded(self, event):
+        cursor = event.reply.get("cursor") if hasattr(event.reply, "get") else None
+        if cursor:
+            batch = cursor.get("firstBatch", cursor.get("nextBatch")) or []
+            mongo_documents.inc(len(batch), command=event.command_name)
+
+    def failed(self, event):
+        mongo_command_failures.inc(command=event.command_name)
+
+class CycleTimings:
+    # Per-pair durations of one job() cycle, for the slowest-pairs summary
+    def __init__(self):
+        self.durations = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def pair(self, ticker, time_frame):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            pair_seconds.observe(duration)
+            with self.lock:
+                self.durations[(ticker, time_frame)] = duration
+
+    def summarize(self, limit=METRICS_SLOWEST_PAIRS):
+        with self.lock:
+            slowest = sorted(self.durations.items(), key=lambda item: item[1], reverse=True)[:limit]
+        slowest_pairs.clear()
+        for (ticker, time_frame), duration in slowest:
+            slowest_pairs.set(round(duration, 4), ticker=ticker, time_frame=time_frame)
+        if slowest:
+            summary = ", ".join(f"{ticker}-{time_frame} {duration:.3f}s" for (ticker, time_frame), duration in slowest)
+            logger.warning(f"Slowest pairs this cycle: {summary}")
+        return slowest
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_server = None
+
+def install(host=METRICS_HOST, port=METRICS_PORT):
+    # Hooks the Mongo command listener into the shared client and serves /metrics
+    global _server
+    db_conn.add_event_listener(MongoCommandMetrics())
+    if port and _server is None:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+        logger.warning(f"Serving metrics on http://{host}:{port}/metrics")
+
+def shutdown():
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server = None
@@ -0,0 +1,114 @@
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+from services.db_conn import MongoConnection
+from services.bars import TV_DATETIME_FIELD, parse_tv_time
+
+logger = logging.getLogger('mainLogger')
+
+# user_interface string time fields and the BSON datetime stored next to each
+UI_TIME_FIELDS = {
+    "start_time": "start_datetime",
+    "big_green_dot_time": "big_green_dot_datetime",
+    "red_dot_time": "red_dot_datetime",
+    "green_dot_time": "green_dot_datetime",
+}
+
+BACKFILL_STATE_ID = "tv_datetime_backfill"
+BACKFILL_BATCH_SIZE = int(os.getenv("TV_DATETIME_BACKFILL_BATCH_SIZE", 1000))
+# Each run restarts this far behind the checkpoint, for bars whose client-made _id sorts
+# slightly before ids that were already migrated
+BACKFILL_OVERLAP_SECONDS = int(os.getenv("TV_DATETIME_BACKFILL_OVERLAP_SECONDS", 300))
+
+_backfill_lock = threading.Lock()
+
+def ui_datetime_fields(update_data):
+    # Typed siblings for the string times in a user_interface $set
+    return {UI_TIME_FIELDS[field]: parse_tv_time(value) for field, value in update_data.items() if field in UI_TIME_FIELDS and value}
+
+def _load_checkpoint(db):
+    record = db[MongoConnection.RUNNER_STATE_COLLECTION_NAME].find_one({"_id": BACKFILL_STATE_ID})
+    return record.get("last_id") if record else None
+
+def _save_checkpoint(db, last_id, migrated):
+    db[MongoConnection.RUNNER_STATE_COLLECTION_NAME].update_one(
+        {"_id": BACKFILL_STATE_ID},
+        {"$set": {"last_id": last_id, "updated": time.time()}, "$inc": {"migrated": migrated}},
+        upsert=True
+    )
+
+def backfill_tv_datetime(batch_size=BACKFILL_BATCH_SIZE, max_batches=None, restart=False):
+    # Resumable, batched: walks market_cipher_b in _id order from the saved checkpoint and
+    # sets "TV Datetime" on bars that don't have it yet. Runs to completion at startup and
+    # then incrementally, so bars inserted by the alert ingester get the field within a cycle.
+    with _backfill_lock, MongoConnection() as mongo_conn:
+        db = mongo_conn.db
+        collection = mongo_conn.collection
+        last_id = None if restart else _load_checkpoint(db)
+        query = {TV_DATETIME_FIELD: {"$exists": False}}
+        if last_id is not None:
+            resume_from = ObjectId.from_datetime(last_id.generation_time - timedelta(seconds=BACKFILL_OVERLAP_SECONDS))
+            query["_id"] = {"$gt": resume_from}
+
+        started = time.monotonic()
+        migrated = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            docs = list(collection.find(query, projection={"TV Time": 1}).sort("_id", 1).limit(batch_size))
+            if not docs:
+                break
+            operations = []
+            for doc in docs:
+                tv_datetime = parse_tv_time(doc.get("TV Time"))
+                if tv_datetime is None:
+                    logger.error(f"Cannot parse TV Time {doc.get('TV Time')!r} of market_cipher_b {doc['_id']}")
+                    continue
+                operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {TV_DATETIME_FIELD: tv_datetime}}))
+            if operations:
+                collection.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+            batches += 1
+            last_id = docs[-1]["_id"] if last_id is None or docs[-1]["_id"] > last_id else last_id
+            query["_id"] = {"$gt": docs[-1]["_id"]}
+            _save_checkpoint(db, last_id, len(operations))
+            if batches % 100 == 0:
+                logger.warning(f"TV Datetime backfill: {migrated} bars migrated in {time.monotonic() - started:.1f}s")
+
+        if migrated:
+            logger.warning(f"TV Datetime backfill: {migrated} bars migrated in {time.monotonic() - started:.1f}s")
+        return migrated
+
+def backfill_ui_datetimes():
+    # One pass over user_interface; it holds one document per pair
+    with MongoConnection() as mongo_conn:
+        operations = []
+        for record in mongo_conn.ui_collection.find({}, projection=dict.fromkeys(list(UI_TIME_FIELDS) + list(UI_TIME_FIELDS.values()), 1)):
+            missing = {
+                typed: parse_tv_time(record.get(field))
+                for field, typed in UI_TIME_FIELDS.items()
+                if record.get(field) and typed not in record
+            }
+            if missing:
+                operations.append(UpdateOne({"_id": record["_id"]}, {"$set": missing}))
+        if operations:
+            mongo_conn.ui_collection.bulk_write(operations, ordered=False)
+            logger.warning(f"Backfilled typed times on {len(operations)} user_interface records")
+        return len(operations)
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the BSON datetime TV Datetime field on market_cipher_b")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    parser.add_argument("--max-batches", type=int, help="stop after this many batches; rerun to resume")
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint and rescan from the start")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    backfill_tv_datetime(args.batch_size, args.max_batches, args.restart)
+    backfill_ui_datetimes()
+
+if __name__ == "__main__":
+    main()
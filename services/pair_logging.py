@@ -0,0 +1,176 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger('mainLogger')
+
+# Handlers run on a listener thread; workers only put records on a queue
+LOG_ASYNC = os.getenv("LOG_ASYNC", "true").lower() == "true"
+# "text" keeps the formatter from logging_config.ini, "json" writes one object per line with the pair fields
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Recent records kept per pair and written out only when that pair fails; 0 disables
+LOG_PAIR_BUFFER_SIZE = int(os.getenv("LOG_PAIR_BUFFER_SIZE", 200))
+# Lowest level the ring keeps. install() never lowers mainLogger, so the ring can't go below
+# it: logging_config.ini ships mainLogger at DEBUG with its handler at WARN for that reason.
+LOG_PAIR_BUFFER_LEVEL = os.getenv("LOG_PAIR_BUFFER_LEVEL", "DEBUG").upper()
+
+_current_pair = contextvars.ContextVar("current_pair", default=None)
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "ticker", "time_frame", "pair", "ring_dump"}
+
+_listeners = []
+_ring = None
+
+class PairContextFilter(logging.Filter):
+    # Stamps records with the pair the current thread is working on
+    def filter(self, record):
+        pair = _current_pair.get()
+        record.ticker, record.time_frame = pair if pair else (None, None)
+        record.pair = f"{pair[0]}-{pair[1]}" if pair else "-"
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "ticker", None) is not None:
+            entry["ticker"] = record.ticker
+            entry["time_frame"] = record.time_frame
+        # Anything passed through extra={...}
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # The stock prepare() formats the message into record.msg, which would bake the
+    # text format into JSON output; only merge the args and render the traceback here.
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class PairRingHandler(logging.Handler):
+    # Keeps the unformatted records of each pair; formatting only happens on dump
+    def __init__(self, size, level=logging.DEBUG):
+        super().__init__(level)
+        self.size = size
+        self.buffers = {}
+
+    def emit(self, record):
+        pair = _current_pair.get()
+        if pair is None or getattr(record, "ring_dump", False):
+            return
+        buffer = self.buffers.get(pair)
+        if buffer is None:
+            buffer = self.buffers.setdefault(pair, deque(maxlen=self.size))
+        buffer.append(record)
+
+    def take(self, pair):
+        self.acquire()
+        try:
+            return list(self.buffers.pop(pair, ()))
+        finally:
+            self.release()
+
+def discard_pair(ticker, time_frame):
+    if _ring is not None:
+        _ring.take((ticker, time_frame))
+
+@contextmanager
+def pair_context(ticker, time_frame):
+    token = _current_pair.set((ticker, time_frame))
+    try:
+        yield
+    finally:
+        _current_pair.reset(token)
+
+def dump_pair(ticker, time_frame):
+    # Writes out what the pair logged below the output level before it failed
+    if _ring is None:
+        return
+    records = _ring.take((ticker, time_frame))
+    if not records:
+        return
+    if isinstance(_ring.formatter, JsonFormatter):
+        # Nested as a list so the dump stays one parseable line
+        entries = [json.loads(_ring.formatter.format(record)) for record in records]
+        logger.error("Last %d log records for %s-%s before the error", len(records), ticker, time_frame, extra={"ring_dump": True, "records": entries})
+        return
+    formatter = _ring.formatter or logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    lines = "\n".join(formatter.format(record) for record in records)
+    logger.error("Last %d log records for %s-%s before the error:\n%s", len(records), ticker, time_frame, lines, extra={"ring_dump": True})
+
+def _output_level(log, handlers):
+    return max(log.getEffectiveLevel(), min((handler.level for handler in handlers), default=logging.NOTSET))
+
+def install():
+    # Called after logging_config.ini is loaded: moves its handlers behind a queue,
+    # stamps pair fields and adds the per-pair ring buffer to mainLogger
+    global _ring
+    if _listeners or _ring is not None:
+        return
+    queue_handlers = {}
+    for log in (logging.getLogger(), logger):
+        handlers = list(log.handlers)
+        if not handlers:
+            continue
+        level = _output_level(log, handlers)
+        if LOG_FORMAT == "json":
+            for handler in handlers:
+                handler.setFormatter(JsonFormatter(datefmt=handler.formatter.datefmt if handler.formatter else None))
+        if not LOG_ASYNC:
+            for handler in handlers:
+                handler.addFilter(PairContextFilter())
+                if handler.level == logging.NOTSET:
+                    handler.setLevel(level)
+            continue
+        key = tuple(map(id, handlers))
+        queue_handler = queue_handlers.get(key)
+        if queue_handler is None:
+            queue_handler = _QueueHandler(queue.SimpleQueue())
+            queue_handler.addFilter(PairContextFilter())
+            listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+            listener.start()
+            _listeners.append(listener)
+            queue_handlers[key] = queue_handler
+        # Records below the old output level are dropped before they are queued
+        queue_handler.setLevel(min(queue_handler.level or level, level))
+        for handler in handlers:
+            log.removeHandler(handler)
+        log.addHandler(queue_handler)
+
+    if LOG_PAIR_BUFFER_SIZE > 0:
+        ring_level = max(logger.getEffectiveLevel(), logging.getLevelName(LOG_PAIR_BUFFER_LEVEL))
+        if ring_level > logging.getLevelName(LOG_PAIR_BUFFER_LEVEL):
+            logger.warning(f"LOG_PAIR_BUFFER_LEVEL={LOG_PAIR_BUFFER_LEVEL} is below mainLogger's level "
+                           f"{logging.getLevelName(ring_level)}; the ring keeps from that level up")
+        _ring = PairRingHandler(LOG_PAIR_BUFFER_SIZE, ring_level)
+        if LOG_FORMAT == "json":
+            _ring.setFormatter(JsonFormatter())
+        logger.addHandler(_ring)
+    atexit.register(shutdown)
+
+def shutdown():
+    # Drains the queue so nothing logged before exit is lost
+    while _listeners:
+        _listeners.pop().stop()
@@ -0,0 +1,97 @@
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger('mainLogger')
+
+TICKERS_PATH = os.getenv("TICKERS_PATH", "./config/tickers.txt")
+DOT_TICKERS_PATH = os.getenv("DOT_TICKERS_PATH", "./config/dot_tickers.txt")
+
+# TradingView resolutions: minutes ("15", "240"), days ("D", "3D") and weeks ("W")
+TIME_FRAME_PATTERN = re.compile(r"\d+|\d*[DW]")
+
+def is_time_frame(value):
+    return TIME_FRAME_PATTERN.fullmatch(value) is not None
+
+def parse_pairs(path):
+    # "TICKER, time_frame" per line. Blank lines and # comments are skipped, malformed lines
+    # are logged and skipped, repeats keep their first position.
+    pairs = {}
+    with open(path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            parts = [part.strip() for part in line.split(',')]
+            if len(parts) != 2 or not parts[0] or not is_time_frame(parts[1]):
+                logger.error(f"Skipping malformed line {line_number} in {path}: {line!r}")
+                continue
+            pair = (parts[0], parts[1])
+            if pair in pairs:
+                logger.warning(f"Skipping duplicate pair {pair[0]}-{pair[1]} on line {line_number} in {path}")
+                continue
+            pairs[pair] = None
+    return tuple(pairs)
+
+class PairRegistry:
+    # Parsed pair lists for tickers.txt (stage pipeline, prices) and dot_tickers.txt (dots).
+    # Readers get an immutable tuple; reload() swaps in a new one and reports the difference.
+    def __init__(self, paths=None):
+        self.paths = paths or {"tickers": TICKERS_PATH, "dots": DOT_TICKERS_PATH}
+        self.sets = {}  # kind -> tuple of (ticker, time_frame) in file order
+        self.listeners = []  # listener(kind, added, removed)
+        self.lock = threading.Lock()
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def kind_for_path(self, path):
+        name = os.path.basename(path)
+        for kind, kind_path in self.paths.items():
+            if os.path.basename(kind_path) == name:
+                return kind
+        return None
+
+    def get(self, kind):
+        pairs = self.sets.get(kind)
+        if pairs is None:
+            with self.lock:
+                if kind not in self.sets:
+                    self.sets[kind] = parse_pairs(self.paths[kind])
+                    logger.warning(f"Loaded {len(self.sets[kind])} pairs from {self.paths[kind]}")
+                pairs = self.sets[kind]
+        return pairs
+
+    def pairs(self):
+        return self.get("tickers")
+
+    def dot_pairs(self):
+        return self.get("dots")
+
+    def reload(self, kind):
+        # A file that can't be read keeps the previous set; editors often save in several steps
+        try:
+            new_pairs = parse_pairs(self.paths[kind])
+        except OSError as e:
+            logger.error(f"Keeping the previous {kind} pairs, cannot read {self.paths[kind]}: {e}")
+            return [], []
+        with self.lock:
+            old_pairs = self.sets.get(kind, ())
+            if new_pairs == old_pairs:
+                return [], []
+            old_set = set(old_pairs)
+            new_set = set(new_pairs)
+            added = [pair for pair in new_pairs if pair not in old_set]
+            removed = [pair for pair in old_pairs if pair not in new_set]
+            self.sets[kind] = new_pairs
+        logger.warning(f"Reloaded {self.paths[kind]}: {len(new_pairs)} pairs, {len(added)} added, {len(removed)} removed")
+        if added or removed:
+            for listener in self.listeners:
+                try:
+                    listener(kind, added, removed)
+                except Exception as e:
+                    logger.exception(f"Pair registry listener failed for {kind}: {e}")
+        return added, removed
+
+pair_registry = PairRegistry()
@@ -0,0 +1,103 @@
+import logging
+import os
+import threading
+import time
+from pymongo import UpdateOne
+from services.db_conn import MongoConnection
+from services.bars import to_float, TV_DATETIME_FIELD
+from services.migrate_tv_time import backfill_tv_datetime
+from services.metrics import timed
+from services.read_model import read_model
+
+logger = logging.getLogger('mainLogger')
+
+PRICE_TIME_FRAME = '15'  # Prices come from the latest 15-minute bar
+PRICE_REFRESH_SECONDS = float(os.getenv("PRICE_REFRESH_SECONDS", 30))
+
+def latest_prices_pipeline(tickers):
+    # Sorted descending on every key of pair_tv_datetime, so the index read backwards gives the
+    # order and the $group by its leading key runs as a DISTINCT_SCAN: one index seek per
+    # ticker, however long the 15m history gets
+    return [
+        {"$match": {"ticker": {"$in": list(tickers)}, "Time Frame": PRICE_TIME_FRAME}},
+        {"$sort": {"ticker": -1, "Time Frame": -1, TV_DATETIME_FIELD: -1}},
+        {"$group": {"_id": "$ticker", "close": {"$first": "$close"}, "TV Time": {"$first": "$TV Time"}}},
+    ]
+
+def fetch_latest_prices(tickers):
+    # Latest 15-minute close for every ticker in one aggregation. Goes straight to Mongo; the
+    # bar cache only refreshes once per job() cycle.
+    prices = {}
+    with MongoConnection() as mongo_conn:
+        for doc in mongo_conn.collection.aggregate(latest_prices_pipeline(tickers)):
+            price = to_float(doc.get("close"))
+            if price is not None:
+                prices[doc["_id"]] = price
+    return prices
+
+def write_prices(prices, pairs):
+    # One bulk write fans each ticker's price out to all of its user_interface rows
+    operations = [
+        UpdateOne({"ticker": ticker, "time_frame": time_frame}, {"$set": {"price": prices[ticker]}}, upsert=True)
+        for ticker, time_frame in pairs if ticker in prices
+    ]
+    # Per-ticker price rows (ticker_symbol) that the dashboard reads
+    operations += [
+        UpdateOne({"ticker_symbol": ticker}, {"$set": {"price": price}}, upsert=True)
+        for ticker, price in prices.items()
+    ]
+    if not operations:
+        return
+    with MongoConnection() as mongo_conn:
+        mongo_conn.ui_collection.bulk_write(operations, ordered=False)
+    for ticker, time_frame in pairs:
+        if ticker in prices:
+            read_model.apply(ticker, time_frame, {"price": prices[ticker]})
+
+@timed("prices")
+def refresh_prices(pairs):
+    pairs = list(dict.fromkeys(pairs))
+    tickers = set(ticker for ticker, _ in pairs)
+    prices = fetch_latest_prices(tickers)
+    for ticker in tickers - set(prices):
+        logger.warning(f"No price fetched for ticker: {ticker}. Skipping update.")
+    write_prices(prices, pairs)
+    logger.info(f"Refreshed prices for {len(prices)} tickers across {len(pairs)} pairs")
+    return prices
+
+class PriceRefresher:
+    def __init__(self, get_pairs, interval=PRICE_REFRESH_SECONDS):
+        # get_pairs() returns the current (ticker, time_frame) pairs to price
+        self.get_pairs = get_pairs
+        self.interval = interval
+        self.thread = None
+        self.stopping = threading.Event()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        if self.interval <= 0 or self.running:
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="price-refresher", daemon=True)
+        self.thread.start()
+        logger.warning(f"Refreshing prices every {self.interval}s")
+
+    def stop(self, timeout=10):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def run(self):
+        while not self.stopping.is_set():
+            started = time.monotonic()
+            try:
+                # Bars the ingester wrote since job() last backfilled have no TV Datetime yet
+                # and would sort below the latest bar; type them first so prices aren't a cycle stale
+                backfill_tv_datetime()
+                refresh_prices(self.get_pairs())
+            except Exception as e:
+                logger.error(f"Failed to refresh prices: {e}")
+            self.stopping.wait(max(0.0, self.interval - (time.monotonic() - started)))
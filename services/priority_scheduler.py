@@ -0,0 +1,125 @@
+import logging
+import os
+import threading
+import time
+from services import metrics
+from services.read_model import read_model
+from services.stage_state import stage_states
+
+logger = logging.getLogger('mainLogger')
+
+# Length of one priority cycle; pairs with an open pattern past its red dot run every cycle
+PRIORITY_CYCLE_SECONDS = float(os.getenv("PRIORITY_CYCLE_SECONDS", 60))
+# Stage 1 pairs, and stage 0 pairs that just saw activity
+PRIORITY_WARM_SECONDS = float(os.getenv("PRIORITY_WARM_SECONDS", 180))
+# Quiet stage 0 pairs double their interval after every evaluation that changed nothing, up to this
+PRIORITY_IDLE_MAX_SECONDS = float(os.getenv("PRIORITY_IDLE_MAX_SECONDS", 720))
+# Most non-hot pairs one cycle evaluates, most overdue first; 0 runs everything that is due
+PRIORITY_CYCLE_BUDGET = int(os.getenv("PRIORITY_CYCLE_BUDGET", 0))
+
+HOT, WARM, IDLE = "hot", "warm", "idle"
+CLASS_ORDER = (HOT, WARM, IDLE)
+# What counts as activity: the stage moving or gaining a dot time, or the latest dot flipping
+SIGNATURE_FIELDS = ("stage", "big_green_dot_time", "red_dot_time", "green_dot_time")
+DOT_FIELDS = ("is_red_dot", "is_green_dot")
+
+def priority_class(ticker, time_frame):
+    stage = (stage_states.get(ticker, time_frame) or {}).get("stage") or 0
+    if stage in (2, 3):
+        # Waiting for the green dot (trade alert) or for the reset
+        return HOT
+    return WARM if stage == 1 else IDLE
+
+def activity_signature(ticker, time_frame):
+    state = stage_states.get(ticker, time_frame) or {}
+    row = read_model.rows.get((ticker, time_frame)) or {}
+    return tuple(state.get(field) for field in SIGNATURE_FIELDS) + tuple(row.get(field) for field in DOT_FIELDS)
+
+class PriorityScheduler:
+    # Each cycle runs every hot pair, then the warm and idle pairs that are due, in one
+    # run_batch call ordered hot first. Load follows the open patterns instead of the length
+    # of the pair files: a quiet stage 0 pair backs off to one evaluation per idle cap.
+    def __init__(self, get_pairs, run_batch, cycle_seconds=PRIORITY_CYCLE_SECONDS, warm_seconds=PRIORITY_WARM_SECONDS,
+                 idle_max_seconds=PRIORITY_IDLE_MAX_SECONDS, budget=PRIORITY_CYCLE_BUDGET):
+        # get_pairs() returns the current (ticker, time_frame) pairs; run_batch(pairs) evaluates them
+        self.get_pairs = get_pairs
+        self.run_batch = run_batch
+        self.cycle_seconds = cycle_seconds
+        self.warm_seconds = warm_seconds
+        self.idle_max_seconds = max(idle_max_seconds, warm_seconds)
+        self.budget = budget
+        self.due = {}  # pair -> monotonic time it is next due
+        self.idle_intervals = {}  # pair -> current back-off interval
+        self.signatures = {}  # pair -> activity signature after its last evaluation
+        self.backlog = 0
+        self.stopping = threading.Event()
+
+    def select(self, pairs, now):
+        # (pairs to run this cycle in order, {pair: class}, due pairs left over)
+        classes = {pair: priority_class(*pair) for pair in pairs}
+        hot = [pair for pair in pairs if classes[pair] == HOT]
+        due = [pair for pair in pairs if classes[pair] != HOT and self.due.get(pair, now) <= now]
+        due.sort(key=lambda pair: (CLASS_ORDER.index(classes[pair]), self.due.get(pair, now)))
+        if self.budget > 0:
+            due, backlog = due[:self.budget], due[self.budget:]
+        else:
+            backlog = []
+        return hot + due, classes, backlog
+
+    def reschedule(self, pair, pair_class, now):
+        signature = activity_signature(*pair)
+        active = self.signatures.get(pair) != signature
+        self.signatures[pair] = signature
+        if pair_class == IDLE:
+            interval = self.idle_intervals.get(pair, self.warm_seconds)
+            interval = self.warm_seconds if active else min(interval * 2, self.idle_max_seconds)
+            self.idle_intervals[pair] = interval
+        else:
+            self.idle_intervals.pop(pair, None)
+            interval = self.cycle_seconds if pair_class == HOT else self.warm_seconds
+        self.due[pair] = now + interval
+
+    def run_once(self, now=None):
+        # Runs one cycle; returns the seconds until the next one
+        started = time.monotonic() if now is None else now
+        pairs = list(dict.fromkeys(self.get_pairs()))
+        current = set(pairs)
+        for table in (self.due, self.idle_intervals, self.signatures):
+            for pair in [pair for pair in table if pair not in current]:
+                del table[pair]
+
+        batch, classes, backlog = self.select(pairs, started)
+        # Classes as they stood when picked, so a pair that just left stage 3 still counts as hot
+        picked = {pair: classes[pair] for pair in batch}
+        self.backlog = len(backlog)
+        counts = {pair_class: sum(1 for value in classes.values() if value == pair_class) for pair_class in CLASS_ORDER}
+        run_counts = {pair_class: sum(1 for value in picked.values() if value == pair_class) for pair_class in CLASS_ORDER}
+        for pair_class in CLASS_ORDER:
+            metrics.priority_pairs.set(counts[pair_class], priority=pair_class)
+            metrics.priority_cycle_pairs.set(run_counts[pair_class], priority=pair_class)
+        metrics.priority_budget.set(self.budget)
+        metrics.priority_backlog.set(self.backlog)
+        logger.warning(f"Priority cycle: {len(batch)} of {len(pairs)} pairs "
+                       f"({run_counts[HOT]} hot, {run_counts[WARM]} warm, {run_counts[IDLE]} idle), backlog {self.backlog}")
+
+        if batch:
+            self.run_batch(batch)
+        finished = time.monotonic() if now is None else now
+        for pair, pair_class in picked.items():
+            self.reschedule(pair, pair_class, finished)
+        return max(0.0, self.cycle_seconds - (finished - started))
+
+    def run(self):
+        logger.warning(f"Priority scheduling: hot pairs every {self.cycle_seconds:.0f}s, warm every {self.warm_seconds:.0f}s, "
+                       f"idle backing off up to {self.idle_max_seconds:.0f}s, budget {self.budget or 'unlimited'}")
+        while not self.stopping.is_set():
+            try:
+                delay = self.run_once()
+            except Exception as e:
+                logger.exception(f"Priority scheduler failed: {e}")
+                delay = self.cycle_seconds
+            if delay > 0:
+                self.stopping.wait(delay)
+
+    def stop(self):
+        self.stopping.set()
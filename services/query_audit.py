@@ -0,0 +1,253 @@
+import argparse
+import json
+import logging
+import os
+import sys
+from collections import namedtuple
+from datetime import timedelta
+from services import db_conn
+from services.db_conn import MongoConnection, setup_mongodb, CROSSING_DOWN_FILTER, CROSSING_UP_FILTER
+from services.bars import BAR_PROJECTION, TV_DATETIME_FIELD, pair_query
+from services.bar_cache import BAR_CACHE_SIZE
+from services.retention import RETENTION_BATCH_SIZE
+
+logger = logging.getLogger('mainLogger')
+
+AUDIT_DB_NAME = "tvstrats_query_audit"
+# Documents examined per document returned above which a shape fails
+QUERY_AUDIT_MAX_RATIO = float(os.getenv("QUERY_AUDIT_MAX_RATIO", 2))
+
+# One registered query shape: `command(sample)` builds the find/aggregate/update/findAndModify
+# command the server sends, filled in with sample values from the audited database.
+# allow_collscan marks shapes that read a whole (small) collection by design.
+QueryShape = namedtuple("QueryShape", ["name", "sources", "collection", "command", "allow_collscan", "max_ratio"],
+                        defaults=(False, None))
+
+def _find(collection, query, sort=None, limit=0):
+    command = {"find": collection, "filter": query, "projection": BAR_PROJECTION}
+    if sort:
+        command["sort"] = sort
+    if limit:
+        command["limit"] = limit
+    return command
+
+def _upsert(collection, query, update_data):
+    return {"update": collection, "updates": [{"q": query, "u": {"$set": update_data}, "upsert": True}]}
+
+def _bars_since_per_pair(sample):
+    from services.get_dots import PAIR_BAR_PROJECTION
+    query = {"$or": [pair_query(ticker, time_frame, extra={TV_DATETIME_FIELD: {"$gte": sample["after"]}})
+                     for ticker, time_frame in sample["pairs"]]}
+    return {"find": MongoConnection.COLLECTION_NAME, "filter": query, "projection": PAIR_BAR_PROJECTION}
+
+def _latest_prices(sample):
+    from services.price_refresher import latest_prices_pipeline
+    return {"aggregate": MongoConnection.COLLECTION_NAME, "pipeline": latest_prices_pipeline(sample["tickers"]), "cursor": {}}
+
+def _trade_claim(sample):
+    from services.telegram_outbox import trade_criteria
+    return {"findAndModify": MongoConnection.TRADES_COLLECTION_NAME, "query": trade_criteria(*sample["trade"]),
+            "update": {"$setOnInsert": {"Trade": "Buy", "Message": 0}}, "fields": {"Message": 1}, "upsert": True}
+
+def _trades_mark_sent(sample):
+    from services.telegram_outbox import trade_criteria
+    return {"update": MongoConnection.TRADES_COLLECTION_NAME,
+            "updates": [{"q": {"$or": [trade_criteria(*sample["trade"])]}, "u": {"$set": {"Message": 1}}, "multi": True}]}
+
+MC = MongoConnection.COLLECTION_NAME
+UI = MongoConnection.UI_COLLECTION_NAME
+TRADES = MongoConnection.TRADES_COLLECTION_NAME
+LATEST = {TV_DATETIME_FIELD: -1}
+OLDEST = {TV_DATETIME_FIELD: 1}
+
+# Every query and sort shape the server sends on its hot paths. Add new shapes here.
+QUERY_SHAPES = [
+    QueryShape("latest_bar", "get_dots (money flow, and the batched first scan), bar_cache first load", MC,
+               lambda s: _find(MC, pair_query(s["ticker"], s["time_frame"]), LATEST, limit=1)),
+    QueryShape("latest_big_green_dot", "stage1.find_big_green_dot", MC,
+               lambda s: _find(MC, pair_query(s["ticker"], s["time_frame"], extra={"Buy": "1"}), LATEST, limit=1)),
+    QueryShape("bars_after", "stage2.find_red_dot, stage3.find_green_dot, stage_fused, backtest", MC,
+               lambda s: _find(MC, pair_query(s["ticker"], s["time_frame"], after=s["after"]), OLDEST)),
+    QueryShape("bars_after_window", "bar_cache refresh", MC,
+               lambda s: _find(MC, pair_query(s["ticker"], s["time_frame"], after=s["after"]), OLDEST, limit=BAR_CACHE_SIZE + 1)),
+    QueryShape("next_red_dot", "reset_dots_stage.reset_dots", MC,
+               lambda s: _find(MC, pair_query(s["ticker"], s["time_frame"], after=s["after"], extra=CROSSING_DOWN_FILTER), OLDEST, limit=1)),
+    QueryShape("latest_dot", "get_dots (per pair, and the batched first scan)", MC,
+               lambda s: _find(MC, pair_query(s["ticker"], s["time_frame"], extra={"$or": [CROSSING_UP_FILTER, CROSSING_DOWN_FILTER]}), LATEST, limit=1)),
+    QueryShape("bars_since_per_pair", "get_dots (batched, after the first scan)", MC, _bars_since_per_pair),
+    QueryShape("latest_prices", "price_refresher.fetch_latest_prices", MC, _latest_prices),
+    QueryShape("retention_batch", "retention.archive_pair", MC,
+               lambda s: {"find": MC, "filter": pair_query(s["ticker"], s["time_frame"], extra={TV_DATETIME_FIELD: {"$lt": s["after"]}}),
+                          "sort": OLDEST, "limit": RETENTION_BATCH_SIZE}),
+    QueryShape("ui_pair_update", "ui_writer.write_update, price_refresher.write_prices", UI,
+               lambda s: _upsert(UI, {"ticker": s["ticker"], "time_frame": s["time_frame"]}, {"stage": 0})),
+    QueryShape("ui_price_row_update", "price_refresher.write_prices", UI,
+               lambda s: _upsert(UI, {"ticker_symbol": s["ticker"]}, {"price": 1.0})),
+    QueryShape("ui_read_all", "stage_state.load, read_model.sync", UI,
+               lambda s: {"find": UI, "filter": {"ticker": {"$ne": None}}}, allow_collscan=True),
+    QueryShape("trade_claim", "telegram_outbox.claim_trade", TRADES, _trade_claim),
+    QueryShape("trades_mark_sent", "telegram_outbox.mark_sent", TRADES, _trades_mark_sent),
+    QueryShape("trades_pending", "telegram_outbox.recover_pending", TRADES,
+               lambda s: {"find": TRADES, "filter": {"Message": 0}}),
+    QueryShape("trades_pending_sharded", "telegram_outbox.recover_pending (sharded)", TRADES,
+               lambda s: {"find": TRADES, "filter": {"Message": 0, "Ticker": {"$in": s["tickers"]}}}),
+]
+
+def _first(doc, key):
+    # First value stored under `key` anywhere in a nested explain document
+    if isinstance(doc, dict):
+        if key in doc:
+            return doc[key]
+        values = doc.values()
+    elif isinstance(doc, list):
+        values = doc
+    else:
+        return None
+    for value in values:
+        found = _first(value, key)
+        if found is not None:
+            return found
+    return None
+
+def _plan_stages(plan, stages, indexes):
+    # Stage names of a winning plan, outermost first; SBE plans keep theirs under queryPlan
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        if "indexName" in plan:
+            indexes.append(plan["indexName"])
+        for key, value in plan.items():
+            if key != "slotBasedPlan":
+                _plan_stages(value, stages, indexes)
+    elif isinstance(plan, list):
+        for value in plan:
+            _plan_stages(value, stages, indexes)
+
+def explain_shape(db, shape, sample, max_ratio=QUERY_AUDIT_MAX_RATIO):
+    command = shape.command(sample)
+    explained = db.command({"explain": command, "verbosity": "executionStats"})
+    stages, indexes = [], []
+    _plan_stages(_first(explained, "winningPlan"), stages, indexes)
+    # Pipeline stages the query layer could not absorb, e.g. a $sort it had to run in memory
+    pipeline_stages = [next(iter(stage)) for stage in explained.get("stages", []) if isinstance(stage, dict)]
+    stats = _first(explained, "executionStats") or {}
+    keys_examined = stats.get("totalKeysExamined", 0)
+    docs_examined = stats.get("totalDocsExamined", 0)
+    returned = stats.get("nReturned", 0)
+    if "aggregate" in command:
+        # The query layer feeds the $group every bar it reads; what the caller gets is one row per group
+        returned = len(list(db[shape.collection].aggregate(command["pipeline"], allowDiskUse=True)))
+    ratio = docs_examined / max(returned, 1)
+
+    failures = []
+    if "COLLSCAN" in stages and not shape.allow_collscan:
+        failures.append("collection scan")
+    if "SORT" in stages or "$sort" in pipeline_stages:
+        failures.append("blocking sort")
+    limit = shape.max_ratio or max_ratio
+    if ratio > limit and not shape.allow_collscan:
+        failures.append(f"examined/returned {ratio:.1f} > {limit:g}")
+    return {
+        "name": shape.name,
+        "sources": shape.sources,
+        "collection": shape.collection,
+        "plan": " <- ".join(stages + [stage for stage in pipeline_stages if stage != "$cursor"]),
+        "indexes": sorted(set(indexes)),
+        "keys_examined": keys_examined,
+        "docs_examined": docs_examined,
+        "returned": returned,
+        "ratio": round(ratio, 2),
+        "failures": failures,
+    }
+
+def seed(args):
+    from services import benchmark
+    from services.telegram_outbox import trade_criteria
+
+    with MongoConnection() as mongo_conn:
+        mongo_conn.client.drop_database(args.db)
+    setup_mongodb()
+    time_frames = [time_frame.strip() for time_frame in args.time_frames.split(",")]
+    pairs = benchmark.generate_pairs(args.tickers, time_frames)
+    logger.warning(f"Seeding {len(pairs)} pairs x {args.bars} bars")
+    benchmark.seed_market_data(pairs, args.bars, 0.2, args.seed)
+    with MongoConnection() as mongo_conn:
+        mongo_conn.ui_collection.insert_many([{"ticker": ticker, "time_frame": time_frame, "stage": 0} for ticker, time_frame in pairs])
+        mongo_conn.ui_collection.insert_many([{"ticker_symbol": ticker, "price": 1.0} for ticker in dict.fromkeys(ticker for ticker, _ in pairs)])
+        # Mostly delivered alerts, a few pending, like a long-running trades collection
+        trades = []
+        for i, bar in enumerate(mongo_conn.collection.find({"Blue Wave Crossing UP": {"$lt": "n"}}, projection={"ticker": 1, "Time Frame": 1, "TV Time": 1})):
+            trades.append(dict(trade_criteria(bar["ticker"], bar["Time Frame"], bar["TV Time"]), Trade="Buy", Message=0 if i % 50 == 0 else 1))
+        if trades:
+            mongo_conn.trades_collection.insert_many(trades)
+
+def sample_values(db, pair_count):
+    # Real ticker, time frame and times to fill the shapes in with
+    collection = db[MongoConnection.COLLECTION_NAME]
+    latest = collection.find_one({}, projection={"ticker": 1, "Time Frame": 1}, sort=[("_id", -1)])
+    if latest is None:
+        raise SystemExit(f"{MongoConnection.COLLECTION_NAME} is empty; seed it or point --db at a populated database")
+    last_bar = collection.find_one(pair_query(latest["ticker"], latest["Time Frame"]), sort=[(TV_DATETIME_FIELD, -1)])
+    pairs = [(doc["_id"]["ticker"], doc["_id"]["time_frame"]) for doc in collection.aggregate([
+        {"$group": {"_id": {"ticker": "$ticker", "time_frame": "$Time Frame"}}},
+        {"$limit": pair_count},
+    ])]
+    trade = db[MongoConnection.TRADES_COLLECTION_NAME].find_one({}) or {"Ticker": latest["ticker"], "Time Frame": latest["Time Frame"], "TV Time": last_bar["TV Time"]}
+    return {
+        "ticker": latest["ticker"],
+        "time_frame": latest["Time Frame"],
+        # About a day of bars on the 15 minute time frame: the typical stage 2/3 scan
+        "after": last_bar[TV_DATETIME_FIELD] - timedelta(minutes=15 * 100),
+        "pairs": pairs,
+        "tickers": list(dict.fromkeys(ticker for ticker, _ in pairs)),
+        "trade": (trade["Ticker"], trade["Time Frame"], trade["TV Time"]),
+    }
+
+def audit(db, shapes=QUERY_SHAPES, max_ratio=QUERY_AUDIT_MAX_RATIO, pair_count=100):
+    sample = sample_values(db, pair_count)
+    return [explain_shape(db, shape, sample, max_ratio) for shape in shapes]
+
+def print_report(results):
+    for result in results:
+        status = "FAIL " + ", ".join(result["failures"]) if result["failures"] else "ok"
+        print(f"{result['name']:<28} {status}")
+        print(f"    {result['collection']}: {result['plan']} {result['indexes']}")
+        print(f"    keys examined {result['keys_examined']}, docs examined {result['docs_examined']}, "
+              f"returned {result['returned']} (ratio {result['ratio']:g}); used by {result['sources']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Explain every registered query shape and fail on collection scans, "
+                                                 "blocking sorts and poor examined/returned ratios")
+    parser.add_argument("--db", default=AUDIT_DB_NAME, help="database to audit (and seed, unless --no-seed)")
+    parser.add_argument("--no-seed", action="store_true", help="audit the data already in --db instead of seeding it")
+    parser.add_argument("--tickers", type=int, default=20)
+    parser.add_argument("--time-frames", default="15,30,60,240")
+    parser.add_argument("--bars", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-ratio", type=float, default=QUERY_AUDIT_MAX_RATIO)
+    parser.add_argument("--shape", action="append", help="only audit these shapes (repeatable)")
+    parser.add_argument("--out", help="write results JSON here")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.db == "market_data" and not args.no_seed:
+        parser.error("refusing to drop the live market_data database; pass --no-seed to audit it in place")
+
+    MongoConnection.DB_NAME = args.db
+    if not args.no_seed:
+        seed(args)
+    shapes = [shape for shape in QUERY_SHAPES if not args.shape or shape.name in args.shape]
+    with MongoConnection() as mongo_conn:
+        results = audit(mongo_conn.db, shapes, args.max_ratio)
+    print_report(results)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+    failed = [result["name"] for result in results if result["failures"]]
+    if failed:
+        print(f"{len(failed)} of {len(results)} query shapes failed: {', '.join(failed)}")
+    db_conn.close_client()
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
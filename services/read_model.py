@@ -0,0 +1,196 @@
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from services.db_conn import MongoConnection
+
+logger = logging.getLogger('mainLogger')
+
+# Loopback only unless set explicitly, e.g. SNAPSHOT_HOST=0.0.0.0 for a dashboard in another container
+SNAPSHOT_HOST = os.getenv("SNAPSHOT_HOST", "127.0.0.1")
+SNAPSHOT_PORT = int(os.getenv("SNAPSHOT_PORT", 9109))  # 0 disables the /snapshot endpoint
+# Re-read user_interface at most this often (from job(), never while writes are buffered)
+# to pick up rows written by other workers or by hand
+SNAPSHOT_RESYNC_SECONDS = float(os.getenv("SNAPSHOT_RESYNC_SECONDS", 60))
+# Deltas older than the oldest remembered removal get the full snapshot instead
+SNAPSHOT_MAX_REMOVALS = int(os.getenv("SNAPSHOT_MAX_REMOVALS", 1000))
+SNAPSHOT_GZIP_MIN_BYTES = 1024
+
+# user_interface fields the dashboard shows
+SNAPSHOT_FIELDS = ("stage", "is_red_dot", "is_green_dot", "money_flow", "price", "start_time", "big_green_dot_time",
+                   "red_dot_time", "green_dot_time", "red_dot_value", "last_updated")
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"), default=str).encode()
+
+class ReadModel:
+    # Every pair's dashboard row, kept current by the writes this process makes. Each
+    # change bumps a global version and stamps the row with it, so "since N" is a scan for
+    # newer stamps and the full body only needs re-serializing when the version moved.
+    def __init__(self):
+        self.rows = {}  # (ticker, time_frame) -> row dict
+        self.row_versions = {}  # (ticker, time_frame) -> version of the last change
+        self.removed = {}  # (ticker, time_frame) -> version it disappeared at
+        self.removed_floor = 0  # deltas from before this version may miss removals
+        self.version = 0
+        # Lets clients notice a restart, which starts the versions over
+        self.epoch = str(int(time.time()))
+        self.body = None  # (version, json bytes, gzip bytes)
+        self.loaded = False
+        self.last_synced = None
+        self.lock = threading.Lock()
+
+    def _read_all(self):
+        projection = dict({field: 1 for field in SNAPSHOT_FIELDS}, ticker=1, time_frame=1, _id=0)
+        rows = {}
+        with MongoConnection() as mongo_conn:
+            for record in mongo_conn.ui_collection.find({"ticker": {"$ne": None}}, projection=projection):
+                key = (record["ticker"], record.get("time_frame"))
+                rows[key] = {field: record[field] for field in SNAPSHOT_FIELDS if field in record}
+        return rows
+
+    def _set_row(self, key, fields):
+        # Caller holds the lock; returns True when something changed
+        row = self.rows.get(key)
+        if row is None:
+            self.rows[key] = row = {}
+            self.removed.pop(key, None)
+        changed = {field: value for field, value in fields.items() if row.get(field, None) != value or field not in row}
+        if not changed:
+            return False
+        row.update(changed)
+        self.version += 1
+        self.row_versions[key] = self.version
+        return True
+
+    def load(self):
+        self.sync()
+
+    def sync(self):
+        # Full re-read: rows other processes changed, added or deleted are folded in as changes
+        rows = self._read_all()
+        with self.lock:
+            for key, fields in rows.items():
+                if self.rows.get(key) != fields:
+                    self.rows.pop(key, None)
+                    self._set_row(key, fields)
+            for key in [key for key in self.rows if key not in rows]:
+                del self.rows[key]
+                del self.row_versions[key]
+                self.version += 1
+                self.removed[key] = self.version
+            while len(self.removed) > SNAPSHOT_MAX_REMOVALS:
+                oldest = min(self.removed, key=self.removed.get)
+                self.removed_floor = self.removed.pop(oldest)
+            self.loaded = True
+            self.last_synced = time.monotonic()
+
+    def sync_if_due(self, interval=SNAPSHOT_RESYNC_SECONDS):
+        if not self.loaded or (interval > 0 and time.monotonic() - self.last_synced >= interval):
+            self.sync()
+
+    def apply(self, ticker, time_frame, update_data):
+        # Write-through from every user_interface $set this process sends
+        if not self.loaded:
+            return
+        fields = {field: value for field, value in update_data.items() if field in SNAPSHOT_FIELDS and field != "last_updated"}
+        if not fields:
+            return
+        with self.lock:
+            self._set_row((ticker, time_frame), fields)
+            if "last_updated" in update_data:
+                # Kept in step with Mongo, but a bare timestamp change is not a new version
+                self.rows[(ticker, time_frame)]["last_updated"] = update_data["last_updated"]
+
+    def etag(self, version=None):
+        return f'"{self.epoch}-{self.version if version is None else version}"'
+
+    def snapshot(self):
+        # (version, json bytes, gzip bytes) of the full snapshot, serialized once per version
+        with self.lock:
+            if self.body is not None and self.body[0] == self.version:
+                return self.body
+            version = self.version
+            pairs = [dict(row, ticker=ticker, time_frame=time_frame) for (ticker, time_frame), row in self.rows.items()]
+        body = _dumps({"epoch": self.epoch, "version": version, "pairs": pairs})
+        serialized = (version, body, gzip.compress(body, compresslevel=6))
+        with self.lock:
+            # Another request may have serialized a newer version meanwhile; keep that one
+            if self.body is None or self.body[0] < version:
+                self.body = serialized
+        return serialized
+
+    def delta(self, since):
+        # Rows changed after version `since`, or None when only the full snapshot is accurate
+        with self.lock:
+            if since > self.version or since < self.removed_floor:
+                return None
+            changed = [dict(self.rows[key], ticker=key[0], time_frame=key[1]) for key, version in self.row_versions.items() if version > since]
+            removed = [list(key) for key, version in self.removed.items() if version > since]
+            version = self.version
+        return _dumps({"epoch": self.epoch, "version": version, "since": since, "changed": changed, "removed": removed})
+
+read_model = ReadModel()
+
+class _SnapshotHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # Served from memory only; job() re-syncs with user_interface between cycles
+        url = urlsplit(self.path)
+        if url.path != "/snapshot":
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        epoch = query.get("epoch", [read_model.epoch])[0]
+        since = query.get("since", [None])[0]
+        body = None
+        if since is not None and since.isdigit() and epoch == read_model.epoch:
+            body = read_model.delta(int(since))
+            etag = None
+        if body is None:
+            version, body, gzipped = read_model.snapshot()
+            etag = read_model.etag(version)
+            if etag in self.headers.get("If-None-Match", ""):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+        else:
+            gzipped = gzip.compress(body, compresslevel=6) if len(body) >= SNAPSHOT_GZIP_MIN_BYTES else None
+
+        use_gzip = gzipped is not None and "gzip" in self.headers.get("Accept-Encoding", "")
+        payload = gzipped if use_gzip else body
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Vary", "Accept-Encoding")
+        if etag:
+            self.send_header("ETag", etag)
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+_server = None
+
+def install(host=SNAPSHOT_HOST, port=SNAPSHOT_PORT):
+    # Loads every row once and serves GET /snapshot, /snapshot?since=N&epoch=E
+    global _server
+    read_model.load()
+    if port and _server is None:
+        _server = ThreadingHTTPServer((host, port), _SnapshotHandler)
+        threading.Thread(target=_server.serve_forever, name="snapshot-http", daemon=True).start()
+        logger.warning(f"Serving the pair snapshot on http://{host}:{port}/snapshot")
+
+def shutdown():
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server = None
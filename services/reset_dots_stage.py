@@ -1,31 +1,31 @@
 import logging
-from datetime import datetime, timezone
-from services.db_conn import MongoConnection
+from services.db_conn import MongoConnection, CROSSING_DOWN_FILTER
+from services.bars import find_bar, parse_tv_time
+from services.stage_state import stage_states
+from services.metrics import timed
 
+@timed("reset_dots")
 def reset_dots(ticker, time_frame):
     logger = logging.getLogger('mainLogger')
     logger.debug("Entering reset_dots()")
     with MongoConnection() as mongo_conn:
-        ui_collection = mongo_conn.ui_collection
         mc_collection = mongo_conn.collection
 
         # Find the UI record for the given ticker and time frame with stage 3
-        ui_record = ui_collection.find_one({"ticker": ticker, "time_frame": time_frame, "stage": 3})
+        ui_record = stage_states.get(ticker, time_frame)
         
-        if ui_record:
-            green_dot_time_str = ui_record["green_dot_time"]
-            green_dot_time = datetime.strptime(green_dot_time_str, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
-            green_dot_time_str_mongo = green_dot_time.strftime("%Y-%m-%d %H:%M:%S")
+        if ui_record and ui_record.get("stage") == 3:
+            # Typed time when the record has it, parsed once otherwise
+            green_dot_time = ui_record.get("green_dot_datetime") or parse_tv_time(ui_record["green_dot_time"])
 
             # Find any red dots in the MarketCipher B collection after the green dot time
-            new_red_dot = mc_collection.find_one(
-                {
-                    "ticker": ticker,
-                    "Time Frame": time_frame,
-                    "TV Time": {"$gt": green_dot_time_str_mongo},
-                    "Blue Wave Crossing Down": {"$ne": "null"}
-                },
-                sort=[("TV Time", 1)]  # Sorting in ascending order
+            new_red_dot = find_bar(
+                mc_collection,
+                ticker,
+                time_frame,
+                after=green_dot_time,
+                extra=CROSSING_DOWN_FILTER,  # Red dot bars only, served by the partial index
+                direction=1  # Sorting in ascending order
             )
 
             if new_red_dot:
@@ -37,10 +37,10 @@ def reset_dots(ticker, time_frame):
                     "green_dot_time": None,
                     "big_green_dot_time": None
                 }
-                logger.info(f"(Reset) Reset stage to 0 and cleared fields for {ticker}-{time_frame} as a new red dot is found after the green dot at {new_red_dot['TV Time']}")
+                logger.info("(Reset) Reset stage to 0 and cleared fields for %s-%s as a new red dot is found after the green dot at %s", ticker, time_frame, new_red_dot.tv_time)
                 return update_data
             else:
-                logger.info(f"(Reset) No new red dot found after the green dot for {ticker}-{time_frame} at {green_dot_time}. No action taken.")
+                logger.info("(Reset) No new red dot found after the green dot for %s-%s at %s. No action taken.", ticker, time_frame, green_dot_time)
         else:
-            logger.info(f"No stage 3 record found for {ticker}-{time_frame}. No action taken.")
+            logger.info("No stage 3 record found for %s-%s. No action taken.", ticker, time_frame)
     return None
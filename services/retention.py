@@ -0,0 +1,164 @@
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from services import bar_archive
+from services.db_conn import MongoConnection, CROSSING_DOWN_FILTER, CROSSING_UP_FILTER
+from services.bars import TV_DATETIME_FIELD, find_bar, pair_query, parse_tv_time
+from services.stage_state import stage_states
+
+logger = logging.getLogger('mainLogger')
+
+# Moves market_cipher_b bars a pair no longer needs into services/bar_archive files
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "false").lower() == "true"
+# Bars newer than this always stay in Mongo (covers the bar cache window and the dashboard)
+RETENTION_DAYS = float(os.getenv("RETENTION_DAYS", 90))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 5000))
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", 6 * 3600))
+# Bars one background pass archives at most (0: no cap); a pass that hits it resumes at the
+# pair it stopped on after RETENTION_BACKLOG_PAUSE_SECONDS instead of the full interval
+RETENTION_MAX_BARS_PER_RUN = int(os.getenv("RETENTION_MAX_BARS_PER_RUN", 50000))
+RETENTION_BACKLOG_PAUSE_SECONDS = float(os.getenv("RETENTION_BACKLOG_PAUSE_SECONDS", 60))
+
+# Times on the pair's user_interface record the stages scan from, typed sibling first
+PATTERN_TIME_FIELDS = (("start_datetime", "start_time"), ("big_green_dot_datetime", "big_green_dot_time"),
+                       ("red_dot_datetime", "red_dot_time"), ("green_dot_datetime", "green_dot_time"))
+
+def pair_cutoff(collection, ticker, time_frame, horizon):
+    # Oldest bar time the pair still needs; bars before it can be archived. None when the
+    # pair's next scan may reach arbitrarily far back and nothing may be archived yet.
+    state = stage_states.get(ticker, time_frame) or {}
+    if state.get("stage") in (1, 2) and not state.get("start_time"):
+        # Stage 1 records don't keep their start time, so find_red_dot scans the whole history
+        return None
+    times = [horizon]
+    for typed_field, field in PATTERN_TIME_FIELDS:
+        value = state.get(typed_field) or parse_tv_time(state.get(field))
+        if value:
+            times.append(value)
+    # stage1.find_big_green_dot and the dots read the latest Buy / dot bar however old it is
+    for extra in ({"Buy": "1"}, {"$or": [CROSSING_UP_FILTER, CROSSING_DOWN_FILTER]}):
+        bar = find_bar(collection, ticker, time_frame, extra=extra)
+        if bar and bar.time:
+            times.append(bar.time)
+    return min(times)
+
+def archive_pair(collection, ticker, time_frame, cutoff, batch_size=RETENTION_BATCH_SIZE, dry_run=False, max_bars=None):
+    # Archive files are written before the batch is deleted, so a run that dies in between
+    # leaves the bars in both places and the next run archives them again (deduplicated).
+    # Stops after max_bars; the rest stays in Mongo for the next run.
+    query = pair_query(ticker, time_frame, extra={TV_DATETIME_FIELD: {"$lt": cutoff}})
+    if dry_run:
+        return collection.count_documents(query)
+    archived = 0
+    while max_bars is None or archived < max_bars:
+        limit = batch_size if max_bars is None else min(batch_size, max_bars - archived)
+        docs = list(collection.find(query, sort=[(TV_DATETIME_FIELD, 1)], limit=limit))
+        if not docs:
+            break
+        months = bar_archive.write_docs(ticker, time_frame, docs)
+        collection.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        archived += len(docs)
+        logger.info("Archived %s bars of %s-%s into %s", len(docs), ticker, time_frame, ", ".join(months))
+        if len(docs) < limit:
+            break
+    return archived
+
+def run(pairs, days=RETENTION_DAYS, batch_size=RETENTION_BATCH_SIZE, dry_run=False, max_bars=None):
+    # Pairs are taken in order; with max_bars the run ends once that many bars are archived
+    started = time.monotonic()
+    horizon = datetime.utcnow() - timedelta(days=days)
+    archived = {}
+    skipped = []
+    with MongoConnection() as mongo_conn:
+        for ticker, time_frame in pairs:
+            remaining = None if max_bars is None else max_bars - sum(archived.values())
+            if remaining is not None and remaining <= 0:
+                break
+            try:
+                cutoff = pair_cutoff(mongo_conn.collection, ticker, time_frame, horizon)
+                if cutoff is None:
+                    skipped.append((ticker, time_frame))
+                    continue
+                count = archive_pair(mongo_conn.collection, ticker, time_frame, cutoff, batch_size, dry_run, remaining)
+                if count:
+                    archived[(ticker, time_frame)] = count
+            except Exception as e:
+                logger.exception(f"Retention failed for {ticker}-{time_frame}: {e}")
+    action = "Would archive" if dry_run else "Archived"
+    logger.warning(f"{action} {sum(archived.values())} bars of {len(archived)} pairs in {time.monotonic() - started:.1f}s; "
+                   f"{len(skipped)} pairs with an open-ended scan kept whole")
+    return archived
+
+class RetentionRunner:
+    # Runs retention on its own thread so archiving never holds up the scan job
+    def __init__(self, get_pairs, interval=RETENTION_INTERVAL_SECONDS, max_bars=RETENTION_MAX_BARS_PER_RUN,
+                 backlog_pause=RETENTION_BACKLOG_PAUSE_SECONDS):
+        # get_pairs() returns the current (ticker, time_frame) pairs this worker may archive
+        self.get_pairs = get_pairs
+        self.interval = interval
+        self.max_bars = max_bars or None
+        self.backlog_pause = backlog_pause
+        # Pair a capped pass stopped on, where the next pass starts
+        self.resume_pair = None
+        self.thread = None
+        self.stopping = threading.Event()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        if not RETENTION_ENABLED or self.interval <= 0 or self.running:
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="retention", daemon=True)
+        self.thread.start()
+        logger.warning(f"Archiving bars every {self.interval}s, at most {self.max_bars or 'all'} per pass")
+
+    def stop(self, timeout=30):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def run_once(self):
+        # One capped pass; True when it hit the cap and bars are left over
+        pairs = list(self.get_pairs())
+        if self.resume_pair in pairs:
+            start = pairs.index(self.resume_pair)
+            pairs = pairs[start:] + pairs[:start]
+        archived = run(pairs, max_bars=self.max_bars)
+        capped = self.max_bars is not None and sum(archived.values()) >= self.max_bars
+        # The last pair archived from may still have bars older than its cutoff
+        self.resume_pair = list(archived)[-1] if capped else None
+        return capped
+
+    def run(self):
+        while not self.stopping.is_set():
+            capped = False
+            try:
+                capped = self.run_once()
+            except Exception as e:
+                logger.error(f"Failed to run retention: {e}")
+            self.stopping.wait(self.backlog_pause if capped else self.interval)
+
+def main():
+    from services.pair_registry import pair_registry
+
+    parser = argparse.ArgumentParser(description="Archive market_cipher_b bars older than what each pair still needs")
+    parser.add_argument("--days", type=float, default=RETENTION_DAYS, help="always keep bars newer than this")
+    parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="only count the bars that would be archived")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    stage_states.load()
+    pairs = list(dict.fromkeys(pair_registry.pairs() + pair_registry.dot_pairs()))
+    archived = run(pairs, args.days, args.batch_size, args.dry_run)
+    for (ticker, time_frame), count in sorted(archived.items()):
+        print(f"{ticker}-{time_frame}: {count}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import logging
+import os
+from services import ui_writer
+from services.stage_state import stage_states
+
+logger = logging.getLogger('mainLogger')
+
+# Set to "false" to rescan every pattern from its anchor on each run (the pre-checkpoint behaviour)
+STAGE_SCAN_INCREMENTAL = os.getenv("STAGE_SCAN_INCREMENTAL", "true").lower() == "true"
+
+# Scanner checkpoints are stored on the pair's user_interface record under this field
+# and read back from the in-memory stage state table.
+SCAN_STATE_FIELD = "scan_state"
+
+def load_scan_state(ticker, time_frame):
+    state = (stage_states.get(ticker, time_frame) or {}).get(SCAN_STATE_FIELD) or {}
+    return dict(state)
+
+def save_scan_state(ticker, time_frame, state):
+    ui_writer.write_update(ticker, time_frame, {SCAN_STATE_FIELD: dict(state)})
+
+def clear_scan_state(ticker, time_frame):
+    logger.info("Clearing scanner checkpoints for %s-%s", ticker, time_frame)
+    save_scan_state(ticker, time_frame, {})
+
+# Bumped when the checkpoint layout changes; older checkpoints are rebuilt from their anchor
+SCAN_STATE_VERSION = 2
+
+def new_checkpoint(anchor, **fields):
+    return dict(fields, anchor=anchor, version=SCAN_STATE_VERSION)
+
+def get_checkpoint(state, scanner, anchor, rebuild=False):
+    # Returns the scanner's checkpoint if it was built for this anchor, otherwise None
+    checkpoint = state.get(scanner)
+    if rebuild or not STAGE_SCAN_INCREMENTAL or not checkpoint or checkpoint.get("anchor") != anchor:
+        return None
+    if checkpoint.get("version") != SCAN_STATE_VERSION:
+        return None
+    return checkpoint
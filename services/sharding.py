@@ -0,0 +1,185 @@
+import argparse
+import hashlib
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+from services.db_conn import MongoConnection
+
+logger = logging.getLogger('mainLogger')
+
+# Several containers can share the pairs: each ticker is leased to one live worker at a time
+SHARDING_ENABLED = os.getenv("SHARDING_ENABLED", "false").lower() == "true"
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+WORKER_HEARTBEAT_SECONDS = float(os.getenv("WORKER_HEARTBEAT_SECONDS", 10))
+# A worker (and its leases) counts as dead after this long without a heartbeat.
+# Must be well above the heartbeat and any clock skew between the containers.
+WORKER_LEASE_SECONDS = float(os.getenv("WORKER_LEASE_SECONDS", 60))
+
+def _weight(worker_id, ticker):
+    return int.from_bytes(hashlib.blake2b(f"{worker_id}:{ticker}".encode(), digest_size=8).digest(), "big")
+
+def owner_of(ticker, workers):
+    # Rendezvous hashing: when a worker joins or leaves only its share of tickers moves
+    return max(workers, key=lambda worker_id: _weight(worker_id, ticker)) if workers else None
+
+class ShardCoordinator:
+    # Workers heartbeat into `workers`; every worker computes the same ticker -> worker
+    # assignment from the live set, and a per-ticker lease in `pair_leases` makes sure a
+    # ticker moving between workers is never processed by both. Sharding is per ticker, the
+    # same unit run_pairs uses to keep a ticker's user_interface writes on one thread.
+    def __init__(self, worker_id=WORKER_ID, enabled=SHARDING_ENABLED,
+                 heartbeat_seconds=WORKER_HEARTBEAT_SECONDS, lease_seconds=WORKER_LEASE_SECONDS):
+        self.worker_id = worker_id
+        self.enabled = enabled
+        self.heartbeat_seconds = heartbeat_seconds
+        self.lease = timedelta(seconds=lease_seconds)
+        self.get_tickers = None
+        self.held = frozenset()
+        self.renewed_at = None  # monotonic time the held leases were last confirmed
+        self.live = []
+        self.acquire_listeners = []  # listener(tickers) after leases were taken over
+        self.active_jobs = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def add_acquire_listener(self, listener):
+        self.acquire_listeners.append(listener)
+
+    def start(self, get_tickers):
+        if not self.enabled:
+            return
+        self.get_tickers = get_tickers
+        self.heartbeat()
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="shard-heartbeat", daemon=True)
+        self.thread.start()
+        logger.warning(f"Sharding as worker {self.worker_id} with {len(self.live)} live workers, holding {len(self.held)} tickers")
+
+    def stop(self, timeout=10):
+        if not self.enabled:
+            return
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout)
+        # Hand the tickers over now instead of after the lease runs out
+        try:
+            with MongoConnection() as mongo_conn:
+                mongo_conn.db[MongoConnection.LEASES_COLLECTION_NAME].delete_many({"owner": self.worker_id})
+                mongo_conn.db[MongoConnection.WORKERS_COLLECTION_NAME].delete_one({"_id": self.worker_id})
+        except Exception as e:
+            logger.error(f"Failed to release leases of worker {self.worker_id}: {e}")
+        self.held = frozenset()
+
+    def run(self):
+        while not self.stopping.wait(self.heartbeat_seconds):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Worker heartbeat failed: {e}")
+
+    def heartbeat(self):
+        now = datetime.utcnow()
+        with MongoConnection() as mongo_conn:
+            workers = mongo_conn.db[MongoConnection.WORKERS_COLLECTION_NAME]
+            leases = mongo_conn.db[MongoConnection.LEASES_COLLECTION_NAME]
+            workers.update_one(
+                {"_id": self.worker_id},
+                {"$set": {"heartbeat": now, "host": socket.gethostname(), "pid": os.getpid()}, "$setOnInsert": {"started": now}},
+                upsert=True
+            )
+            if self.held:
+                leases.update_many({"_id": {"$in": list(self.held)}, "owner": self.worker_id}, {"$set": {"expires": now + self.lease}})
+                owned = {record["_id"] for record in leases.find({"owner": self.worker_id}, projection={"_id": 1})}
+                lost = self.held - owned
+                if lost:
+                    # Expired while heartbeats failed and another worker took them over
+                    logger.error(f"Lost the leases of {len(lost)} tickers: {sorted(lost)}")
+                    with self.lock:
+                        self.held = frozenset(self.held & owned)
+            self.renewed_at = time.monotonic()
+            self.live = sorted(record["_id"] for record in workers.find({"heartbeat": {"$gte": now - self.lease}}, projection={"_id": 1}))
+            self.rebalance(leases, now)
+
+    def rebalance(self, leases, now):
+        tickers = set(self.get_tickers())
+        assigned = {ticker for ticker in tickers if owner_of(ticker, self.live) == self.worker_id}
+        with self.lock:
+            # Never give a ticker away while a job may still be writing it
+            release = set() if self.active_jobs else self.held - assigned
+        if release:
+            leases.delete_many({"_id": {"$in": list(release)}, "owner": self.worker_id})
+            logger.warning(f"Released {len(release)} tickers: {sorted(release)}")
+
+        acquired = set()
+        for ticker in assigned - self.held:
+            try:
+                # Takes a free or expired lease; a live lease held by someone else makes the
+                # upsert collide on _id and we retry on the next heartbeat
+                leases.update_one(
+                    {"_id": ticker, "$or": [{"owner": self.worker_id}, {"expires": {"$lt": now}}]},
+                    {"$set": {"owner": self.worker_id, "expires": now + self.lease, "acquired": now}},
+                    upsert=True
+                )
+                acquired.add(ticker)
+            except DuplicateKeyError:
+                pass
+
+        with self.lock:
+            self.held = frozenset((self.held - release) | acquired)
+        if acquired:
+            logger.warning(f"Acquired {len(acquired)} tickers: {sorted(acquired)}")
+            for listener in self.acquire_listeners:
+                try:
+                    listener(acquired)
+                except Exception as e:
+                    logger.exception(f"Lease acquire listener failed: {e}")
+
+    def filter(self, pairs):
+        # The (ticker, time_frame) pairs this worker may process right now
+        if not self.enabled:
+            return list(pairs)
+        if self.renewed_at is None or time.monotonic() - self.renewed_at > self.lease.total_seconds() / 2:
+            # Heartbeats are failing, so the leases may already belong to someone else
+            logger.error(f"Worker {self.worker_id} could not renew its leases, skipping its pairs")
+            return []
+        held = self.held
+        return [pair for pair in pairs if pair[0] in held]
+
+    @contextmanager
+    def job(self):
+        with self.lock:
+            self.active_jobs += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active_jobs -= 1
+
+coordinator = ShardCoordinator()
+
+def status():
+    now = datetime.utcnow()
+    with MongoConnection() as mongo_conn:
+        workers = list(mongo_conn.db[MongoConnection.WORKERS_COLLECTION_NAME].find().sort("_id", 1))
+        leases = list(mongo_conn.db[MongoConnection.LEASES_COLLECTION_NAME].find().sort("_id", 1))
+    for worker in workers:
+        age = (now - worker["heartbeat"]).total_seconds()
+        owned = sorted(lease["_id"] for lease in leases if lease.get("owner") == worker["_id"] and lease["expires"] > now)
+        print(f"{worker['_id']}: heartbeat {age:.0f}s ago, {len(owned)} tickers {owned}")
+    orphaned = sorted(lease["_id"] for lease in leases if lease["expires"] <= now)
+    if orphaned:
+        print(f"expired leases: {orphaned}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the workers and ticker leases of a sharded deployment")
+    parser.parse_args()
+    status()
+
+if __name__ == "__main__":
+    main()
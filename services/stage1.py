@@ -1,25 +1,23 @@
 import logging
-from pymongo import DESCENDING
 from services.db_conn import MongoConnection
+from services.bars import find_bar
+from services.metrics import timed
 
+@timed("find_big_green_dot")
 def find_big_green_dot(ticker, time_frame):
     logger = logging.getLogger('mainLogger')
     logger.debug("Entering find_big_green_dot()")
     with MongoConnection() as mongo_conn:
         collection = mongo_conn.collection
-        query = {
-            "ticker": ticker,
-            "Time Frame": time_frame,
-            "Buy": "1"
-        }
-        logger.debug(f"Query for big green dot: {query}")
+        query = {"Buy": "1"}
+        logger.debug("Query for big green dot: %s", query)
         
-        record = collection.find_one(query, sort=[("TV Time", DESCENDING)])
+        bar = find_bar(collection, ticker, time_frame, extra=query)
         
-        if record:
-            green_dot_time = record["TV Time"]  # Capture the TV Time of the red dot
-            logger.info(f"Stage 1, BIG GREEN DOT TIME for {ticker}-{time_frame}: {green_dot_time}")
+        if bar:
+            green_dot_time = bar.tv_time  # Capture the TV Time of the red dot
+            logger.info("Stage 1, BIG GREEN DOT TIME for %s-%s: %s", ticker, time_frame, green_dot_time)
             return {"Stage": 1, "TV Time": green_dot_time}
         else:
-            logger.info(f"No Big Green Dot found for {ticker}-{time_frame} with query {query}")
+            logger.info("No Big Green Dot found for %s-%s with query %s", ticker, time_frame, query)
             return {"Stage": 0, "TV Time": None}
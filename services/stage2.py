@@ -1,43 +1,53 @@
 import logging
 from services.db_conn import MongoConnection
+from services import scan_state
+from services.bars import find_bars, parse_tv_time
+from services.metrics import timed
 
-def find_red_dot(ticker, time_frame, start_time):
+@timed("find_red_dot")
+def find_red_dot(ticker, time_frame, start_time, rebuild=False):
     logger = logging.getLogger('mainLogger')
     logger.debug("Entering find_red_dot()")
-    with MongoConnection() as mongo_conn:
-        collection = mongo_conn.collection
 
-        stage = 1
-        last_red_dot_value = float('-inf')
-        red_dot_time = None  # Initialize red_dot_time
+    # Resume from the last bar scanned for this start_time instead of rescanning all history
+    state = scan_state.load_scan_state(ticker, time_frame)
+    checkpoint = scan_state.get_checkpoint(state, "red", start_time, rebuild)
+    if checkpoint is None:
+        checkpoint = scan_state.new_checkpoint(start_time, last_time=parse_tv_time(start_time), red_dot_time=None, red_dot_value=None)
 
-        records = collection.find({
-            "ticker": ticker,
-            "Time Frame": time_frame,
-            "TV Time": {"$gt": start_time}
-        }).sort("TV Time", 1)
+    stage = 2 if checkpoint["red_dot_time"] else 1
+    red_dot_time = checkpoint["red_dot_time"]
+    red_dot_value = checkpoint["red_dot_value"]
 
-        for record in records:
-            if stage == 1:
-                #logger.info(f"Record in stage2: {record}")
-                red_dot_value_str = record.get('Blue Wave Crossing Down')
-                if red_dot_value_str and red_dot_value_str != 'null':
-                    red_dot_value = float(red_dot_value_str)
-                    if red_dot_value >= 9:  # Change this value to find First Red Dot
+    # Without a start time there is nothing to scan from
+    if stage == 1 and checkpoint["last_time"] is not None:
+        with MongoConnection() as mongo_conn:
+            collection = mongo_conn.collection
+
+            for bar in find_bars(collection, ticker, time_frame, after=checkpoint["last_time"]):
+                checkpoint["last_time"] = bar.time
+                if bar.crossing_down is not None:
+                    if bar.crossing_down >= 9:  # Change this value to find First Red Dot
                         stage = 2
-                        red_dot_time = record["TV Time"]  # Capture the TV Time of the red dot
-                        logger.info(f"Stage 2, RED DOT TIME for {ticker}-{time_frame}: {red_dot_time}")
-                        logger.info(f"Stage 2 set due to Red Dot: {record}")
+                        red_dot_value = bar.crossing_down
+                        red_dot_time = bar.tv_time  # Capture the TV Time of the red dot
+                        logger.info("Stage 2, RED DOT TIME for %s-%s: %s", ticker, time_frame, red_dot_time)
+                        logger.info("Stage 2 set due to Red Dot: %s", bar)
+                        break
                     else:
-                        logger.debug(f"Red Dot (Stage 1): {record}")
-                    if red_dot_value > last_red_dot_value and red_dot_value < 0:
-                        last_red_dot_value = red_dot_value
+                        logger.debug("Red Dot (Stage 1): %s", bar)
+
+        checkpoint["red_dot_time"] = red_dot_time
+        checkpoint["red_dot_value"] = red_dot_value
+        state["red"] = checkpoint
+        state["stage"] = stage
+        scan_state.save_scan_state(ticker, time_frame, state)
 
-        if stage == 2:
-            logger.info(f"Red Dot (Stage 2) found for {ticker}-{time_frame} at {red_dot_time}")
-            return {"Stage": 2, "TV Time": red_dot_time, "Red Dot Time": red_dot_time, "Red Dot Value": red_dot_value}
-        else:
-            logger.info(f"No Red Dot (Stage 2) found for {ticker}-{time_frame}")
-            stage = 0
-            logger.info(f"S2 Set stage to 0 for {ticker}-{time_frame} with Red Dot Time of {red_dot_time}")
-            return {"Stage": 0, "TV Time": None, "Red Dot Time": None}
+    if stage == 2:
+        logger.info("Red Dot (Stage 2) found for %s-%s at %s", ticker, time_frame, red_dot_time)
+        return {"Stage": 2, "TV Time": red_dot_time, "Red Dot Time": red_dot_time, "Red Dot Value": red_dot_value}
+    else:
+        logger.info("No Red Dot (Stage 2) found for %s-%s", ticker, time_frame)
+        stage = 0
+        logger.info("S2 Set stage to 0 for %s-%s with Red Dot Time of %s", ticker, time_frame, red_dot_time)
+        return {"Stage": 0, "TV Time": None, "Red Dot Time": None}
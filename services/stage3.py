@@ -1,81 +1,74 @@
 import logging
 from services.db_conn import MongoConnection
-from datetime import datetime, timedelta
-from services.telegram_notifier import send_telegram_message
+from datetime import timedelta
+from services.telegram_outbox import outbox
+from services import scan_state
+from services.bars import find_bars, parse_tv_time
+from services.metrics import timed
 
-def find_green_dot(ticker, time_frame, red_dot_time_str, red_dot_value):
+@timed("find_green_dot")
+def find_green_dot(ticker, time_frame, red_dot_time_str, red_dot_value, rebuild=False):
     logger = logging.getLogger('mainLogger')
     logger.debug("Entering find_green_dot()")
 
     # Convert red dot time to datetime object and add 1 second
-    red_dot_time = datetime.strptime(red_dot_time_str, "%Y-%m-%dT%H:%M:%SZ")
+    red_dot_time = parse_tv_time(red_dot_time_str)
     search_start_time = red_dot_time + timedelta(seconds=1)
-    logger.info(f"S3: Searching for green dots after {search_start_time} for {ticker}-{time_frame}")
+    logger.info("S3: Searching for green dots after %s for %s-%s", search_start_time, ticker, time_frame)
+
+    # Resume from the last bar scanned for this red dot instead of rescanning from it
+    state = scan_state.load_scan_state(ticker, time_frame)
+    anchor = [red_dot_time_str, red_dot_value]
+    checkpoint = scan_state.get_checkpoint(state, "green", anchor, rebuild)
+    if checkpoint is None:
+        checkpoint = scan_state.new_checkpoint(anchor, last_time=search_start_time, outcome=None)
+    elif checkpoint.get("outcome"):
+        # This red dot already resolved to a break or a green dot; the bars after it don't matter
+        logger.info("S3: Using stored outcome for %s-%s: %s", ticker, time_frame, checkpoint['outcome'])
+        return checkpoint["outcome"]
 
     with MongoConnection() as mongo_conn:
         collection = mongo_conn.collection
 
-        # Find all records after the search_start_time for the given ticker and time frame, sorted by TV Time in ascending order
-        records = collection.find(
-            {"ticker": ticker, "Time Frame": time_frame, "TV Time": {"$gt": search_start_time.isoformat() + "Z"}},
-            sort=[("TV Time", 1)]
-        )
-
-        for record in records:
-            green_dot_time_str = record["TV Time"]
-            green_dot_time = datetime.strptime(green_dot_time_str, "%Y-%m-%dT%H:%M:%SZ")
+        # Find all bars after the checkpoint for the given ticker and time frame, sorted by TV Time in ascending order
+        for bar in find_bars(collection, ticker, time_frame, after=checkpoint["last_time"]):
+            green_dot_time_str = bar.tv_time
+            green_dot_time = bar.time
 
             # Check for higher red dot
-            red_dot_value_str = record.get('Blue Wave Crossing Down')
-            red_dot_time_str = record.get('TV Time')
-            if red_dot_value_str is not None and red_dot_value_str != 'null':
-                new_red_dot_value = float(red_dot_value_str)
-                if new_red_dot_value > red_dot_value:
-                    logger.info(f"S3: Breaking sequence: Found higher Red Dot at {red_dot_time_str}")
-                    return {"Stage": 0, "TV Time": None, "red_dot_time": None, "big_green_dot_time": None}
+            red_dot_time_str = bar.tv_time
+            if bar.crossing_down is not None:
+                if bar.crossing_down > red_dot_value:
+                    logger.info("S3: Breaking sequence: Found higher Red Dot at %s", red_dot_time_str)
+                    result = {"Stage": 0, "TV Time": None, "red_dot_time": None, "big_green_dot_time": None}
+                    save_green_checkpoint(ticker, time_frame, state, checkpoint, bar.time, stage=0, outcome=result)
+                    return result
 
             # Check for green dot
-            green_dot_value_str = record.get('Blue Wave Crossing UP')
-            logger.info(f"S3: Checking green dot at {green_dot_time} with value {green_dot_value_str} and time {green_dot_time_str}")
+            logger.debug("S3: Checking green dot at %s with value %s and time %s", green_dot_time, bar.crossing_up, green_dot_time_str)
 
-            if green_dot_value_str is not None and green_dot_value_str != 'null':
-                green_dot_value = float(green_dot_value_str)
-                if green_dot_value <= -9:  # Value for Stage 3 green dot
-                    logger.info(f"S3: Green Dot found for {ticker}-{time_frame} at {green_dot_time}: {record}")
+            if bar.crossing_up is not None:
+                if bar.crossing_up <= -9:  # Value for Stage 3 green dot
+                    logger.info("S3: Green Dot found for %s-%s at %s: %s", ticker, time_frame, green_dot_time, bar)
 
-                    # Insert/update the trade record after detecting Stage 3
-                    unique_criteria = {
-                        "Time Frame": time_frame,
-                        "TV Time": record['TV Time'],
-                        "Ticker": ticker
-                    }
-                    update_data = {
-                        "$setOnInsert": {
-                            "Trade": "Buy",
-                            "Message": 0
-                        }
-                    }
+                    # Claim the trade record and queue the alert; the outbox sends it in the background
+                    if outbox.claim_trade(ticker, time_frame, bar.tv_time):
+                        logger.info("S3: Queued trade alert for %s-%s at %s", ticker, time_frame, bar.tv_time)
 
-                    with MongoConnection() as mongo_conn:
-                        trades_collection = mongo_conn.trades_collection
-                        trades_collection.update_one(unique_criteria, update_data, upsert=True)
+                    result = {"Stage": 3, "TV Time": green_dot_time_str}
+                    save_green_checkpoint(ticker, time_frame, state, checkpoint, bar.time, stage=3, outcome=result)
+                    return result
 
-                        # Check if the message for this trade has been sent already
-                        trade_record = trades_collection.find_one(unique_criteria)
-                        if trade_record and trade_record.get("Message") == 0:
-                            try:
-                                # Notify Telegram
-                                message = f"Trade Alert! Buy for {ticker} at {record['TV Time']} (Time Frame: {time_frame})"
-                                send_telegram_message(message)
-
-                                # Update the Message flag to 1
-                                trades_collection.update_one(unique_criteria, {"$set": {"Message": 1}})
-                            except Exception as e:
-                                print(f"In main, Failed to send Telegram message. Error: {e}")  # Print to console
-                                logging.error(f"Failed to send Telegram message. Error: {e}")
-                    
-                    return {"Stage": 3, "TV Time": green_dot_time_str}
+            checkpoint["last_time"] = bar.time
 
+        save_green_checkpoint(ticker, time_frame, state, checkpoint, checkpoint["last_time"], stage=2)
         # If no green dot is found after the red dot, log the information and return None
-        logger.info(f"S3: No Green Dot found for {ticker}-{time_frame} after Red Dot at {red_dot_time_str}")
+        logger.info("S3: No Green Dot found for %s-%s after Red Dot at %s", ticker, time_frame, red_dot_time_str)
         return None
+
+def save_green_checkpoint(ticker, time_frame, state, checkpoint, last_time, stage, outcome=None):
+    checkpoint["last_time"] = last_time
+    checkpoint["outcome"] = outcome
+    state["green"] = checkpoint
+    state["stage"] = stage
+    scan_state.save_scan_state(ticker, time_frame, state)
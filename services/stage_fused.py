@@ -0,0 +1,68 @@
+import logging
+import os
+from services.db_conn import MongoConnection
+from services.telegram_outbox import outbox
+from services import scan_state
+from services.bars import find_bars, parse_tv_time
+from services.metrics import timed
+
+logger = logging.getLogger('mainLogger')
+
+# Set to "false" to run stages 2 and 3 as the separate find_red_dot/find_green_dot/reset_dots scans
+STAGE_FUSED_EVALUATOR = os.getenv("STAGE_FUSED_EVALUATOR", "true").lower() == "true"
+
+# Values the separate scanners use
+RED_DOT_MIN = 9
+GREEN_DOT_MAX = -9
+
+@timed("evaluate_pattern")
+def evaluate_pattern(ticker, time_frame, start_time, rebuild=False):
+    # One pass over the bars after start_time with the rules of stage2.find_red_dot,
+    # stage3.find_green_dot and reset_dots_stage.reset_dots in sequence:
+    #   first red dot >= 9, then a higher red dot breaks the pattern or a green dot <= -9
+    #   completes it, then any red dot after the green dot resets it.
+    # Resumes from a checkpoint anchored on start_time, like the separate scanners do.
+    state = scan_state.load_scan_state(ticker, time_frame)
+    checkpoint = scan_state.get_checkpoint(state, "fused", start_time, rebuild)
+    if checkpoint is None:
+        checkpoint = scan_state.new_checkpoint(
+            start_time, last_time=parse_tv_time(start_time), red_dot_time=None, red_dot_value=None,
+            outcome=None, green_dot_time=None, reset=False
+        )
+
+    finished = checkpoint["outcome"] == "broken" or checkpoint["reset"]
+    if not finished and checkpoint["last_time"] is not None:
+        with MongoConnection() as mongo_conn:
+            for bar in find_bars(mongo_conn.collection, ticker, time_frame, after=checkpoint["last_time"]):
+                checkpoint["last_time"] = bar.time
+                if checkpoint["red_dot_time"] is None:
+                    if bar.crossing_down is not None and bar.crossing_down >= RED_DOT_MIN:
+                        checkpoint["red_dot_time"] = bar.tv_time
+                        checkpoint["red_dot_value"] = bar.crossing_down
+                        logger.info("Fused: red dot for %s-%s at %s: %s", ticker, time_frame, bar.tv_time, bar)
+                elif checkpoint["outcome"] is None:
+                    if bar.crossing_down is not None and bar.crossing_down > checkpoint["red_dot_value"]:
+                        checkpoint["outcome"] = "broken"
+                        logger.info("Fused: higher red dot breaks %s-%s at %s", ticker, time_frame, bar.tv_time)
+                        break
+                    if bar.crossing_up is not None and bar.crossing_up <= GREEN_DOT_MAX:
+                        checkpoint["outcome"] = "green"
+                        checkpoint["green_dot_time"] = bar.tv_time
+                        logger.info("Fused: green dot for %s-%s at %s: %s", ticker, time_frame, bar.tv_time, bar)
+                        if outbox.claim_trade(ticker, time_frame, bar.tv_time):
+                            logger.info("Fused: queued trade alert for %s-%s at %s", ticker, time_frame, bar.tv_time)
+                elif bar.crossing_down is not None:
+                    checkpoint["reset"] = True
+                    logger.info("Fused: red dot after the green dot resets %s-%s at %s", ticker, time_frame, bar.tv_time)
+                    break
+
+        state["fused"] = checkpoint
+        scan_state.save_scan_state(ticker, time_frame, state)
+
+    return {
+        "red_dot_time": checkpoint["red_dot_time"],
+        "red_dot_value": checkpoint["red_dot_value"],
+        "outcome": checkpoint["outcome"],
+        "green_dot_time": checkpoint["green_dot_time"],
+        "reset": checkpoint["reset"],
+    }
@@ -0,0 +1,103 @@
+import logging
+import os
+import threading
+import time
+from services.db_conn import MongoConnection
+
+logger = logging.getLogger('mainLogger')
+
+# user_interface fields the stage pipeline reads back. This process is the only writer of
+# these, so after one load at startup the table below is authoritative and reads are free.
+STATE_FIELDS = ("stage", "start_time", "big_green_dot_time", "red_dot_time", "green_dot_time", "red_dot_value", "scan_state",
+                "start_datetime", "big_green_dot_datetime", "red_dot_datetime", "green_dot_datetime")
+
+STATE_RECONCILE_INTERVAL = int(os.getenv("STATE_RECONCILE_INTERVAL", 3600))
+
+class StageStateTable:
+    def __init__(self):
+        self.states = {}  # (ticker, time_frame) -> {field: value}
+        self.loaded = False
+        self.last_reconciled = None
+        self.lock = threading.RLock()
+
+    def _read_all(self, query=None):
+        projection = dict({field: 1 for field in STATE_FIELDS}, ticker=1, time_frame=1, _id=0)
+        states = {}
+        with MongoConnection() as mongo_conn:
+            for record in mongo_conn.ui_collection.find(query or {"ticker": {"$ne": None}}, projection=projection):
+                key = (record.pop("ticker"), record.pop("time_frame", None))
+                states[key] = {field: record[field] for field in STATE_FIELDS if field in record}
+        return states
+
+    def load(self):
+        states = self._read_all()
+        with self.lock:
+            self.states = states
+            self.loaded = True
+            self.last_reconciled = time.monotonic()
+        logger.warning(f"Loaded stage state for {len(states)} pairs")
+
+    def load_tickers(self, tickers):
+        # Re-reads the given tickers' pairs, e.g. after another worker wrote them
+        if not self.loaded or not tickers:
+            return
+        states = self._read_all({"ticker": {"$in": list(tickers)}})
+        tickers = set(tickers)
+        with self.lock:
+            for key in [key for key in self.states if key[0] in tickers]:
+                del self.states[key]
+            self.states.update(states)
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    self.load()
+
+    def get(self, ticker, time_frame):
+        self.ensure_loaded()
+        with self.lock:
+            state = self.states.get((ticker, time_frame))
+            return dict(state) if state is not None else None
+
+    def apply(self, ticker, time_frame, update_data):
+        # Write-through: called with every $set this process sends to user_interface
+        if not self.loaded:
+            return
+        fields = {field: value for field, value in update_data.items() if field in STATE_FIELDS}
+        if not fields:
+            return
+        with self.lock:
+            self.states.setdefault((ticker, time_frame), {}).update(fields)
+
+    def reconcile(self, tickers=None):
+        # Adopt edits made to user_interface outside this process. Must run while no
+        # buffered writes are pending, otherwise those would show up as drift. With
+        # sharding only this worker's tickers are compared; the rest belong to other workers.
+        states = self._read_all({"ticker": {"$in": list(tickers)}} if tickers is not None else None)
+        changed = 0
+        with self.lock:
+            own_keys = set(self.states) if tickers is None else {key for key in self.states if key[0] in tickers}
+            for key in set(states) | own_keys:
+                if states.get(key, {}) != self.states.get(key, {}):
+                    changed += 1
+                    logger.warning(f"Stage state for {key[0]}-{key[1]} changed outside this process: "
+                                   f"{self.states.get(key)} -> {states.get(key)}")
+            if tickers is None:
+                self.states = states
+            else:
+                for key in own_keys:
+                    del self.states[key]
+                self.states.update(states)
+            self.loaded = True
+            self.last_reconciled = time.monotonic()
+        logger.info(f"Reconciled stage state for {len(states)} pairs, {changed} changed outside this process")
+        return changed
+
+    def reconcile_if_due(self, interval=STATE_RECONCILE_INTERVAL, tickers=None):
+        if not self.loaded:
+            self.load()
+        elif interval > 0 and time.monotonic() - self.last_reconciled >= interval:
+            self.reconcile(tickers)
+
+stage_states = StageStateTable()
@@ -9,18 +9,31 @@ TELE_CHAT_ID = os.getenv("TELE_CHAT_ID")
 TOKEN = TELE_TOKEN
 CHAT_ID = TELE_CHAT_ID #Chat ID
 
-def send_telegram_message(message):
-    base_url = f"https://api.telegram.org/bot{TOKEN}/sendMessage"
+# Point TELEGRAM_API_URL at a local stub server to test without hitting Telegram
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+TELEGRAM_TIMEOUT = float(os.getenv("TELEGRAM_TIMEOUT", 10))
+
+# Reused across sends so the TLS connection to Telegram stays open
+_session = requests.Session()
+
+class TelegramError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def send_telegram_message(message, session=None):
+    base_url = f"{TELEGRAM_API_URL}/bot{TOKEN}/sendMessage"
     payload = {
         "chat_id": CHAT_ID,
         "text": message,
         "parse_mode": "HTML"
     }
-    response = requests.post(base_url, data=payload)
+    response = (session or _session).post(base_url, data=payload, timeout=TELEGRAM_TIMEOUT)
     response_data = response.json()
     
     # Check for error in the response and raise exception with details
     if not response_data.get("ok"):
-        raise Exception(f"Telegram API Error: {response_data.get('description', 'Unknown error')}")
+        retry_after = (response_data.get("parameters") or {}).get("retry_after")
+        raise TelegramError(f"Telegram API Error: {response_data.get('description', 'Unknown error')}", retry_after)
     
     return response_data
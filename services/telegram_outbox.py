@@ -0,0 +1,173 @@
+import logging
+import os
+import queue
+import threading
+import time
+from pymongo.errors import DuplicateKeyError
+from services.db_conn import MongoConnection
+from services.telegram_notifier import send_telegram_message, TelegramError
+from services.metrics import telegram_sends
+
+logger = logging.getLogger('mainLogger')
+
+# Trade rows double as the outbox: "Message" is 0 until the alert was delivered, then 1.
+TELEGRAM_MIN_INTERVAL = float(os.getenv("TELEGRAM_MIN_INTERVAL", 1))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", 5))
+TELEGRAM_BATCH_SIZE = int(os.getenv("TELEGRAM_BATCH_SIZE", 10))
+# How often the outbox re-queues rows still at Message 0, e.g. after it gave up retrying; 0 turns it off
+TELEGRAM_RECOVER_INTERVAL = float(os.getenv("TELEGRAM_RECOVER_INTERVAL", 300))
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+def trade_criteria(ticker, time_frame, tv_time):
+    return {"Time Frame": time_frame, "TV Time": tv_time, "Ticker": ticker}
+
+def trade_message(ticker, time_frame, tv_time):
+    return f"Trade Alert! Buy for {ticker} at {tv_time} (Time Frame: {time_frame})"
+
+class TelegramOutbox:
+    def __init__(self, send=send_telegram_message, min_interval=TELEGRAM_MIN_INTERVAL,
+                 max_retries=TELEGRAM_MAX_RETRIES, batch_size=TELEGRAM_BATCH_SIZE, recover_interval=TELEGRAM_RECOVER_INTERVAL):
+        self.send = send
+        self.min_interval = min_interval
+        self.max_retries = max_retries
+        self.batch_size = batch_size
+        self.recover_interval = recover_interval
+        self.get_recover_tickers = None  # returns the tickers to recover, or None for all
+        self.queue = queue.Queue()
+        self.queued = set()
+        self.lock = threading.Lock()
+        self.last_sent = 0.0
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def claim_trade(self, ticker, time_frame, tv_time):
+        # One find-and-modify creates the trade row; only the call that inserted it gets
+        # None back, so exactly one caller enqueues the alert for a new trade. Two upserts
+        # racing on a new trade both miss the find; the unique ticker_time_frame_tv_time
+        # index rejects the second insert.
+        try:
+            with MongoConnection() as mongo_conn:
+                before = mongo_conn.trades_collection.find_one_and_update(
+                    trade_criteria(ticker, time_frame, tv_time),
+                    {"$setOnInsert": {"Trade": "Buy", "Message": 0}},
+                    projection={"Message": 1},
+                    upsert=True
+                )
+        except DuplicateKeyError:
+            # Claimed by the other upsert
+            return False
+        if before is None:
+            self.enqueue(ticker, time_frame, tv_time)
+            return True
+        return False
+
+    def enqueue(self, ticker, time_frame, tv_time):
+        key = (ticker, time_frame, tv_time)
+        with self.lock:
+            if key in self.queued:
+                return False
+            self.queued.add(key)
+        self.queue.put(key)
+        return True
+
+    def recover_pending(self, tickers=None):
+        # Trades whose alert was never delivered, e.g. the process died before sending.
+        # With sharding each worker only recovers the tickers it holds.
+        query = {"Message": 0}
+        if tickers is not None:
+            query["Ticker"] = {"$in": list(tickers)}
+        with MongoConnection() as mongo_conn:
+            pending = list(mongo_conn.trades_collection.find(query, projection={"Ticker": 1, "Time Frame": 1, "TV Time": 1}))
+        requeued = sum(1 for trade in pending if self.enqueue(trade["Ticker"], trade["Time Frame"], trade["TV Time"]))
+        if requeued:
+            logger.warning(f"Re-queued {requeued} undelivered trade alerts")
+        return requeued
+
+    def start(self, get_recover_tickers=None):
+        if self.thread and self.thread.is_alive():
+            return
+        self.get_recover_tickers = get_recover_tickers
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="telegram-outbox", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=30):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=1)]
+        except queue.Empty:
+            return []
+        length = len(trade_message(*batch[0]))
+        while len(batch) < self.batch_size:
+            try:
+                key = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            length += len(trade_message(*key)) + 1
+            if length > TELEGRAM_MAX_MESSAGE_LENGTH:
+                self.queue.put(key)
+                break
+            batch.append(key)
+        return batch
+
+    def recover_if_due(self, next_recover):
+        # Runs on the outbox thread, so it never races deliver() over a batch being sent
+        if self.recover_interval <= 0 or self.stopping.is_set() or time.monotonic() < next_recover:
+            return next_recover
+        try:
+            self.recover_pending(self.get_recover_tickers() if self.get_recover_tickers else None)
+        except Exception as e:
+            logger.error(f"Failed to re-queue undelivered trade alerts: {e}")
+        return time.monotonic() + self.recover_interval
+
+    def run(self):
+        next_recover = time.monotonic() + self.recover_interval
+        while not (self.stopping.is_set() and self.queue.empty()):
+            next_recover = self.recover_if_due(next_recover)
+            batch = self.next_batch()
+            if batch:
+                self.deliver(batch)
+
+    def deliver(self, batch):
+        message = "\n".join(trade_message(*key) for key in batch)
+        for attempt in range(1, self.max_retries + 1):
+            wait = self.min_interval - (time.monotonic() - self.last_sent)
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                self.send(message)
+                telegram_sends.inc(result="ok")
+                self.last_sent = time.monotonic()
+                self.mark_sent(batch)
+                logger.info(f"Sent {len(batch)} trade alerts to Telegram")
+                return True
+            except Exception as e:
+                telegram_sends.inc(result="error")
+                self.last_sent = time.monotonic()
+                retry_after = e.retry_after if isinstance(e, TelegramError) and e.retry_after else 2 ** attempt
+                logger.error(f"Failed to send Telegram message (attempt {attempt}/{self.max_retries}). Error: {e}")
+                if attempt < self.max_retries:
+                    time.sleep(retry_after)
+        # Leave Message at 0 so the next recover_pending() picks these up again
+        with self.lock:
+            self.queued.difference_update(batch)
+        logger.error(f"Giving up on {len(batch)} trade alerts: {batch}")
+        return False
+
+    def mark_sent(self, batch):
+        try:
+            with MongoConnection() as mongo_conn:
+                mongo_conn.trades_collection.update_many(
+                    {"$or": [trade_criteria(*key) for key in batch]},
+                    {"$set": {"Message": 1}}
+                )
+        except Exception as e:
+            logger.error(f"Sent trade alerts but failed to mark them in trades: {e}")
+        with self.lock:
+            self.queued.difference_update(batch)
+
+outbox = TelegramOutbox()
@@ -0,0 +1,108 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from services.db_conn import MongoConnection
+from services.stage_state import stage_states
+from services.read_model import read_model
+from services.migrate_tv_time import ui_datetime_fields
+
+logger = logging.getLogger('mainLogger')
+
+UI_WRITE_FLUSH_THRESHOLD = int(os.getenv("UI_WRITE_FLUSH_THRESHOLD", 500))
+
+class UIWriteBuffer:
+    def __init__(self, flush_threshold=UI_WRITE_FLUSH_THRESHOLD):
+        self.flush_threshold = flush_threshold
+        self.pending = {}  # (ticker, time_frame) -> merged $set fields
+        self.errors = {}   # (ticker, time_frame) -> last flush error for that key
+        self.lock = threading.RLock()
+        # Held across a whole flush so batches reach Mongo in the order they were taken;
+        # add() only needs self.lock and never waits on a bulk write
+        self.flush_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, ticker, time_frame, update_data):
+        with self.lock:
+            # Later calls in the same job win for fields they set
+            self.pending.setdefault((ticker, time_frame), {}).update(update_data)
+            full = len(self.pending) >= self.flush_threshold
+        if full:
+            logger.info("UI write buffer reached %s keys, flushing", self.flush_threshold)
+            self.flush()
+
+    def flush(self, keys=None):
+        with self.flush_lock:
+            with self.lock:
+                if keys is None:
+                    batch = self.pending
+                    self.pending = {}
+                else:
+                    batch = {key: self.pending.pop(key) for key in keys if key in self.pending}
+            if not batch:
+                return {}
+            return self._write(batch)
+
+    def _write(self, batch):
+        batch_keys = list(batch.keys())
+        operations = [
+            UpdateOne({"ticker": ticker, "time_frame": time_frame}, {"$set": batch[(ticker, time_frame)]}, upsert=True)
+            for ticker, time_frame in batch_keys
+        ]
+        errors = {}
+        try:
+            with MongoConnection() as mongo_conn:
+                result = mongo_conn.ui_collection.bulk_write(operations, ordered=False)
+            logger.info("Flushed %s UI updates (matched %s, upserted %s)", len(operations), result.matched_count, result.upserted_count)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                errors[batch_keys[write_error["index"]]] = write_error.get("errmsg")
+            for write_concern_error in e.details.get("writeConcernErrors", []):
+                logger.error(f"UI bulk write concern error: {write_concern_error}")
+        except Exception as e:
+            errors = {key: str(e) for key in batch_keys}
+
+        for (ticker, time_frame), error in errors.items():
+            logger.error(f"Failed to update UI collection for {ticker}-{time_frame}: {error}")
+        with self.lock:
+            self.errors.update(errors)
+        return errors
+
+_active_buffer = None
+
+def get_active_buffer():
+    return _active_buffer
+
+def write_update(ticker, time_frame, update_data):
+    # Every user_interface $set goes through here: string times get their BSON datetime
+    # siblings, the stage state table and dashboard snapshot are updated, then the write is
+    # merged into the open job buffer or sent directly.
+    update_data = dict(update_data, **ui_datetime_fields(update_data))
+    stage_states.apply(ticker, time_frame, update_data)
+    read_model.apply(ticker, time_frame, update_data)
+    buffer = _active_buffer
+    if buffer is not None:
+        buffer.add(ticker, time_frame, update_data)
+        return
+    with MongoConnection() as mongo_conn:
+        mongo_conn.ui_collection.update_one(
+            {"ticker": ticker, "time_frame": time_frame},
+            {"$set": update_data},
+            upsert=True
+        )
+
+@contextmanager
+def buffered_ui_writes(flush_threshold=UI_WRITE_FLUSH_THRESHOLD):
+    global _active_buffer
+    buffer = UIWriteBuffer(flush_threshold)
+    previous = _active_buffer
+    _active_buffer = buffer
+    try:
+        yield buffer
+    finally:
+        _active_buffer = previous
+        buffer.flush()
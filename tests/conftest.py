@@ -0,0 +1,20 @@
+import os
+import sys
+import mongomock
+import pytest
+
+# Tests import main and services.* from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import db_conn
+from services.db_conn import MongoConnection, setup_mongodb
+
+@pytest.fixture
+def mongo(monkeypatch):
+    # A fresh in-process database with the production indexes, used through MongoConnection
+    db_conn.use_client(mongomock.MongoClient())
+    monkeypatch.setattr(MongoConnection, "DB_NAME", "tvstrats_test")
+    setup_mongodb()
+    with MongoConnection() as mongo_conn:
+        yield mongo_conn
+    db_conn.use_client(None)
@@ -0,0 +1,36 @@
+import os
+from datetime import datetime, timedelta
+import numpy as np
+from services import bar_archive
+from services.bars import TV_DATETIME_FIELD
+
+START = datetime(2024, 1, 1)
+
+def docs(ticker, count, money_flow="1"):
+    return [{"ticker": ticker, "Time Frame": "15", TV_DATETIME_FIELD: START + timedelta(minutes=15 * i), "Mny Flow": money_flow}
+            for i in range(count)]
+
+def money_flows(ticker, archive_dir):
+    return [doc["Mny Flow"] for doc in bar_archive.load_docs(ticker, "15", archive_dir=archive_dir)]
+
+def test_rearchived_bars_keep_the_newer_copy(tmp_path):
+    bar_archive.write_docs("BTCUSDT", "15", docs("BTCUSDT", 4), str(tmp_path))
+    bar_archive.write_docs("BTCUSDT", "15", docs("BTCUSDT", 2, money_flow="2"), str(tmp_path))
+    assert money_flows("BTCUSDT", str(tmp_path)) == ["2", "2", "1", "1"]
+
+def test_pairs_sharing_a_directory_are_kept_apart(tmp_path):
+    # Both names map onto the same directory
+    assert bar_archive.pair_dir("BTC/USDT", "15") == bar_archive.pair_dir("BTC_USDT", "15")
+    bar_archive.write_docs("BTC/USDT", "15", docs("BTC/USDT", 3, money_flow="1"), str(tmp_path))
+    bar_archive.write_docs("BTC_USDT", "15", docs("BTC_USDT", 3, money_flow="2"), str(tmp_path))
+    assert money_flows("BTC/USDT", str(tmp_path)) == ["1", "1", "1"]
+    assert money_flows("BTC_USDT", str(tmp_path)) == ["2", "2", "2"]
+
+def test_partitions_without_pair_columns_are_deduplicated(tmp_path):
+    path = bar_archive.partition_path("BTCUSDT", "15", "2024-01", str(tmp_path))
+    os.makedirs(os.path.dirname(path))
+    times = np.array([START + timedelta(minutes=15 * i) for i in range(3)], dtype="datetime64[ms]")
+    # As written before the pair was kept in the file
+    np.savez_compressed(path, **{TV_DATETIME_FIELD: times, "Mny Flow": np.array(["1", "1", "1"])})
+    bar_archive.write_docs("BTCUSDT", "15", docs("BTCUSDT", 2, money_flow="2"), str(tmp_path))
+    assert money_flows("BTCUSDT", str(tmp_path)) == ["2", "2", "1"]
@@ -0,0 +1,45 @@
+import threading
+from datetime import datetime, timedelta
+from services import bars
+from services.bar_cache import BarCache
+
+START = datetime(2024, 1, 1)
+
+def bar(minute, money_flow="1.00", time_frame="1"):
+    time = START + timedelta(minutes=minute)
+    return {"ticker": "BTCUSDT", "Time Frame": time_frame, "TV Time": time.strftime(bars.TV_TIME_FORMAT),
+            "TV Datetime": time, "Mny Flow": money_flow, "Buy": "0",
+            "Blue Wave Crossing UP": "null", "Blue Wave Crossing Down": "null"}
+
+def from_mongo(collection):
+    return list(bars.find_bars(collection, "BTCUSDT", "1"))
+
+def test_refresh_picks_up_rewritten_and_late_bars(mongo):
+    cache = BarCache(size=50, overlap_seconds=300)
+    mongo.collection.insert_many([bar(minute) for minute in range(10) if minute != 7])
+    cache.new_cycle()
+    assert cache.find_bars(mongo.collection, "BTCUSDT", "1") == from_mongo(mongo.collection)
+
+    # The newest bar is rewritten, a bar arrives late behind it, and a new one lands on top
+    mongo.collection.update_one({"TV Datetime": START + timedelta(minutes=9)}, {"$set": {"Mny Flow": "-5.00"}})
+    mongo.collection.insert_many([bar(7), bar(10)])
+    cache.new_cycle()
+    cached = cache.find_bars(mongo.collection, "BTCUSDT", "1")
+    assert cached == from_mongo(mongo.collection)
+    assert len(cached) == 11 and cached[9].money_flow == -5.0
+
+def test_hits_and_misses_count_every_lookup(mongo):
+    cache = BarCache(size=50)
+    mongo.collection.insert_many([bar(minute, time_frame=time_frame) for minute in range(10) for time_frame in ("1", "5")])
+    cache.new_cycle()
+
+    def lookups(time_frame):
+        for _ in range(500):
+            cache.find_bar(mongo.collection, "BTCUSDT", time_frame)
+            cache.find_bars(mongo.collection, "BTCUSDT", time_frame, extra={"Mny Flow": "1.00"})
+    threads = [threading.Thread(target=lookups, args=(time_frame,)) for time_frame in ("1", "5") * 2]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (cache.hits, cache.misses) == (2000, 2000)
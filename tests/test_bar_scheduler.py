@@ -0,0 +1,48 @@
+import os
+from datetime import datetime, timedelta, timezone
+from services.bar_scheduler import BarCloseScheduler, last_close, next_close, time_frame_minutes
+from services.pair_registry import parse_pairs
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config")
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+def test_time_frame_minutes():
+    assert time_frame_minutes("15") == 15
+    assert time_frame_minutes("D") == 1440
+    assert time_frame_minutes("3D") == 4320
+    assert time_frame_minutes("W") == 10080
+
+def test_day_and_week_closes():
+    at = utc(2024, 5, 15, 13, 7)  # a Wednesday
+    assert last_close("D", at) == utc(2024, 5, 15)
+    assert next_close("D", at) == utc(2024, 5, 16)
+    assert last_close("W", at) == utc(2024, 5, 13)  # Monday
+    assert next_close("W", at) == utc(2024, 5, 20)
+    three_days = last_close("3D", at)
+    assert three_days <= at < three_days + timedelta(days=3)
+    assert three_days.hour == 0 and three_days.minute == 0
+
+def test_session_offset_grid():
+    at = utc(2024, 5, 15, 14, 10)
+    assert last_close("60", at, 30) == utc(2024, 5, 15, 13, 30)
+    assert next_close("60", at, 30) == utc(2024, 5, 15, 14, 30)
+    assert next_close("60", utc(2024, 5, 15, 23, 40), 30) == utc(2024, 5, 16, 0, 30)
+    assert next_close("77", utc(2024, 5, 15, 23, 50)) == utc(2024, 5, 16)
+
+def test_scheduler_runs_every_configured_pair():
+    pairs = list(parse_pairs(os.path.join(CONFIG_DIR, "tickers.txt")))
+    batches = []
+    scheduler = BarCloseScheduler(lambda: pairs, lambda batch: batches.append((now, batch)), grace_seconds=30)
+    now = utc(2024, 5, 12, 23, 59)  # Sunday, so the weekly close is inside the window
+    end = now + timedelta(days=2)
+    while now < end:
+        delay = scheduler.run_once(now)
+        now += timedelta(seconds=max(delay, 1))
+    ran = {pair for _, batch in batches for pair in batch}
+    assert ran == set(pairs)
+    spy_hourly = [at for at, batch in batches if ("SPY", "60") in batch]
+    assert spy_hourly and all(at.minute == 30 for at in spy_hourly)
+    btc_hourly = [at for at, batch in batches if ("BTCUSDT", "60") in batch]
+    assert btc_hourly and all(at.minute == 0 for at in btc_hourly)
@@ -0,0 +1,74 @@
+from datetime import datetime
+import pytest
+from services import get_dots
+from services.get_dots import get_and_store_dot_data
+
+PAIRS = [("BTCUSDT", "15"), ("ETHUSDT", "15"), ("SOLUSDT", "60")]
+
+def bar(ticker, tv_time, money_flow, up="null", down="null", time_frame="15"):
+    return {"ticker": ticker, "Time Frame": time_frame, "TV Time": tv_time, "Mny Flow": money_flow,
+            "TV Datetime": datetime.strptime(tv_time, "%Y-%m-%dT%H:%M:%SZ"),
+            "Blue Wave Crossing UP": up, "Blue Wave Crossing Down": down}
+
+@pytest.fixture(autouse=True)
+def fresh_scan_state(monkeypatch):
+    monkeypatch.setattr(get_dots, "_latest_bars", {})
+    monkeypatch.setattr(get_dots, "_latest_dots", {})
+
+def scan(batched):
+    return {(row["ticker"], row["time_frame"]): row for row in get_and_store_dot_data(PAIRS, batched=batched)}
+
+def test_batched_scan_matches_per_pair_lookups_across_cycles(mongo):
+    mongo.collection.insert_many([
+        bar("BTCUSDT", "2024-01-01T00:00:00Z", "1", up="5"),
+        bar("BTCUSDT", "2024-01-01T00:15:00Z", "2"),
+        bar("ETHUSDT", "2024-01-01T00:00:00Z", "3"),
+    ])
+    assert scan(True) == scan(False)
+    assert scan(True)[("BTCUSDT", "15")]["is_green_dot"] == "TRUE"
+    # Stored as the alert sent it
+    assert scan(True)[("BTCUSDT", "15")]["money_flow"] == "2"
+
+    # New bars after the first scan: a red dot, a plain bar, and a pair's first bar
+    mongo.collection.insert_many([
+        bar("BTCUSDT", "2024-01-01T00:30:00Z", "4", down="7"),
+        bar("ETHUSDT", "2024-01-01T00:15:00Z", "6"),
+        bar("SOLUSDT", "2024-01-01T01:00:00Z", "8", up="1", time_frame="60"),
+    ])
+    # The latest bar rewritten in place
+    mongo.collection.update_one({"ticker": "ETHUSDT", "TV Time": "2024-01-01T00:15:00Z"}, {"$set": {"Mny Flow": "9"}})
+    rows = scan(True)
+    assert rows == scan(False)
+    assert rows[("BTCUSDT", "15")]["is_red_dot"] == "TRUE"
+    assert rows[("ETHUSDT", "15")]["money_flow"] == "9"
+    assert rows[("SOLUSDT", "60")]["is_green_dot"] == "TRUE"
+
+def test_later_scans_only_read_new_bars(mongo):
+    mongo.collection.insert_many([bar("BTCUSDT", f"2024-01-01T{hour:02d}:00:00Z", str(hour)) for hour in range(24)])
+    scan(True)
+    # Everything but each pair's latest bar is out of reach of the next scan
+    assert len(list(mongo.collection.find(get_dots.bars_since_query(PAIRS)))) == 1
+
+def test_new_pairs_are_seeded_by_the_chunk_query(mongo, monkeypatch):
+    mongo.collection.insert_many([bar("BTCUSDT", "2024-01-01T00:00:00Z", "1", up="5"), bar("BTCUSDT", "2024-01-01T00:15:00Z", "2"),
+                                  bar("ETHUSDT", "2024-01-01T00:00:00Z", "3", down="4")])
+    # Wide enough to reach back to 2024
+    monkeypatch.setattr(get_dots, "DOT_SCAN_SEED_BARS", 10 ** 6)
+    lookups = []
+    monkeypatch.setattr(get_dots, "find_bar", lambda *args, **kwargs: lookups.append(args[1:3]))
+    rows = {(row["ticker"], row["time_frame"]): row for row in get_and_store_dot_data(PAIRS[:2], batched=True)}
+    assert lookups == []
+    assert rows[("BTCUSDT", "15")]["is_green_dot"] == "TRUE" and rows[("BTCUSDT", "15")]["money_flow"] == "2"
+    assert rows[("ETHUSDT", "15")]["is_red_dot"] == "TRUE"
+
+    # A pair with nothing in the window falls back to the per-pair lookups, once
+    get_and_store_dot_data(PAIRS, batched=True)
+    assert lookups == [("SOLUSDT", "60"), ("SOLUSDT", "60")]
+    get_and_store_dot_data(PAIRS, batched=True)
+    assert len(lookups) == 2
+
+def test_pairs_dropped_from_the_list_are_forgotten(mongo):
+    mongo.collection.insert_many([bar(ticker, "2024-01-01T00:00:00Z", "1") for ticker, _ in PAIRS[:2]])
+    get_and_store_dot_data(PAIRS, batched=True)
+    get_and_store_dot_data(PAIRS[:1], batched=True)
+    assert set(get_dots._latest_bars) == set(get_dots._latest_dots) == {PAIRS[0]}
@@ -0,0 +1,61 @@
+import configparser
+import io
+import logging
+import os
+import pytest
+from services import pair_logging
+
+@pytest.fixture
+def main_logger(monkeypatch):
+    log = logging.getLogger("mainLogger")
+    handler = logging.StreamHandler()
+    monkeypatch.setattr(logging.getLogger(), "handlers", [])
+    monkeypatch.setattr(log, "handlers", [handler])
+    level = log.level
+    # setLevel, not setattr: it also clears the logger's cached isEnabledFor answers
+    log.setLevel(logging.INFO)
+    monkeypatch.setattr(pair_logging, "LOG_ASYNC", False)
+    monkeypatch.setattr(pair_logging, "_listeners", [])
+    monkeypatch.setattr(pair_logging, "_ring", None)
+    yield log
+    pair_logging.shutdown()
+    log.setLevel(level)
+
+def ring_records(log):
+    with pair_logging.pair_context("BTCUSDT", "15"):
+        log.debug("debug")
+        log.info("info")
+    return [record.getMessage() for record in pair_logging._ring.take(("BTCUSDT", "15"))]
+
+def test_ring_defaults_to_the_loggers_level(main_logger):
+    pair_logging.install()
+    assert main_logger.level == logging.INFO
+    assert ring_records(main_logger) == ["info"]
+
+def test_a_lower_ring_level_does_not_lower_the_logger(main_logger, monkeypatch):
+    monkeypatch.setattr(pair_logging, "LOG_PAIR_BUFFER_LEVEL", "DEBUG")
+    pair_logging.install()
+    assert main_logger.level == logging.INFO
+    assert ring_records(main_logger) == ["info"]
+
+def test_shipped_config_feeds_the_ring_without_changing_the_output():
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.path.dirname(__file__), "..", "config", "logging_config.ini"))
+    assert config["logger_mainLogger"]["level"] == "DEBUG"
+    assert config["handler_consoleHandler"]["level"] == "WARN"
+
+def test_debug_records_of_a_failing_pair_are_dumped(main_logger, monkeypatch):
+    # What logging_config.ini sets up: mainLogger at DEBUG, its output handler at WARN
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setLevel(logging.WARNING)
+    monkeypatch.setattr(main_logger, "handlers", [handler])
+    main_logger.setLevel(logging.DEBUG)
+    pair_logging.install()
+
+    with pair_logging.pair_context("BTCUSDT", "15"):
+        main_logger.debug("scanned 12 bars after the red dot")
+    assert stream.getvalue() == ""
+    pair_logging.dump_pair("BTCUSDT", "15")
+    assert "Last 1 log records for BTCUSDT-15" in stream.getvalue()
+    assert "scanned 12 bars after the red dot" in stream.getvalue()
@@ -0,0 +1,21 @@
+import os
+from services.pair_registry import parse_pairs
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config")
+
+def _pair_lines(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+def test_real_config_files_keep_every_pair():
+    for name in ("tickers.txt", "dot_tickers.txt"):
+        path = os.path.join(CONFIG_DIR, name)
+        pairs = parse_pairs(path)
+        assert len(pairs) == len(_pair_lines(path)) == 231
+        time_frames = {time_frame for _, time_frame in pairs}
+        assert {"D", "3D", "W"} <= time_frames
+
+def test_malformed_lines_and_duplicates_are_skipped(tmp_path):
+    path = tmp_path / "tickers.txt"
+    path.write_text("BTCUSDT, 15\n# comment\n\nBTCUSDT, 15\nETHUSDT\nETHUSDT, D  # daily\nSPY, 3D\nSPY, 15m\n, 60\n")
+    assert parse_pairs(str(path)) == (("BTCUSDT", "15"), ("ETHUSDT", "D"), ("SPY", "3D"))
@@ -0,0 +1,32 @@
+from datetime import datetime
+from services import price_refresher
+from services.price_refresher import PriceRefresher, fetch_latest_prices
+
+def bar(ticker, tv_time, close, time_frame="15", typed=True):
+    doc = {"ticker": ticker, "Time Frame": time_frame, "TV Time": tv_time, "close": close}
+    if typed:
+        doc["TV Datetime"] = datetime.strptime(tv_time, "%Y-%m-%dT%H:%M:%SZ")
+    return doc
+
+def test_latest_price_per_ticker(mongo):
+    mongo.collection.insert_many([
+        bar("BTCUSDT", "2024-01-01T00:00:00Z", "1"),
+        bar("BTCUSDT", "2024-01-01T00:15:00Z", "2"),
+        bar("BTCUSDT", "2024-01-01T00:30:00Z", "9", time_frame="30"),
+        bar("ETHUSDT", "2024-01-01T00:15:00Z", "5"),
+        bar("ETHUSDT", "2024-01-01T00:00:00Z", "4"),
+    ])
+    assert fetch_latest_prices({"BTCUSDT", "ETHUSDT", "SOLUSDT"}) == {"BTCUSDT": 2.0, "ETHUSDT": 5.0}
+
+def test_refresher_sees_bars_written_since_the_last_backfill(mongo, monkeypatch):
+    mongo.collection.insert_many([
+        bar("BTCUSDT", "2024-01-01T00:00:00Z", "1"),
+        bar("BTCUSDT", "2024-01-01T00:15:00Z", "2", typed=False),
+    ])
+    written = {}
+    monkeypatch.setattr(price_refresher, "write_prices", lambda prices, pairs: written.update(prices))
+    refresher = PriceRefresher(lambda: [("BTCUSDT", "15")])
+    # One pass of the loop
+    monkeypatch.setattr(refresher.stopping, "wait", lambda timeout: refresher.stopping.set())
+    refresher.run()
+    assert written == {"BTCUSDT": 2.0}
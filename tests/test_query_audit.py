@@ -0,0 +1,31 @@
+import os
+from argparse import Namespace
+import pytest
+from pymongo import MongoClient
+from services import benchmark, db_conn, query_audit
+from services.db_conn import MongoConnection
+
+# The explain rules need a real server; mongomock has no query planner
+AUDIT_MONGO_URI = os.getenv("QUERY_AUDIT_MONGO_URI")
+
+def test_every_shape_builds_from_sample_values(mongo):
+    pairs = benchmark.generate_pairs(3, ["15", "60"])
+    benchmark.seed_market_data(pairs, 50, 0.5, 1)
+    sample = query_audit.sample_values(mongo.db, pair_count=10)
+    for shape in query_audit.QUERY_SHAPES:
+        command = shape.command(sample)
+        assert next(iter(command)) in ("find", "aggregate", "update", "findAndModify"), shape.name
+        assert command[next(iter(command))] == shape.collection, shape.name
+
+@pytest.mark.skipif(not AUDIT_MONGO_URI, reason="set QUERY_AUDIT_MONGO_URI to a disposable mongod to run the explain audit")
+def test_every_shape_passes_the_audit(monkeypatch):
+    db_conn.use_client(MongoClient(AUDIT_MONGO_URI))
+    monkeypatch.setattr(MongoConnection, "DB_NAME", query_audit.AUDIT_DB_NAME)
+    try:
+        query_audit.seed(Namespace(db=query_audit.AUDIT_DB_NAME, tickers=10, time_frames="15,60", bars=1000, seed=1))
+        with MongoConnection() as mongo_conn:
+            results = query_audit.audit(mongo_conn.db)
+        assert {result["name"]: result["failures"] for result in results if result["failures"]} == {}
+    finally:
+        db_conn.close_client()
+        db_conn.use_client(None)
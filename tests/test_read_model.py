@@ -0,0 +1,28 @@
+import threading
+from services import read_model as read_model_module
+from services.read_model import ReadModel
+
+def test_a_slow_older_snapshot_does_not_replace_a_newer_one(monkeypatch):
+    model = ReadModel()
+    model.loaded = True
+    model.apply("BTCUSDT", "15", {"stage": 1})
+
+    dumps = read_model_module._dumps
+    serializing, release = threading.Event(), threading.Event()
+
+    def slow_first_dumps(value):
+        if value["version"] == 1:
+            serializing.set()
+            release.wait(5)
+        return dumps(value)
+    monkeypatch.setattr(read_model_module, "_dumps", slow_first_dumps)
+
+    old = threading.Thread(target=model.snapshot)
+    old.start()
+    assert serializing.wait(5)
+    model.apply("BTCUSDT", "15", {"stage": 2})
+    assert model.snapshot()[0] == 2
+    release.set()
+    old.join(5)
+    assert model.body[0] == 2
+    assert model.snapshot() is model.body
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+import pytest
+from services import bar_archive
+from services.retention import RetentionRunner
+from services.stage_state import stage_states
+
+PAIRS = [("BTCUSDT", "15"), ("ETHUSDT", "15")]
+START = datetime(2024, 1, 1)
+
+def bars(ticker, count):
+    return [{"ticker": ticker, "Time Frame": "15", "TV Time": (START + timedelta(minutes=15 * i)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+             "TV Datetime": START + timedelta(minutes=15 * i), "Mny Flow": str(i)} for i in range(count)]
+
+@pytest.fixture(autouse=True)
+def empty_archive(monkeypatch, tmp_path):
+    monkeypatch.setattr(bar_archive, "ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(stage_states, "states", {})
+    monkeypatch.setattr(stage_states, "loaded", False)
+
+def live_count(mongo, ticker):
+    return mongo.collection.count_documents({"ticker": ticker})
+
+def test_capped_passes_resume_where_the_last_one_stopped(mongo):
+    mongo.collection.insert_many(bars("BTCUSDT", 30) + bars("ETHUSDT", 30))
+    runner = RetentionRunner(lambda: PAIRS, max_bars=20)
+
+    assert runner.run_once()
+    assert (live_count(mongo, "BTCUSDT"), live_count(mongo, "ETHUSDT")) == (10, 30)
+    assert runner.resume_pair == ("BTCUSDT", "15")
+
+    assert runner.run_once()
+    assert (live_count(mongo, "BTCUSDT"), live_count(mongo, "ETHUSDT")) == (0, 20)
+    assert runner.resume_pair == ("ETHUSDT", "15")
+
+    runner.run_once()
+    assert not runner.run_once()
+    assert runner.resume_pair is None
+    assert live_count(mongo, "ETHUSDT") == 0
+    for ticker, time_frame in PAIRS:
+        assert [bar.money_flow_text for bar in bar_archive.load_bars(ticker, time_frame)] == [str(i) for i in range(30)]
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+from services import sharding
+from services.sharding import ShardCoordinator
+
+TICKERS = {f"SYN{i:02d}USDT" for i in range(20)}
+PAIRS = [(ticker, "15") for ticker in sorted(TICKERS)]
+LEASE_SECONDS = 60
+
+class Clock:
+    # Drives both the lease times in Mongo and the monotonic renewal check
+    def __init__(self):
+        self.seconds = 0.0
+
+    def advance(self, seconds):
+        self.seconds += seconds
+
+    def utcnow(self):
+        return datetime(2024, 1, 1) + timedelta(seconds=self.seconds)
+
+    def monotonic(self):
+        return self.seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sharding, "datetime", SimpleNamespace(utcnow=clock.utcnow))
+    monkeypatch.setattr(sharding, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+def coordinator(worker_id):
+    worker = ShardCoordinator(worker_id, enabled=True, heartbeat_seconds=10, lease_seconds=LEASE_SECONDS)
+    worker.get_tickers = lambda: TICKERS
+    worker.acquired = []
+    worker.add_acquire_listener(worker.acquired.append)
+    return worker
+
+def beat(clock, *workers):
+    clock.advance(10)
+    for worker in workers:
+        worker.heartbeat()
+
+def test_two_workers_split_the_tickers(mongo, clock):
+    a, b = coordinator("a"), coordinator("b")
+    beat(clock, a, b)
+    # b joined while a held everything, so it gets its share once a lets go
+    assert a.held == TICKERS and b.held == frozenset()
+    beat(clock, a, b)
+    assert a.held and b.held
+    assert a.held | b.held == TICKERS and not a.held & b.held
+    assert a.held == {ticker for ticker in TICKERS if sharding.owner_of(ticker, ["a", "b"]) == "a"}
+
+def test_tickers_are_not_released_while_a_job_runs(mongo, clock):
+    a, b = coordinator("a"), coordinator("b")
+    beat(clock, a)
+    with a.job():
+        beat(clock, b, a, b)
+        assert a.held == TICKERS and b.held == frozenset()
+        assert len(a.filter(PAIRS)) == len(PAIRS)
+    beat(clock, a, b)
+    assert a.held | b.held == TICKERS and not a.held & b.held and b.held
+
+def test_a_worker_that_stops_renewing_is_taken_over(mongo, clock):
+    a, b = coordinator("a"), coordinator("b")
+    beat(clock, a, b)
+    beat(clock, a, b)
+    a_share = set(a.held)
+
+    # a's heartbeats fail from here on; before its leases run out b must not take them
+    beat(clock, b)
+    assert b.held.isdisjoint(a_share)
+    # Past half a lease without a renewal a stops processing its pairs
+    clock.advance(LEASE_SECONDS / 2)
+    assert a.filter(PAIRS) == []
+    for _ in range(4):
+        beat(clock, b)
+    assert b.held == TICKERS
+    assert set(b.acquired[-1]) == a_share
+
+    # a comes back: it finds its leases gone and only gets its share back once b releases it
+    beat(clock, a)
+    assert a.held == frozenset() and a.filter(PAIRS) == []
+    beat(clock, b, a)
+    assert a.held == a_share and b.held == TICKERS - a_share
+    assert {pair[0] for pair in a.filter(PAIRS)} == a_share
@@ -0,0 +1,91 @@
+import copy
+from datetime import datetime, timedelta
+import pytest
+from services import bars, stage_fused, stage_parity
+from services.db_conn import MongoConnection, setup_mongodb
+from services.stage_state import stage_states
+from services.telegram_outbox import outbox
+
+def buy():
+    return {"Buy": "1"}
+
+def red(value):
+    return {"Blue Wave Crossing Down": f"{value:.2f}"}
+
+def green(value):
+    return {"Blue Wave Crossing UP": f"{value:.2f}"}
+
+# One pair per stage transition; entry i holds the bars the pair gets in cycle i.
+# name -> (scripted cycles, cycle the transition happens in, stage before it, stage after it).
+# A stage 1 record keeps no start time, so 1 -> 2 only happens in the pass that found the Buy.
+SCRIPTS = {
+    "ZERO_TO_ONE": ([[buy()]], 0, 0, 1),
+    "ONE_TO_TWO": ([[buy(), red(10)]], 0, 0, 2),
+    "TWO_TO_ZERO": ([[buy(), red(10)], [red(12)]], 1, 2, 0),
+    "TWO_TO_THREE": ([[buy(), red(10)], [green(-10)]], 1, 2, 3),
+    "THREE_TO_ZERO": ([[buy(), red(10)], [green(-10)], [red(5)]], 2, 3, 0),
+    # The whole pattern in one batch of bars
+    "ZERO_TO_THREE": ([[buy(), red(10), {}, green(-10)]], 0, 0, 3),
+}
+PAIRS = [(f"{name}USDT", "15") for name in SCRIPTS]
+CYCLES = 5
+
+def cycle_bars(cycle, next_time):
+    docs = []
+    for name, (script, _, _, _) in SCRIPTS.items():
+        pair = (f"{name}USDT", "15")
+        # A plain bar every cycle, so scans also resume past bars that change nothing
+        for fields in (script[cycle] if cycle < len(script) else []) + [{}]:
+            doc = {"ticker": pair[0], "Time Frame": "15", "TV Time": next_time[pair].strftime(stage_parity.TV_TIME_FORMAT),
+                   "TV Datetime": next_time[pair], "close": "1.0", "Mny Flow": "0.00", "Buy": "0",
+                   "Blue Wave Crossing UP": "null", "Blue Wave Crossing Down": "null"}
+            doc.update(fields)
+            docs.append(doc)
+            next_time[pair] += timedelta(minutes=15)
+    return docs
+
+def state_snapshot():
+    with stage_states.lock:
+        states = copy.deepcopy(stage_states.states)
+    return {pair: {field: value for field, value in state.items() if field not in stage_parity.IGNORED_UI_FIELDS}
+            for pair, state in states.items()}
+
+@pytest.fixture
+def parity_dbs(mongo, monkeypatch):
+    # run_cycle switches these for each side; monkeypatch puts them back afterwards
+    monkeypatch.setattr(MongoConnection, "DB_NAME", MongoConnection.DB_NAME)
+    monkeypatch.setattr(stage_fused, "STAGE_FUSED_EVALUATOR", stage_fused.STAGE_FUSED_EVALUATOR)
+    monkeypatch.setattr(stage_states, "states", {})
+    monkeypatch.setattr(stage_states, "loaded", False)
+    bars.set_cache(None)
+    claims = {False: [], True: []}
+    monkeypatch.setattr(outbox, "enqueue", lambda *key: claims[stage_fused.STAGE_FUSED_EVALUATOR].append(key))
+    for fused in (False, True):
+        MongoConnection.DB_NAME = stage_parity.PARITY_DB_NAMES[fused]
+        setup_mongodb()
+    return claims
+
+def test_fused_evaluator_matches_the_separate_scans(parity_dbs):
+    claims = parity_dbs
+    next_time = {pair: datetime(2024, 1, 1) for pair in PAIRS}
+    stages = {pair: [] for pair in PAIRS}
+    for cycle in range(CYCLES):
+        new_docs = cycle_bars(cycle, next_time)
+        chained_ui, chained_trades = stage_parity.run_cycle(False, PAIRS, new_docs)
+        chained_states = state_snapshot()
+        fused_ui, fused_trades = stage_parity.run_cycle(True, PAIRS, new_docs)
+        fused_states = state_snapshot()
+
+        assert fused_states == chained_states, f"cycle {cycle}"
+        assert fused_ui == chained_ui, f"cycle {cycle}"
+        assert fused_trades == chained_trades, f"cycle {cycle}"
+        assert claims[True] == claims[False], f"cycle {cycle}"
+        for pair in PAIRS:
+            stages[pair].append(chained_states[pair]["stage"])
+
+    # Every scripted transition actually happened
+    for name, (_, cycle, before, after) in SCRIPTS.items():
+        history = stages[(f"{name}USDT", "15")]
+        assert (history[cycle - 1] if cycle else 0) == before, name
+        assert history[cycle] == after, name
+    assert sorted(key[0] for key in claims[False]) == ["THREE_TO_ZEROUSDT", "TWO_TO_THREEUSDT", "ZERO_TO_THREEUSDT"]
@@ -0,0 +1,42 @@
+import mongomock
+import pytest
+from pymongo.errors import DuplicateKeyError
+from services.telegram_outbox import TelegramOutbox
+
+TRADE = ("BTCUSDT", "15", "2024-01-01T00:15:00Z")
+
+def failing_send(message):
+    raise RuntimeError("telegram down")
+
+def test_a_trade_is_claimed_once(mongo):
+    outbox = TelegramOutbox(send=failing_send)
+    assert outbox.claim_trade(*TRADE) is True
+    assert outbox.claim_trade(*TRADE) is False
+    assert mongo.trades_collection.count_documents({}) == 1
+    with pytest.raises(DuplicateKeyError):
+        mongo.trades_collection.insert_one({"Ticker": TRADE[0], "Time Frame": TRADE[1], "TV Time": TRADE[2]})
+
+def test_losing_a_racing_upsert_counts_as_already_claimed(mongo, monkeypatch):
+    def racing_upsert(*args, **kwargs):
+        raise DuplicateKeyError("E11000 duplicate key error")
+    monkeypatch.setattr(mongomock.collection.Collection, "find_one_and_update", racing_upsert)
+    outbox = TelegramOutbox(send=failing_send)
+    assert outbox.claim_trade(*TRADE) is False
+    assert outbox.queue.empty()
+
+def test_alerts_given_up_on_are_requeued_by_the_timer(mongo):
+    outbox = TelegramOutbox(send=failing_send, min_interval=0, max_retries=1, recover_interval=60)
+    outbox.claim_trade(*TRADE)
+    assert outbox.deliver(outbox.next_batch()) is False
+    assert outbox.queue.empty()
+
+    # Not due yet
+    assert outbox.recover_if_due(float("inf")) == float("inf")
+    assert outbox.queue.empty()
+    # Another worker holds the ticker
+    outbox.get_recover_tickers = lambda: {"ETHUSDT"}
+    outbox.recover_if_due(0)
+    assert outbox.queue.empty()
+    outbox.get_recover_tickers = lambda: {"BTCUSDT"}
+    outbox.recover_if_due(0)
+    assert outbox.next_batch() == [TRADE]
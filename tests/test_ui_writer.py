@@ -0,0 +1,30 @@
+import threading
+import mongomock
+from services.ui_writer import UIWriteBuffer
+
+def test_add_does_not_wait_for_a_flush_in_progress(mongo, monkeypatch):
+    bulk_write = mongomock.collection.Collection.bulk_write
+    writing, release = threading.Event(), threading.Event()
+
+    def slow_bulk_write(self, operations, **kwargs):
+        writing.set()
+        release.wait(5)
+        return bulk_write(self, operations, **kwargs)
+    monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", slow_bulk_write)
+
+    buffer = UIWriteBuffer(flush_threshold=2)
+    flusher = threading.Thread(target=lambda: [buffer.add("BTCUSDT", tf, {"stage": 1}) for tf in ("15", "60")])
+    flusher.start()
+    assert writing.wait(5)
+    # The threshold flush is stuck in bulk_write; other pairs still get buffered meanwhile
+    adder = threading.Thread(target=buffer.add, args=("ETHUSDT", "15", {"stage": 2}))
+    adder.start()
+    adder.join(1)
+    assert not adder.is_alive()
+    assert len(buffer) == 1
+
+    release.set()
+    flusher.join(5)
+    assert buffer.flush() == {}
+    rows = {(row["ticker"], row["time_frame"]): row["stage"] for row in mongo.ui_collection.find()}
+    assert rows == {("BTCUSDT", "15"): 1, ("BTCUSDT", "60"): 1, ("ETHUSDT", "15"): 2}